@@ -0,0 +1,304 @@
+"""
+Django settings for app project shared by every profile.
+
+Generated by 'django-admin startproject' using Django 2.1.5. The dev, prod
+and test modules next to this one build on it; manage.py and wsgi.py pick
+one with the DJANGO_ENV environment variable.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/2.1/topics/settings/
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/2.1/ref/settings/
+"""
+
+import os
+
+# Build paths inside the project like this: os.path.join(BASE_DIR, ...)
+BASE_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/2.1/howto/deployment/checklist/
+
+# SECURITY WARNING: keep the secret key used in production secret!
+# The prod profile reads it from DJANGO_SECRET_KEY instead.
+SECRET_KEY = 'ur4lofcr0dh^i+cce550sdi6ytio$r8&!+=u#qp(dr8bq4#d6m'
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = False
+
+ALLOWED_HOSTS = []
+
+
+# Application definition
+
+INSTALLED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'rest_framework',
+    'rest_framework.authtoken',
+    'core',
+    'user',
+    'recipe',
+
+]
+
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CompressionMiddleware',
+    'core.db_router.ReadYourWritesMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+# URL prefixes of the token-authenticated API and of media files, which
+# need no sessions or CSRF either
+API_PATH_PREFIXES = ('/api/', '/media/')
+# Middleware core.middleware.WebOnlyMiddleware runs for non-API paths only
+WEB_ONLY_MIDDLEWARE = []
+
+ROOT_URLCONF = 'app.urls'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.debug',
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = 'app.wsgi.application'
+# Import views and build caches in wsgi.py before the first request
+WSGI_WARMUP = os.environ.get('WSGI_WARMUP', '1') == '1'
+
+
+# Database
+# https://docs.djangoproject.com/en/2.1/ref/settings/#databases
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'HOST': os.environ.get('DB_HOST'),
+        'NAME': os.environ.get("DB_NAME"),
+        'USER': os.environ.get("DB_USER"),
+        'PASSWORD': os.environ.get("DB_PASS")
+    }
+}
+
+# Read replicas, e.g. DB_REPLICA_HOSTS=replica1,replica2, served by the
+# same credentials as the primary
+DATABASE_REPLICAS = []
+for index, host in enumerate(
+        filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    alias = f'replica_{index + 1}'
+    DATABASES[alias] = dict(
+        DATABASES['default'],
+        HOST=host.strip(),
+        TEST={'MIRROR': 'default'}
+    )
+    DATABASE_REPLICAS.append(alias)
+
+# User data shards, e.g. DB_SHARD_HOSTS=shard1,shard2; each user's tags,
+# ingredients and recipes live on one of them. Replicas of shard_N come
+# from DB_SHARD_N_REPLICA_HOSTS and serve that shard's reads.
+DATABASE_SHARDS = ['default']
+SHARD_REPLICAS = {}
+for index, host in enumerate(
+        filter(None, os.environ.get('DB_SHARD_HOSTS', '').split(','))):
+    alias = f'shard_{index + 2}'
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host.strip())
+    DATABASE_SHARDS.append(alias)
+    SHARD_REPLICAS[alias] = []
+    for replica_index, replica_host in enumerate(filter(None, os.environ.get(
+            f'DB_SHARD_{index + 2}_REPLICA_HOSTS', '').split(','))):
+        replica = f'{alias}_replica_{replica_index + 1}'
+        DATABASES[replica] = dict(
+            DATABASES[alias],
+            HOST=replica_host.strip(),
+            TEST={'MIRROR': alias}
+        )
+        SHARD_REPLICAS[alias].append(replica)
+
+# Seconds a worker may keep using a cached user -> shard mapping
+SHARD_MAP_CACHE_SECONDS = 30
+
+DATABASE_ROUTERS = [
+    'core.sharding.ShardRouter',
+    'core.db_router.ReplicaRouter',
+]
+
+# Reads from a client stay on the primary this long after it writes
+READ_YOUR_WRITES_SECONDS = 5
+# Replicas further behind than this are taken out of rotation
+REPLICA_MAX_LAG_SECONDS = 10
+REPLICA_HEALTH_CHECK_INTERVAL = 5
+REPLICA_EJECT_SECONDS = 30
+
+
+# Password validation
+# https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/2.1/topics/i18n/
+
+LANGUAGE_CODE = 'en-us'
+
+TIME_ZONE = 'UTC'
+
+USE_I18N = True
+
+USE_L10N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/2.1/howto/static-files/
+
+STATIC_URL = '/static/'
+STATIC_ROOT = '/vol/web/static'
+
+MEDIA_URL = '/media/'
+MEDIA_ROOT = '/vol/web/media'
+# Seconds browsers may cache media whose name does not hold its digest, and
+# how media bodies are sent: from Python when unset, by nginx through
+# 'x-accel-redirect' to its internal MEDIA_OFFLOAD_PREFIX location, or by
+# Apache or lighttpd through 'x-sendfile'
+MEDIA_CACHE_SECONDS = 60 * 60
+MEDIA_OFFLOAD = os.environ.get('MEDIA_OFFLOAD') or None
+MEDIA_OFFLOAD_PREFIX = '/protected-media/'
+
+# Uploads are stored once per content digest and shared between recipes,
+# on the local volume or, with MEDIA_STORAGE=s3, in an object store
+DEFAULT_FILE_STORAGE = {
+    'local': 'core.storage.ContentAddressedStorage',
+    's3': 'core.objectstore.ObjectStorage',
+}[os.environ.get('MEDIA_STORAGE', 'local')]
+
+# Object store for media (core.objectstore, needs boto3): bucket, endpoint
+# of S3-compatible stores other than AWS, and region; credentials come from
+# the usual AWS_* variables. Files go up in parts of OBJECT_STORAGE_PART_SIZE
+# bytes sent concurrently by a pool of upload threads, failed uploads are
+# attempted this many times, saved files stay in a local cache of this many
+# bytes, and presigned download URLs stay valid this many seconds
+OBJECT_STORAGE_BUCKET = os.environ.get('OBJECT_STORAGE_BUCKET', '')
+OBJECT_STORAGE_ENDPOINT_URL = os.environ.get('OBJECT_STORAGE_ENDPOINT_URL')
+OBJECT_STORAGE_REGION = os.environ.get('OBJECT_STORAGE_REGION')
+OBJECT_STORAGE_PART_SIZE = 8 * 1024 * 1024
+OBJECT_STORAGE_UPLOAD_THREADS = 4
+OBJECT_STORAGE_UPLOAD_ATTEMPTS = 3
+OBJECT_STORAGE_CACHE_DIR = os.environ.get(
+    'OBJECT_STORAGE_CACHE_DIR', '/vol/web/media-cache'
+)
+OBJECT_STORAGE_CACHE_BYTES = 512 * 1024 * 1024
+OBJECT_STORAGE_URL_SECONDS = 60 * 60
+FILE_UPLOAD_PERMISSIONS = 0o644
+
+# Resumable image uploads: directory of partially received files, seconds
+# an idle upload is kept, largest image, and bytes one user's unfinished
+# uploads may reserve at once
+UPLOAD_SESSION_DIR = os.environ.get('UPLOAD_SESSION_DIR', '/vol/web/uploads')
+UPLOAD_SESSION_SECONDS = 24 * 60 * 60
+UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+UPLOAD_QUOTA_BYTES = 100 * 1024 * 1024
+
+# Uploaded images: most pixels an image's header may declare before it is
+# refused undecoded, and the longest side it is scaled down to when stored
+IMAGE_MAX_PIXELS = 50 * 1000 * 1000
+IMAGE_MAX_SIDE = 2048
+
+AUTH_USER_MODEL = 'core.User'
+
+# Keep per-user recipe stats rollups up to date on every recipe write
+RECIPE_STATS_ROLLUP = os.environ.get('RECIPE_STATS_ROLLUP') == '1'
+
+# Responses smaller than this many bytes are sent uncompressed
+RESPONSE_COMPRESSION_MIN_SIZE = 512
+
+# Rows removed per DELETE statement when deleting users and recipes in bulk
+BULK_DELETE_BATCH_SIZE = int(os.environ.get('BULK_DELETE_BATCH_SIZE', 1000))
+# Delete users from the admin in a background thread after deactivating them
+BULK_DELETE_IN_BACKGROUND = os.environ.get('BULK_DELETE_IN_BACKGROUND') == '1'
+# Days tombstones of deleted objects are kept for delta sync clients; run
+# prune_tombstones regularly, clients with older cursors sync from scratch
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 30))
+
+# Admin change lists show Postgres row estimates above this many rows
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Users whose cookable-recipe indexes each process keeps in memory
+COOKABLE_INDEX_USERS = 128
+
+# MinHash signature length and LSH bands for similar-recipe lookups; with
+# 16 bands of 4 rows, pairs above about 0.5 Jaccard similarity are found
+RECIPE_MINHASH_PERMUTATIONS = 64
+RECIPE_LSH_BANDS = 16
+
+# Seconds a computed shopping list is reused for an unchanged meal plan
+SHOPPING_LIST_CACHE_SECONDS = 300
+
+# Concurrent identical recipe list reads share one computation: whether
+# they do, seconds a waiter waits before computing on its own, and whether
+# processes also share through the cache backend (needs a shared cache)
+REQUEST_COALESCING = True
+REQUEST_COALESCING_TIMEOUT = 5
+REQUEST_COALESCING_SHARED = (
+    os.environ.get('REQUEST_COALESCING_SHARED', '') == '1'
+)
+
+# Most recipes one `?ids=` batch retrieve may ask for
+RECIPE_BATCH_MAX_IDS = 100
+
+# Batch endpoint: most calls per batch, database connections (and so
+# threads) its GETs may use at once, and the API paths it may call
+BATCH_MAX_REQUESTS = 20
+BATCH_DB_CONNECTIONS = int(os.environ.get('BATCH_DB_CONNECTIONS', 4))
+BATCH_ALLOWED_PREFIXES = ('/api/user/', '/api/recipe/')
+
+# Change stream: broker fanning events out to subscribers (LocalBroker
+# within one process, PostgresBroker across processes), events buffered
+# per client before it falls back to a database catch-up, seconds between
+# heartbeats and before a stream ends, the client reconnect delay, and the
+# streams one process serves at once (each holds a worker thread; raise it
+# for gevent workers)
+EVENT_BROKER = os.environ.get('EVENT_BROKER', 'core.events.LocalBroker')
+EVENT_QUEUE_SIZE = 100
+EVENT_HEARTBEAT_SECONDS = 15
+EVENT_STREAM_MAX_SECONDS = 300
+EVENT_RETRY_MILLISECONDS = 5000
+EVENT_MAX_STREAMS = int(os.environ.get('EVENT_MAX_STREAMS', 8))
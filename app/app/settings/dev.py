@@ -0,0 +1,8 @@
+"""
+Django settings for local development.
+
+Used by manage.py when DJANGO_ENV is unset or "dev".
+"""
+from app.settings.base import *  # noqa: F401,F403
+
+DEBUG = True
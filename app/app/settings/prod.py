@@ -0,0 +1,74 @@
+"""
+Django settings for production.
+
+Used when DJANGO_ENV is "prod", and by wsgi.py unless DJANGO_ENV says
+otherwise. Secrets and hosts come from the environment.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from app.settings.base import *  # noqa: F401,F403
+from app.settings.base import DATABASES, TEMPLATES
+
+# With DEBUG on Django keeps every query of a request in memory.
+DEBUG = False
+
+try:
+    SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+except KeyError:
+    raise ImproperlyConfigured('Set DJANGO_SECRET_KEY for the prod profile.')
+
+ALLOWED_HOSTS = [
+    host.strip()
+    for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',')
+    if host.strip()
+]
+
+# Reuse database connections between requests instead of reconnecting.
+CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+for database in DATABASES.values():
+    database['CONN_MAX_AGE'] = CONN_MAX_AGE
+
+# Compile each template once per process.
+TEMPLATES = [dict(
+    TEMPLATES[0],
+    APP_DIRS=False,
+    OPTIONS=dict(TEMPLATES[0]['OPTIONS'], loaders=[
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]),
+)]
+
+# The token-authenticated API needs no sessions, CSRF, messages or frame
+# options; those only run for the admin and other non-API paths.
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CompressionMiddleware',
+    'core.db_router.ReadYourWritesMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'core.middleware.WebOnlyMiddleware',
+]
+WEB_ONLY_MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        'rest_framework.authentication.TokenAuthentication',
+    ),
+    # JSON only: no browsable API and its template rendering
+    'DEFAULT_RENDERER_CLASSES': (
+        'rest_framework.renderers.JSONRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+}
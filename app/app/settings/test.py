@@ -0,0 +1,53 @@
+"""
+Django settings for running the test suite.
+
+Used by `manage.py test` unless DJANGO_SETTINGS_MODULE says otherwise.
+Tests run on in-memory SQLite by default, so no database server is
+needed; set TEST_DATABASE=postgres to run them on the Postgres from the
+environment and add --keepdb to reuse its test databases between runs.
+"""
+import os
+import tempfile
+
+from app.settings.base import *  # noqa: F401,F403
+
+if os.environ.get('TEST_DATABASE') == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'HOST': os.environ.get('DB_HOST'),
+            'NAME': os.environ.get('DB_NAME'),
+            'USER': os.environ.get('DB_USER'),
+            'PASSWORD': os.environ.get('DB_PASS'),
+        }
+    }
+    DATABASES['shard_2'] = dict(
+        DATABASES['default'],
+        TEST={'NAME': f"test_{DATABASES['default']['NAME']}_shard_2"}
+    )
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        },
+        'shard_2': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        },
+    }
+
+# A second shard exercises cross-shard code; new users stay on default.
+DATABASE_SHARDS = ['default']
+DATABASE_REPLICAS = []
+SHARD_REPLICAS = {}
+
+# Hashing with MD5 makes every create_user and login nearly free.
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+# Uploads stay in process memory, so parallel test processes never share
+# or remove each other's files.
+DEFAULT_FILE_STORAGE = 'core.storage.InMemoryStorage'
+UPLOAD_SESSION_DIR = tempfile.mkdtemp(prefix='recipe-uploads-')
+
+TEST_RUNNER = 'core.test_runner.TimedTestRunner'
@@ -15,11 +15,19 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf.urls.static import static
 from django.conf import settings
 
+from core import media
+from core.db_router import pin_exempt
+from core.views import BatchView, CoalescingStatsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/user/", include("user.urls")),
     path("api/recipe/", include("recipe.urls")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path("api/batch/", pin_exempt(BatchView.as_view()), name="batch"),
+    path("api/coalescing/", CoalescingStatsView.as_view(),
+         name="coalescing-stats"),
+    path(f"{settings.MEDIA_URL.lstrip('/')}<path:name>", media.serve,
+         name="media"),
+]
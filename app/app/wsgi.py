@@ -9,8 +9,18 @@ https://docs.djangoproject.com/en/2.1/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+os.environ.setdefault(
+    'DJANGO_SETTINGS_MODULE',
+    f"app.settings.{os.environ.get('DJANGO_ENV', 'prod')}"
+)
 
 application = get_wsgi_application()
+
+# Pay the first request's one-off costs at startup: once per worker, or
+# once before forking when the server preloads the application.
+if settings.WSGI_WARMUP:
+    from core.warmup import warmup
+    warmup()
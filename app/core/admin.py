@@ -1,13 +1,170 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import PAGE_VAR, ChangeList
+from django.contrib.auth import get_permission_codename, get_user_model
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import QueryDict
+from django.utils.functional import cached_property
 from core import models
+from core.deletion import delete_objects, delete_user
+from core.sharding import cross_shard_count
 from django.utils.translation import gettext as _
 
+SHARD_VAR = 'shard'
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator using the planner's row estimate for large Postgres results
+
+    Counting millions of rows exactly takes a full scan, so above
+    ADMIN_EXACT_COUNT_LIMIT estimated rows the estimate is shown instead.
+    """
+
+    def estimate(self):
+        """Return the planner's row estimate, or None when unavailable"""
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+
+        sql, params = queryset.query.get_compiler(
+            connection=connection
+        ).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    @cached_property
+    def count(self):
+        estimate = self.estimate()
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        if estimate is not None and estimate > limit:
+            return estimate
+        return super().count
+
+
+class InputFilter(admin.SimpleListFilter):
+    """List filter whose value is typed in rather than picked from a list"""
+    template = 'admin/core/input_filter.html'
+
+    def lookups(self, request, model_admin):
+        # A single placeholder keeps the filter displayed.
+        return [(None, None)]
+
+    def choices(self, changelist):
+        all_choice = next(super().choices(changelist))
+        all_choice['query_parts'] = [
+            (key, value) for key, value in changelist.params.items()
+            if key not in (self.parameter_name, PAGE_VAR)
+        ]
+        yield all_choice
+
+
+class UserFilter(InputFilter):
+    """Filter objects by the id or email address of their owner"""
+    title = _('owner id or email')
+    parameter_name = 'user'
+
+    def queryset(self, request, queryset):
+        value = (self.value() or '').strip()
+        if not value:
+            return queryset
+        if value.isdigit():
+            return queryset.filter(user_id=int(value))
+        # Users live on the primary, so resolve them before filtering shards.
+        user_ids = get_user_model().objects.using(DEFAULT_DB_ALIAS).filter(
+            email__iexact=value
+        ).values_list('pk', flat=True)
+        return queryset.filter(user_id__in=list(user_ids))
+
+
+class PriceFilter(admin.SimpleListFilter):
+    """Filter recipes by price range"""
+    title = _('price')
+    parameter_name = 'price'
+    ranges = {
+        'lt5': (None, 5),
+        '5-10': (5, 10),
+        '10-20': (10, 20),
+        'gte20': (20, None),
+    }
+
+    def lookups(self, request, model_admin):
+        return (
+            ('lt5', _('Under 5')),
+            ('5-10', _('5 to 10')),
+            ('10-20', _('10 to 20')),
+            ('gte20', _('20 and more')),
+        )
+
+    def queryset(self, request, queryset):
+        if self.value() not in self.ranges:
+            return queryset
+        low, high = self.ranges[self.value()]
+        if low is not None:
+            queryset = queryset.filter(price__gte=low)
+        if high is not None:
+            queryset = queryset.filter(price__lt=high)
+        return queryset
+
+
+class ShardedChangeList(ChangeList):
+    """Change list treating the shard parameter as a non-filter"""
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(SHARD_VAR, None)
+        return lookup_params
+
+
+class ShardedModelAdmin(admin.ModelAdmin):
+    """Admin for user data, browsing one shard chosen with ?shard=<alias>"""
+    list_select_related = ('user',)
+    list_filter = (UserFilter,)
+    raw_id_fields = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_shard(self, request):
+        """Return the shard selected by the request
+
+        Object pages carry the change list's query in _changelist_filters,
+        so the shard chosen there also applies to change and delete views.
+        """
+        shard = request.GET.get(SHARD_VAR)
+        if shard is None:
+            filters = QueryDict(request.GET.get('_changelist_filters', ''))
+            shard = filters.get(SHARD_VAR)
+        if shard in settings.DATABASE_SHARDS:
+            return shard
+        return DEFAULT_DB_ALIAS
+
+    def get_changelist(self, request, **kwargs):
+        return ShardedChangeList
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(self.get_shard(request))
+
+    def delete_model(self, request, obj):
+        delete_objects(
+            type(obj)._base_manager.using(obj._state.db).filter(pk=obj.pk)
+        )
+
+    def delete_queryset(self, request, queryset):
+        delete_objects(queryset)
+
 
 @admin.register(models.User)
 class UserAdmin(BaseUserAdmin):
     ordering = ['id']
     list_display = ['email', 'name']
+    list_filter = ('is_staff', 'is_superuser', 'is_active')
+    search_fields = ('^email', '^name')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         (_("Personal Info"), {'fields': ("name",)}),
@@ -25,17 +182,49 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
 
+    def get_deleted_objects(self, objs, request):
+        """Count the data of deleted users instead of listing every row"""
+        objs = list(objs)
+        user_ids = [obj.pk for obj in objs]
+        model_count = {self.opts.verbose_name_plural: len(objs)}
+        perms_needed = set()
+        for model in (models.Recipe, models.Tag, models.Ingredient):
+            opts = model._meta
+            count = cross_shard_count(
+                model._base_manager.filter(user_id__in=user_ids)
+            )
+            if not count:
+                continue
+            model_count[opts.verbose_name_plural] = count
+            codename = get_permission_codename('delete', opts)
+            if not request.user.has_perm(f'{opts.app_label}.{codename}'):
+                perms_needed.add(opts.verbose_name)
+
+        return [str(obj) for obj in objs], model_count, perms_needed, []
+
+    def delete_model(self, request, obj):
+        delete_user(obj, background=settings.BULK_DELETE_IN_BACKGROUND)
+
+    def delete_queryset(self, request, queryset):
+        for user in queryset:
+            delete_user(user, background=settings.BULK_DELETE_IN_BACKGROUND)
+
 
 @admin.register(models.Tag)
-class TagAdmin(admin.ModelAdmin):
-    pass
+class TagAdmin(ShardedModelAdmin):
+    list_display = ('name', 'user')
+    search_fields = ('^name',)
 
 
 @admin.register(models.Ingredient)
-class IngredientAdmin(admin.ModelAdmin):
-    pass
+class IngredientAdmin(ShardedModelAdmin):
+    list_display = ('name', 'user')
+    search_fields = ('^name',)
 
 
 @admin.register(models.Recipe)
-class RecipeAdmin(admin.ModelAdmin):
-    pass
+class RecipeAdmin(ShardedModelAdmin):
+    list_display = ('title', 'user', 'price', 'time_minutes')
+    list_filter = (UserFilter, PriceFilter)
+    search_fields = ('^title',)
+    autocomplete_fields = ('tags', 'ingredients')
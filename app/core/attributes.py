@@ -0,0 +1,63 @@
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+
+from core import events
+
+
+def _create_named(model, user_id, names, using):
+    """Insert tags or ingredients with one statement and one sequence block
+
+    Like ChangeTrackedModel.save, every row gets its own change sequence
+    number, reserved together for the whole batch.
+    """
+    last = get_user_model().objects.db_manager(using).next_change_seq(
+        user_id, count=len(names)
+    )
+    model.objects.db_manager(using).bulk_create(
+        model(user_id=user_id, name=name, change_seq=seq)
+        for seq, name in enumerate(names, start=last - len(names) + 1)
+    )
+    return dict(zip(names, range(last - len(names) + 1, last + 1)))
+
+
+def resolve_names(model, user_id, names, using=None):
+    """Return {name: pk} of a user's named objects, creating missing ones
+
+    Existing names are found with one query and the missing ones created
+    with one bulk insert. A concurrent request creating the same name
+    makes the insert fail on the unique (user, name) constraint; the
+    batch is then retried name by name in savepoints, keeping whichever
+    row won.
+    """
+    names = list(dict.fromkeys(names))
+    manager = model.objects.db_manager(using)
+    found = dict(manager.filter(
+        user_id=user_id, name__in=names
+    ).values_list('name', 'pk'))
+    missing = [name for name in names if name not in found]
+    if not missing:
+        return found
+
+    created = {}
+    try:
+        with transaction.atomic(using=using):
+            created = _create_named(model, user_id, missing, using)
+    except IntegrityError:
+        for name in missing:
+            try:
+                with transaction.atomic(using=using):
+                    created.update(
+                        _create_named(model, user_id, [name], using)
+                    )
+            except IntegrityError:
+                pass
+
+    found.update(manager.filter(
+        user_id=user_id, name__in=missing
+    ).values_list('name', 'pk'))
+    kind = model._meta.model_name
+    for name, seq in created.items():
+        events.publish_on_commit(
+            using, user_id, seq, kind, 'created', [found[name]]
+        )
+    return found
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+_MISSING = object()
+
+
+def request_key(user_id, seq, request):
+    """Return the coalescing key of a read by a user at a change sequence
+
+    Query parameters are sorted so the same read spelled differently
+    shares a key. The change sequence makes reads that start after a
+    write miss computations started before it. The negotiated format is
+    part of the key as serializers shape data for some renderers.
+    """
+    params = sorted(
+        (name, sorted(values)) for name, values in request.GET.lists()
+    )
+    digest = hashlib.sha256(json.dumps(params).encode()).hexdigest()
+    renderer = getattr(request, 'accepted_renderer', None)
+    format = getattr(renderer, 'format', '')
+    return f'{user_id}:{seq}:{request.path}:{format}:{digest}'
+
+
+class Flight:
+    """One computation and the requests waiting for its result"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Run one computation per key at a time and share its result
+
+    A request arriving while the same key is being computed waits for
+    that result, or re-raises its error, instead of computing it again.
+    Waiters give up after `timeout` seconds and compute on their own.
+    With `shared`, a cache lock extends this to other processes using
+    the same cache backend.
+    """
+
+    def __init__(self, prefix, timeout=5, shared=False, poll=0.05):
+        self.prefix = prefix
+        self.timeout = timeout
+        self.shared = shared
+        self.poll = poll
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = Counter()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def do(self, key, compute):
+        """Return compute(), shared with concurrent calls for the same key"""
+        with self._lock:
+            self._stats['calls'] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                flight.waiters += 1
+
+        if not leader:
+            return self._wait(flight, compute)
+
+        self._count('leaders')
+        try:
+            flight.result = (
+                self._compute_shared(key, compute) if self.shared
+                else compute()
+            )
+            return flight.result
+        except Exception as exc:
+            flight.error = exc
+            self._count('errors')
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _wait(self, flight, compute):
+        """Return the result of another thread's flight"""
+        if not flight.done.wait(self.timeout):
+            self._count('timeouts')
+            return compute()
+        self._count('followers')
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _compute_shared(self, key, compute):
+        """Compute once across processes through a cache lock
+
+        The process holding the lock stores its result for the others to
+        pick up. When the holder fails its lock goes away and a waiter
+        takes over; when it hangs waiters compute on their own after
+        `timeout` seconds.
+        """
+        result_key = f'coalesce:{self.prefix}:result:{key}'
+        lock_key = f'coalesce:{self.prefix}:lock:{key}'
+        deadline = time.monotonic() + self.timeout
+        while True:
+            result = cache.get(result_key, _MISSING)
+            if result is not _MISSING:
+                self._count('shared')
+                return result
+            if cache.add(lock_key, 1, self.timeout):
+                try:
+                    result = compute()
+                    cache.set(result_key, result, self.timeout)
+                    return result
+                finally:
+                    cache.delete(lock_key)
+            if time.monotonic() >= deadline:
+                self._count('timeouts')
+                return compute()
+            time.sleep(self.poll)
+
+    def stats(self):
+        """Return counters and the share of calls served by another call
+
+        `leaders` computed a result, `followers` got one from a thread of
+        this process and `shared` from another process; `timeouts` gave
+        up waiting and computed on their own.
+        """
+        with self._lock:
+            stats = {
+                name: self._stats[name]
+                for name in ('calls', 'leaders', 'followers', 'shared',
+                             'timeouts', 'errors')
+            }
+        stats['ratio'] = round(
+            (stats['followers'] + stats['shared']) / stats['calls'], 4
+        ) if stats['calls'] else 0.0
+        return stats
+
+
+recipe_lists = SingleFlight(
+    'recipe-list',
+    timeout=settings.REQUEST_COALESCING_TIMEOUT,
+    shared=settings.REQUEST_COALESCING_SHARED,
+)
@@ -0,0 +1,214 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Signed cookie marking a client that wrote within READ_YOUR_WRITES_SECONDS
+PIN_COOKIE = 'primary_pin'
+
+_state = threading.local()
+
+
+def is_pinned():
+    """Return True when reads must go to the primary"""
+    return getattr(_state, 'pinned', 0) > 0
+
+
+@contextmanager
+def pinned_to_primary():
+    """Send every read inside the block to the primary database"""
+    _state.pinned = getattr(_state, 'pinned', 0) + 1
+    try:
+        yield
+    finally:
+        _state.pinned -= 1
+
+
+class ReplicaHealth:
+    """Track which read replicas are reachable and caught up"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = {}
+        self._ejected_until = {}
+
+    def reset(self):
+        """Forget all health information"""
+        with self._lock:
+            self._checked_at.clear()
+            self._ejected_until.clear()
+
+    def eject(self, alias, reason):
+        """Take a replica out of rotation for the ejection period"""
+        logger.warning("Ejecting replica %s: %s", alias, reason)
+        with self._lock:
+            self._ejected_until[alias] = (
+                time.monotonic() + settings.REPLICA_EJECT_SECONDS
+            )
+
+    def replication_lag(self, alias):
+        """Return how many seconds the replica is behind the primary"""
+        with connections[alias].cursor() as cursor:
+            if connections[alias].vendor != 'postgresql':
+                cursor.execute('SELECT 1')
+                return 0.0
+            cursor.execute(
+                'SELECT EXTRACT(EPOCH FROM '
+                'now() - pg_last_xact_replay_timestamp())'
+            )
+            lag = cursor.fetchone()[0]
+        return float(lag or 0.0)
+
+    def check(self, alias):
+        """Probe a replica and eject it when it is down or lagging"""
+        try:
+            lag = self.replication_lag(alias)
+        except Exception as exc:
+            self.eject(alias, exc)
+            return False
+        if lag > settings.REPLICA_MAX_LAG_SECONDS:
+            self.eject(alias, f'{lag:.1f}s behind the primary')
+            return False
+        return True
+
+    def is_healthy(self, alias):
+        """Return whether a replica may serve reads, probing periodically"""
+        now = time.monotonic()
+        with self._lock:
+            if self._ejected_until.get(alias, 0) > now:
+                return False
+            due = (
+                now - self._checked_at.get(alias, float('-inf'))
+                >= settings.REPLICA_HEALTH_CHECK_INTERVAL
+            )
+            if due:
+                self._checked_at[alias] = now
+        if due:
+            return self.check(alias)
+        return True
+
+
+health = ReplicaHealth()
+
+
+def replicas_of(primary):
+    """Return the read replicas of a primary database or shard"""
+    if primary == DEFAULT_DB_ALIAS:
+        return settings.DATABASE_REPLICAS
+    return settings.SHARD_REPLICAS.get(primary, [])
+
+
+def primary_of(alias):
+    """Return the primary a replica follows, or the alias itself"""
+    if alias in settings.DATABASE_REPLICAS:
+        return DEFAULT_DB_ALIAS
+    for primary, replicas in settings.SHARD_REPLICAS.items():
+        if alias in replicas:
+            return primary
+    return alias
+
+
+def read_alias(primary):
+    """Return the database serving a read meant for `primary`
+
+    A healthy replica of it, unless reads are pinned or a transaction is
+    open on the primary.
+    """
+    if is_pinned() or connections[primary].in_atomic_block:
+        return primary
+    replicas = [
+        alias for alias in replicas_of(primary) if health.is_healthy(alias)
+    ]
+    if not replicas:
+        return primary
+    return random.choice(replicas)
+
+
+class ReplicaRouter:
+    """Send writes to the primary and spread reads over healthy replicas"""
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return read_alias(DEFAULT_DB_ALIAS)
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return primary_of(instance._state.db)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if primary_of(obj1._state.db) == primary_of(obj2._state.db):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if primary_of(db) != db:
+            return False
+        return None
+
+
+def pin_exempt(view):
+    """Keep a view's unsafe method from pinning the client by itself
+
+    For views like the batch endpoint, whose POST only wraps other calls;
+    they call mark_written when one of those writes.
+    """
+    view.pin_exempt = True
+    return view
+
+
+def mark_written(request):
+    """Pin the client's reads to the primary after this response"""
+    request._wrote_primary = True
+
+
+class ReadYourWritesMiddleware(MiddlewareMixin):
+    """Pin a client's reads to the primary for a while after it writes
+
+    The pin travels with the client in a signed cookie, so it holds
+    whichever worker process serves the next request.
+    """
+
+    def process_request(self, request):
+        wrote_recently = request.get_signed_cookie(
+            PIN_COOKIE, default=None, salt=PIN_COOKIE,
+            max_age=settings.READ_YOUR_WRITES_SECONDS
+        ) is not None
+        request._wrote_primary = False
+        request._replica_pin = pinned_to_primary() if wrote_recently else None
+        if request._replica_pin is not None:
+            request._replica_pin.__enter__()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method in SAFE_METHODS or getattr(
+                view_func, 'pin_exempt', False):
+            return None
+        mark_written(request)
+        if request._replica_pin is None:
+            request._replica_pin = pinned_to_primary()
+            request._replica_pin.__enter__()
+        return None
+
+    def process_response(self, request, response):
+        pin = getattr(request, '_replica_pin', None)
+        if pin is not None:
+            pin.__exit__(None, None, None)
+            request._replica_pin = None
+
+        if getattr(request, '_wrote_primary', False):
+            response.set_signed_cookie(
+                PIN_COOKIE, '1', salt=PIN_COOKIE,
+                max_age=settings.READ_YOUR_WRITES_SECONDS, httponly=True
+            )
+        return response
@@ -0,0 +1,328 @@
+import logging
+import threading
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import Max
+from django.db.models.signals import post_delete, pre_delete
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core import events, uploads
+from core.models import (
+    Tag,
+    Ingredient,
+    Recipe,
+    RecipeStats,
+    RecipeSignature,
+    LshBucket,
+    ImageBlob,
+    ImageUpload,
+    ShardAssignment,
+    Tombstone
+)
+
+logger = logging.getLogger(__name__)
+
+# Receivers in this module are mirrored by the set-based deletes below
+OWN_RECEIVERS = 'core.signals'
+
+# Rows referencing recipes that go before the recipes themselves
+RECIPE_ROWS = (
+    Recipe.tags.through,
+    Recipe.ingredients.through,
+    RecipeSignature,
+    LshBucket,
+    ImageUpload,
+)
+
+RELATIONS = {
+    Tag: (Recipe.tags.through, 'tag_id'),
+    Ingredient: (Recipe.ingredients.through, 'ingredient_id'),
+}
+
+
+def needs_instances(*models):
+    """Return True when a foreign delete receiver listens to any model
+
+    Such receivers expect model instances, so objects of these models have
+    to go through Django's collector instead of set-based deletes.
+    """
+    for model in models:
+        for signal in (pre_delete, post_delete):
+            for receiver in signal._live_receivers(model):
+                if receiver.__module__ != OWN_RECEIVERS:
+                    return True
+    return False
+
+
+def _write_db(queryset):
+    """Return the database a queryset deletes from"""
+    return queryset._db or router.db_for_write(
+        queryset.model, **queryset._hints
+    )
+
+
+def _pk_batches(queryset, batch_size):
+    """Yield primary keys of a queryset in batches until none are left"""
+    queryset = queryset.order_by('pk').values_list(
+        'pk', flat=True
+    ).distinct()
+    while True:
+        pks = list(queryset[:batch_size])
+        if not pks:
+            return
+        yield pks
+
+
+def _raw_delete(model, using, **filters):
+    """Delete matching rows with a single statement and no signals"""
+    return model._base_manager.using(using).filter(**filters)._raw_delete(
+        using
+    )
+
+
+def _record_tombstones(model, user_id, pks, using):
+    """Leave tombstones for objects deleted without their signals"""
+    last = get_user_model().objects.db_manager(using).next_change_seq(
+        user_id, count=len(pks)
+    )
+    first = last - len(pks) + 1
+    Tombstone.objects.using(using).bulk_create(
+        Tombstone(
+            user_id=user_id,
+            kind=model._meta.model_name,
+            object_id=pk,
+            change_seq=seq
+        )
+        for seq, pk in enumerate(pks, start=first)
+    )
+    for seq, pk in enumerate(pks, start=first):
+        events.publish_on_commit(
+            using, user_id, seq, model._meta.model_name, 'deleted', [pk]
+        )
+
+
+class ResyncRequired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = ('Deletions since this cursor are no longer kept, '
+                      'sync again from the start.')
+    default_code = 'resync_required'
+
+
+def pruned_seq(user_id, using):
+    """Return the newest change sequence of a user's pruned tombstones"""
+    return get_user_model()._base_manager.using(using).values_list(
+        'pruned_seq', flat=True
+    ).get(pk=user_id)
+
+
+def check_cursor(user_id, since, using):
+    """Raise ResyncRequired when tombstones after `since` were pruned
+
+    A cursor of 0 asks for everything and needs no tombstones.
+    """
+    if 0 < since < pruned_seq(user_id, using):
+        raise ResyncRequired()
+
+
+def prune_tombstones(using):
+    """Delete tombstones older than the retention window from a database
+
+    Each user's pruned_seq moves up to their newest deleted tombstone, so
+    clients whose cursor is older know they missed deletions. Returns how
+    many tombstones were deleted.
+    """
+    cutoff = timezone.now() - timedelta(
+        days=settings.TOMBSTONE_RETENTION_DAYS
+    )
+    old = Tombstone.objects.using(using).filter(created_at__lt=cutoff)
+    users = get_user_model()._base_manager.using(using)
+    with transaction.atomic(using=using):
+        for row in old.values('user_id').annotate(seq=Max('change_seq')):
+            users.filter(
+                pk=row['user_id'], pruned_seq__lt=row['seq']
+            ).update(pruned_seq=row['seq'])
+        return old._raw_delete(using)
+
+
+def _release_images(names, using):
+    """Drop the image references held by deleted recipes"""
+    for name, count in Counter(name for name in names if name).items():
+        ImageBlob.objects.release(name, count, using=using)
+
+
+def _delete_recipes(pks, using):
+    """Delete recipes by pk keeping tombstones, stats and images in step"""
+    rows = list(Recipe._base_manager.using(using).filter(
+        pk__in=pks
+    ).values_list('pk', 'user_id', 'price', 'time_minutes', 'image'))
+    by_user = defaultdict(list)
+    for row in rows:
+        by_user[row[1]].append(row)
+
+    for rows_model in RECIPE_ROWS:
+        _raw_delete(rows_model, using, recipe_id__in=pks)
+    deleted = _raw_delete(Recipe, using, pk__in=pks)
+
+    for user_id, user_rows in by_user.items():
+        _record_tombstones(Recipe, user_id, [row[0] for row in user_rows],
+                           using)
+        if settings.RECIPE_STATS_ROLLUP:
+            RecipeStats.objects.db_manager(using).apply_delta(
+                user_id,
+                -len(user_rows),
+                -sum(Decimal(str(row[2])) for row in user_rows),
+                -sum(row[3] for row in user_rows)
+            )
+    _release_images((row[4] for row in rows), using)
+    return deleted
+
+
+def _delete_attributes(model, pks, using):
+    """Delete tags or ingredients by pk and mark their recipes changed"""
+    through, column = RELATIONS[model]
+    by_user = defaultdict(list)
+    for pk, user_id in model._base_manager.using(using).filter(
+            pk__in=pks).values_list('pk', 'user_id'):
+        by_user[user_id].append(pk)
+
+    for user_id, user_pks in by_user.items():
+        recipe_ids = list(through._base_manager.using(using).filter(
+            **{f'{column}__in': user_pks}
+        ).values_list('recipe_id', flat=True).distinct())
+        if recipe_ids:
+            seq = get_user_model().objects.db_manager(using).next_change_seq(
+                user_id
+            )
+            Recipe._base_manager.using(using).filter(
+                pk__in=recipe_ids
+            ).update(change_seq=seq)
+            events.publish_on_commit(
+                using, user_id, seq, 'recipe', 'updated', recipe_ids
+            )
+
+    _raw_delete(through, using, **{f'{column}__in': pks})
+    deleted = _raw_delete(model, using, pk__in=pks)
+    for user_id, user_pks in by_user.items():
+        _record_tombstones(model, user_id, user_pks, using)
+    return deleted
+
+
+def delete_objects(queryset, batch_size=None, progress=None):
+    """Delete the tags, ingredients or recipes matched by a queryset
+
+    Rows go in batches of set-based DELETEs, each in its own transaction,
+    so locks are held briefly. Objects are only loaded into memory when a
+    foreign signal receiver needs them. Returns the number deleted.
+    """
+    model = queryset.model
+    using = _write_db(queryset)
+    batch_size = batch_size or settings.BULK_DELETE_BATCH_SIZE
+    careful = needs_instances(model, *RECIPE_ROWS)
+
+    deleted = 0
+    for pks in _pk_batches(queryset, batch_size):
+        with transaction.atomic(using=using):
+            if careful:
+                model._base_manager.using(using).filter(pk__in=pks).delete()
+            elif model is Recipe:
+                _delete_recipes(pks, using)
+            else:
+                _delete_attributes(model, pks, using)
+        deleted += len(pks)
+        if progress is not None:
+            progress(model, deleted)
+    return deleted
+
+
+# Order in which a deleted user's rows go so foreign keys always resolve
+USER_DATA = (
+    (Recipe.tags.through, 'recipe__user_id'),
+    (Recipe.ingredients.through, 'recipe__user_id'),
+    (RecipeSignature, 'recipe__user_id'),
+    (LshBucket, 'recipe__user_id'),
+    (ImageUpload, 'user_id'),
+    (Recipe, 'user_id'),
+    (Tag, 'user_id'),
+    (Ingredient, 'user_id'),
+    (Tombstone, 'user_id'),
+    (RecipeStats, 'user_id'),
+)
+
+
+def _remove_partial_files(pks, using):
+    """Remove the files of deleted uploads once their deletion commits"""
+    paths = [ImageUpload(pk=pk).path for pk in pks]
+
+    def remove():
+        for path in paths:
+            uploads.remove_file(path)
+
+    transaction.on_commit(remove, using=using)
+
+
+def _delete_user_data(user_id, using, batch_size, progress):
+    """Delete every row a user owns on one database, in batches"""
+    for model, column in USER_DATA:
+        queryset = model._base_manager.using(using).filter(
+            **{column: user_id}
+        )
+        careful = needs_instances(model)
+        deleted = 0
+        for pks in _pk_batches(queryset, batch_size):
+            with transaction.atomic(using=using):
+                if careful:
+                    model._base_manager.using(using).filter(
+                        pk__in=pks
+                    ).delete()
+                else:
+                    images = []
+                    if model is Recipe:
+                        images = Recipe._base_manager.using(using).filter(
+                            pk__in=pks
+                        ).values_list('image', flat=True)
+                    _release_images(list(images), using)
+                    _raw_delete(model, using, pk__in=pks)
+                    if model is ImageUpload:
+                        _remove_partial_files(pks, using)
+            deleted += len(pks)
+            if progress is not None:
+                progress(model, deleted)
+
+
+def delete_user(user, batch_size=None, progress=None, background=False):
+    """Delete a user, removing their recipes and attributes in bulk first
+
+    The user's data is deleted in short set-based batches on the shard
+    holding it, so only the user row itself is left for Django's collector.
+    In background mode the user is deactivated at once and the deletion
+    runs in a thread after the current transaction commits.
+    """
+    batch_size = batch_size or settings.BULK_DELETE_BATCH_SIZE
+    if background:
+        get_user_model().objects.filter(pk=user.pk).update(is_active=False)
+
+        def run():
+            try:
+                delete_user(user, batch_size, progress)
+            except Exception:
+                logger.exception('Deleting user %s failed', user.pk)
+            finally:
+                connections.close_all()
+
+        transaction.on_commit(
+            lambda: threading.Thread(target=run, daemon=True).start()
+        )
+        return
+
+    shard = ShardAssignment.objects.using(DEFAULT_DB_ALIAS).filter(
+        user_id=user.pk
+    ).values_list('shard', flat=True).first() or DEFAULT_DB_ALIAS
+    _delete_user_data(user.pk, shard, batch_size, progress)
+    user.delete()
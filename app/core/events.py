@@ -0,0 +1,304 @@
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core.models import Tag, Ingredient, Recipe, Tombstone
+from core.sharding import shard_for_user
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple('Event', ('user_id', 'seq', 'kind', 'action', 'id'))
+
+KINDS = {'tag': Tag, 'ingredient': Ingredient, 'recipe': Recipe}
+
+
+class Subscription:
+    """Bounded queue of one client's events
+
+    A client reading slower than its events arrive is not allowed to
+    grow the queue: further events are dropped and the subscription is
+    marked overflowed, so the stream catches up from the database.
+    """
+
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self.overflowed = False
+        self._queue = queue.Queue(maxsize=settings.EVENT_QUEUE_SIZE)
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Return the next event, or None when none came within `timeout`"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def reset(self):
+        """Drop queued events after falling behind"""
+        self.overflowed = False
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """Deliver events to subscribers in the current process only"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, user_id):
+        subscription = Subscription(self, user_id)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def deliver(self, event):
+        """Hand an event to this process's subscribers of its user"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(event.user_id, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def publish(self, event):
+        self.deliver(event)
+
+
+class PostgresBroker(LocalBroker):
+    """Share events between processes with Postgres LISTEN/NOTIFY
+
+    Events are sent with pg_notify and every process listens on a
+    dedicated connection, delivering what arrives to its own subscribers.
+    """
+    channel = 'recipe_changes'
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+
+    def publish(self, event):
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_notify(%s, %s)',
+                [self.channel, json.dumps(event._asdict())]
+            )
+
+    def subscribe(self, user_id):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(
+                    target=self._listen, daemon=True
+                )
+                self._listener.start()
+        return super().subscribe(user_id)
+
+    def _listen(self):
+        import psycopg2
+
+        while True:
+            try:
+                params = connections[DEFAULT_DB_ALIAS].get_connection_params()
+                connection = psycopg2.connect(**params)
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                while True:
+                    select.select([connection], [], [], 5)
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        self.deliver(Event(**json.loads(notify.payload)))
+            except Exception:
+                logger.exception('Event listener failed, reconnecting')
+                time.sleep(1)
+
+
+broker = SimpleLazyObject(lambda: import_string(settings.EVENT_BROKER)())
+
+
+class TooManyStreams(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many change streams are open, please retry shortly.'
+    default_code = 'too_many_streams'
+
+    def __init__(self):
+        super().__init__()
+        # Sent as Retry-After by the exception handler
+        self.wait = max(1, settings.EVENT_RETRY_MILLISECONDS // 1000)
+
+
+class StreamSlot:
+    """Place of one open stream, given back when the stream is closed"""
+
+    def __init__(self, limiter):
+        self._limiter = limiter
+
+    def close(self):
+        limiter, self._limiter = self._limiter, None
+        if limiter is not None:
+            limiter.release()
+
+
+class StreamLimiter:
+    """Cap the change streams served at once by this process
+
+    A stream holds its worker thread until it ends, so at most
+    EVENT_MAX_STREAMS of them run and the other threads stay free for
+    ordinary requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+
+    def acquire(self):
+        """Return a slot for a new stream, or raise TooManyStreams"""
+        with self._lock:
+            if self.active >= settings.EVENT_MAX_STREAMS:
+                raise TooManyStreams()
+            self.active += 1
+        return StreamSlot(self)
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+streams = StreamLimiter()
+
+
+def publish_on_commit(using, user_id, seq, kind, action, object_ids):
+    """Publish change events once the current transaction commits"""
+    events = [
+        Event(user_id, seq, kind, action, object_id)
+        for object_id in object_ids
+    ]
+
+    def publish():
+        for event in events:
+            try:
+                broker.publish(event)
+            except Exception:
+                logger.exception('Publishing %s failed', event)
+
+    transaction.on_commit(publish, using=using)
+
+
+def changes_since(user_id, since):
+    """Return events recreating a user's changes after a sequence number
+
+    The database keeps no creation marker, so objects changed since then
+    are reported as updated.
+    """
+    using = shard_for_user(user_id)
+    events = []
+    for kind, model in KINDS.items():
+        rows = model.objects.db_manager(using).filter(
+            user_id=user_id, change_seq__gt=since
+        ).values_list('change_seq', 'pk')
+        events += [
+            Event(user_id, seq, kind, 'updated', pk) for seq, pk in rows
+        ]
+    tombstones = Tombstone.objects.db_manager(using).filter(
+        user_id=user_id, change_seq__gt=since
+    ).values_list('change_seq', 'kind', 'object_id')
+    events += [
+        Event(user_id, seq, kind, 'deleted', object_id)
+        for seq, kind, object_id in tombstones
+    ]
+    events.sort(key=lambda event: event.seq)
+    return events
+
+
+def close_idle_connections():
+    """Close database connections a waiting stream would keep open"""
+    for connection in connections.all():
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+def format_event(event):
+    """Return an event in the Server-Sent Events wire format"""
+    data = json.dumps({
+        'kind': event.kind,
+        'action': event.action,
+        'id': event.id,
+        'seq': event.seq,
+    })
+    return f'id: {event.seq}\nevent: change\ndata: {data}\n\n'
+
+
+def event_stream(user_id, last_seq, subscription):
+    """Yield a user's change events as Server-Sent Events
+
+    Changes missed while disconnected are replayed from the database
+    first, and again whenever the subscription overflows. Comment lines
+    are sent as heartbeats, and the stream ends after
+    EVENT_STREAM_MAX_SECONDS so clients reconnect with Last-Event-ID.
+    Database connections are closed after each catch-up instead of being
+    held while the stream waits for events.
+    """
+    # Keys of the events delivered at `last_seq`; None when all were.
+    seen = None
+
+    def fresh(events):
+        nonlocal last_seq, seen
+        for event in events:
+            key = (event.kind, event.id)
+            if event.seq < last_seq:
+                continue
+            if event.seq == last_seq and (seen is None or key in seen):
+                continue
+            if event.seq > last_seq:
+                last_seq, seen = event.seq, set()
+            seen.add(key)
+            yield format_event(event)
+
+    deadline = time.monotonic() + settings.EVENT_STREAM_MAX_SECONDS
+    try:
+        yield f'retry: {settings.EVENT_RETRY_MILLISECONDS}\n\n'
+        yield from fresh(changes_since(user_id, last_seq))
+        close_idle_connections()
+        while time.monotonic() < deadline:
+            event = subscription.get(settings.EVENT_HEARTBEAT_SECONDS)
+            if subscription.overflowed:
+                subscription.reset()
+                yield from fresh(changes_since(user_id, last_seq))
+                close_idle_connections()
+            elif event is None:
+                yield ': heartbeat\n\n'
+            else:
+                yield from fresh([event])
+    finally:
+        subscription.close()
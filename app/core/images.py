@@ -0,0 +1,126 @@
+import warnings
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from core.storage import sniff_extension
+
+# Sniffed extensions we accept, and the format each is re-encoded to;
+# anything but JPEG becomes PNG so transparency survives
+OUTPUT_FORMATS = {
+    'jpg': 'JPEG',
+    'png': 'PNG',
+    'gif': 'PNG',
+    'webp': 'PNG',
+    'bmp': 'PNG',
+    'tiff': 'PNG',
+}
+OUTPUT_MODES = {
+    'JPEG': ('L', 'RGB'),
+    'PNG': ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'),
+}
+
+# Transposes undoing each EXIF orientation, applied before EXIF is dropped;
+# names of PIL.Image constants, as Pillow is only imported when decoding
+ORIENTATION_TRANSPOSES = {
+    2: 'FLIP_LEFT_RIGHT',
+    3: 'ROTATE_180',
+    4: 'FLIP_TOP_BOTTOM',
+    5: 'TRANSPOSE',
+    6: 'ROTATE_270',
+    7: 'TRANSVERSE',
+    8: 'ROTATE_90',
+}
+EXIF_ORIENTATION = 0x0112
+
+
+class InvalidImage(ValueError):
+    """Raised when an upload is not an image we are willing to decode"""
+
+
+def _open(file):
+    """Return a lazily decoded image, having read only its header"""
+    from PIL import Image
+
+    with warnings.catch_warnings():
+        # The pixel limit is checked by the caller, below Pillow's own.
+        warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+        try:
+            return Image.open(file)
+        except Image.DecompressionBombError:
+            raise InvalidImage('The image has too many pixels.')
+        except (OSError, SyntaxError, ValueError):
+            raise InvalidImage(
+                'Upload a valid image. The file you uploaded was either not '
+                'an image or a corrupted image.'
+            )
+
+
+def _orientation(image):
+    """Return the EXIF orientation of an image, 1 when it has none"""
+    try:
+        exif = image._getexif() or {}
+    except (AttributeError, OSError, SyntaxError, ValueError):
+        return 1
+    return exif.get(EXIF_ORIENTATION, 1)
+
+
+def sanitize(file, max_bytes=None, max_pixels=None, max_side=None):
+    """Return an uploaded image re-encoded without metadata
+
+    The format is sniffed from the leading bytes and the size read from
+    the header, so oversized files and decompression bombs are refused
+    before any pixel is decoded. JPEGs are decoded straight at the
+    smallest scale still covering `max_side` and every image is scaled
+    down to fit it, which caps the memory one upload can take. Rewriting
+    the pixels drops EXIF and other metadata; the EXIF orientation is
+    applied first so photos keep facing up.
+    """
+    from PIL import Image
+
+    max_bytes = max_bytes or settings.UPLOAD_MAX_BYTES
+    max_pixels = max_pixels or settings.IMAGE_MAX_PIXELS
+    max_side = max_side or settings.IMAGE_MAX_SIDE
+
+    if file.size > max_bytes:
+        raise InvalidImage(f'Images may be at most {max_bytes} bytes.')
+
+    file.seek(0)
+    ext = sniff_extension(file.read(16))
+    file.seek(0)
+    if ext not in OUTPUT_FORMATS:
+        raise InvalidImage(
+            'Upload a JPEG, PNG, GIF, WebP, BMP or TIFF image.'
+        )
+
+    image = _open(file)
+    width, height = image.size
+    if width * height > max_pixels:
+        raise InvalidImage(f'Images may have at most {max_pixels} pixels.')
+
+    orientation = _orientation(image)
+    image.draft('RGB', (max_side, max_side))
+    try:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    except (OSError, SyntaxError, ValueError):
+        raise InvalidImage('The image could not be decoded.')
+    if orientation in ORIENTATION_TRANSPOSES:
+        image = image.transpose(
+            getattr(Image, ORIENTATION_TRANSPOSES[orientation])
+        )
+
+    output_format = OUTPUT_FORMATS[ext]
+    if image.mode not in OUTPUT_MODES[output_format]:
+        has_alpha = 'A' in image.mode or 'transparency' in image.info
+        image = image.convert(
+            'RGBA' if has_alpha and output_format == 'PNG' else 'RGB'
+        )
+
+    output = BytesIO()
+    if output_format == 'JPEG':
+        image.save(output, 'JPEG', quality=90, optimize=True)
+    else:
+        image.save(output, 'PNG', optimize=True)
+    extension = 'jpg' if output_format == 'JPEG' else 'png'
+    return ContentFile(output.getvalue(), name=f'image.{extension}')
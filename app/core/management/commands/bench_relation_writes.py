@@ -0,0 +1,108 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.models import Tag, Recipe
+from core.relations import write_relations
+
+
+class Rollback(Exception):
+    """Raised to discard the benchmark data"""
+
+
+class WriteCounter:
+    """Execute wrapper counting write statements and the rows they hit"""
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        if sql.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+            self.statements += 1
+            self.rows += max(context['cursor'].rowcount, 0)
+        return result
+
+
+def replace_with_set(recipe, ids):
+    """Update a recipe's tags the way ModelSerializer.update does"""
+    recipe.save()
+    recipe.tags.set(ids)
+
+
+def replace_with_diff(recipe, ids):
+    """Update a recipe's tags with the diff-based relation writer"""
+    write_relations(recipe, {'tags': ids}, recipe._state.db)
+
+
+class Command(BaseCommand):
+    """Django command to compare writes of recipe relation updates"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--links', type=int, default=200)
+        parser.add_argument('--changed', type=int, default=5)
+        parser.add_argument('--updates', type=int, default=50)
+
+    def _wal_position(self):
+        """Return the WAL insert position in bytes, None off PostgreSQL"""
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), '0/0')"
+            )
+            return int(cursor.fetchone()[0])
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = get_user_model().objects.create_user(
+                    'bench-relations@example.com'
+                )
+                self._report(user, options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _report(self, user, options):
+        """Print statements, rows and WAL bytes written per update
+
+        Every update swaps `--changed` of a recipe's `--links` tags, as
+        when a client edits a long tag list.
+        """
+        links, changed, updates = (
+            options['links'], options['changed'], options['updates']
+        )
+        Tag.objects.bulk_create(
+            Tag(user=user, name=f'Tag {i}') for i in range(links + changed)
+        )
+        pool = list(Tag.objects.filter(user=user).values_list(
+            'pk', flat=True
+        ))
+        versions = (pool[:links], pool[changed:])
+
+        self.stdout.write(
+            f"{'writer':<8}{'statements':>12}{'rows':>8}{'WAL bytes':>12}"
+        )
+        for name, replace in (
+            ('set', replace_with_set), ('diff', replace_with_diff)
+        ):
+            recipe = Recipe.objects.create(
+                user=user, title=name, time_minutes=10, price=5
+            )
+            recipe.tags.set(versions[0])
+            counter = WriteCounter()
+            wal_before = self._wal_position()
+            with connection.execute_wrapper(counter):
+                for i in range(1, updates + 1):
+                    replace(recipe, versions[i % 2])
+            wal_after = self._wal_position()
+
+            wal = '-' if wal_before is None else (
+                f'{(wal_after - wal_before) / updates:.0f}'
+            )
+            self.stdout.write(
+                f'{name:<8}{counter.statements / updates:>12.1f}'
+                f'{counter.rows / updates:>8.1f}{wal:>12}'
+            )
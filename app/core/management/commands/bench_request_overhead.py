@@ -0,0 +1,101 @@
+import importlib
+import os
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+from rest_framework.authtoken.models import Token
+
+from core.models import Tag
+
+# Settings that shape the request path, taken from each profile
+PROFILE_SETTINGS = (
+    'DEBUG', 'MIDDLEWARE', 'WEB_ONLY_MIDDLEWARE', 'TEMPLATES',
+    'REST_FRAMEWORK',
+)
+
+
+class Rollback(Exception):
+    """Raised to discard the benchmark data"""
+
+
+class Command(BaseCommand):
+    """Django command to compare per-request overhead of settings profiles"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--path', default='/api/recipe/tags/')
+        parser.add_argument(
+            '--profiles', nargs='+',
+            default=['app.settings.dev', 'app.settings.prod']
+        )
+
+    def _profile_settings(self, module_name):
+        """Return the request path settings of a settings module"""
+        # The prod profile refuses to load without a secret key.
+        os.environ.setdefault('DJANGO_SECRET_KEY', 'bench-request-overhead')
+        module = importlib.import_module(module_name)
+        overrides = {
+            name: getattr(module, name)
+            for name in PROFILE_SETTINGS if hasattr(module, name)
+        }
+        overrides.setdefault('REST_FRAMEWORK', {})
+        overrides['ALLOWED_HOSTS'] = ['testserver']
+        return overrides
+
+    def _measure(self, token, path, count):
+        """Return mean seconds per request through the full handler"""
+        client = Client(HTTP_AUTHORIZATION=f'Token {token}')
+        client.get(path)
+        started = time.perf_counter()
+        for _ in range(count):
+            response = client.get(path)
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            self.stderr.write(f'{path} returned {response.status_code}')
+        return elapsed / count
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = get_user_model().objects.create_user(
+                    'bench-requests@example.com'
+                )
+                token = Token.objects.create(user=user)
+                Tag.objects.bulk_create(
+                    Tag(user=user, name=f'Tag {i}') for i in range(20)
+                )
+                self._report(token.key, options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _report(self, token, options):
+        """Print the best microseconds per request of each profile
+
+        Profiles take turns over several rounds so drift in machine load
+        affects them alike.
+        """
+        profiles = {
+            module_name: self._profile_settings(module_name)
+            for module_name in options['profiles']
+        }
+        best = dict.fromkeys(profiles, float('inf'))
+        for _ in range(options['rounds']):
+            for module_name, overrides in profiles.items():
+                with override_settings(**overrides):
+                    best[module_name] = min(best[module_name], self._measure(
+                        token, options['path'], options['requests']
+                    ))
+
+        self.stdout.write(f"{'profile':<24}{'us/request':>12}{'ratio':>8}")
+        baseline = None
+        for module_name, seconds in best.items():
+            baseline = baseline or seconds
+            self.stdout.write(
+                f'{module_name:<24}{seconds * 1e6:>12.0f}'
+                f'{seconds / baseline:>8.2f}'
+            )
@@ -0,0 +1,92 @@
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Tag, Ingredient, Recipe
+
+
+class Rollback(Exception):
+    """Raised to discard the benchmark data"""
+
+
+class Command(BaseCommand):
+    """Django command to compare memory per row of instances and rows"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+
+    def _measure(self, load):
+        """Return bytes retained by the result of `load`"""
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        result = load()
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del result
+        return after - before
+
+    def _populate(self, user, count):
+        """Create benchmark tags, ingredients and recipes for a user"""
+        Tag.objects.bulk_create(
+            Tag(user=user, name=f'Tag {i}') for i in range(count)
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(user=user, name=f'Ingredient {i}') for i in range(count)
+        )
+        Recipe.objects.bulk_create(
+            Recipe(user=user, title=f'Recipe {i}', time_minutes=10,
+                   price=i % 100)
+            for i in range(count)
+        )
+        links = zip(
+            Recipe.objects.filter(user=user).values_list('id', flat=True),
+            Tag.objects.filter(user=user).values_list('id', flat=True),
+            Ingredient.objects.filter(user=user).values_list('id', flat=True)
+        )
+        tag_links, ingredient_links = [], []
+        for recipe_id, tag_id, ingredient_id in links:
+            tag_links.append(
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            )
+            ingredient_links.append(Recipe.ingredients.through(
+                recipe_id=recipe_id, ingredient_id=ingredient_id
+            ))
+        Recipe.tags.through.objects.bulk_create(tag_links)
+        Recipe.ingredients.through.objects.bulk_create(ingredient_links)
+
+    def handle(self, *args, **options):
+        count = options['rows']
+        try:
+            with transaction.atomic():
+                user = get_user_model().objects.create_user(
+                    'bench-rows@example.com'
+                )
+                self._populate(user, count)
+                self._report(user, count)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _report(self, user, count):
+        """Print bytes per row for each model and load path"""
+        self.stdout.write(f"{'model':<12}{'instances':>12}{'rows':>12}")
+        for model, fields in (
+            (Tag, ('id', 'name')),
+            (Ingredient, ('id', 'name')),
+            (Recipe, ('id', 'title', 'time_minutes', 'price', 'link',
+                      'ingredients', 'tags')),
+        ):
+            queryset = model.objects.filter(user=user)
+            if model is Recipe:
+                instances = self._measure(lambda: list(
+                    queryset.prefetch_related('tags', 'ingredients')
+                ))
+            else:
+                instances = self._measure(lambda: list(queryset))
+            rows = self._measure(lambda: queryset.rows(*fields))
+            self.stdout.write(
+                f'{model.__name__:<12}{instances // count:>12}'
+                f'{rows // count:>12}'
+            )
@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.deletion import delete_user
+
+
+class Command(BaseCommand):
+    """Django command to delete users and their data in batches"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='+', type=int)
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def progress(self, model, deleted):
+        self.stdout.write(
+            f'  {deleted} {model._meta.verbose_name_plural} deleted'
+        )
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.filter(pk__in=options['user_ids'])
+        found = {user.pk: user for user in users}
+        missing = set(options['user_ids']) - set(found)
+        if missing:
+            raise CommandError(
+                f"No users with ids {', '.join(map(str, sorted(missing)))}"
+            )
+
+        for user in found.values():
+            self.stdout.write(f'Deleting user {user.pk} ({user.email})')
+            delete_user(user, options['batch_size'], self.progress)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {len(found)} users'))
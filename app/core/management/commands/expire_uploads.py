@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.uploads import expire_uploads, remove_stale_files
+
+
+class Command(BaseCommand):
+    """Django command to delete expired resumable image uploads"""
+
+    def handle(self, *args, **options):
+        expired = sum(
+            expire_uploads(alias) for alias in settings.DATABASE_SHARDS
+        )
+        removed = remove_stale_files()
+        self.stdout.write(self.style.SUCCESS(
+            f'Expired {expired} uploads and removed {removed} stale files'
+        ))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import sharding
+
+
+class Command(BaseCommand):
+    """Django command to move one user's data to another shard online"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_id', type=int)
+        parser.add_argument('shard')
+        parser.add_argument('--drain-seconds', type=float, default=None)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            sharding.move_user(
+                options['user_id'],
+                options['shard'],
+                drain_seconds=options['drain_seconds'],
+                batch_size=options['batch_size'],
+                log=self.stdout.write
+            )
+        except ValueError as exc:
+            raise CommandError(exc)
+        self.stdout.write(self.style.SUCCESS("Move finished!"))
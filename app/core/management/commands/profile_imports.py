@@ -0,0 +1,90 @@
+import os
+import subprocess
+import sys
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Code each entry point runs before it can serve a command or a request
+ENTRY_POINTS = {
+    'manage.py': 'import django; django.setup()',
+    'wsgi.py': 'import app.wsgi',
+}
+
+
+def parse_importtime(output):
+    """Return (module, self us, cumulative us) rows of `-X importtime`"""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split(
+            '|'
+        )
+        if not self_us.strip().isdigit():
+            continue
+        rows.append((module.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def package_totals(rows):
+    """Return the summed self time of each top-level package"""
+    totals = Counter()
+    for module, self_us, _ in rows:
+        totals[module.split('.')[0]] += self_us
+    return totals
+
+
+class Command(BaseCommand):
+    """Django command to report the heaviest imports of each entry point"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'entry_points', nargs='*',
+            help=f"Entry points to profile: {', '.join(ENTRY_POINTS)}."
+        )
+        parser.add_argument('--top', type=int, default=15)
+
+    def _profile(self, code):
+        """Return the import rows of running `code` in a fresh interpreter"""
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+        return parse_importtime(result.stderr)
+
+    def handle(self, *args, **options):
+        top = options['top']
+        names = options['entry_points'] or list(ENTRY_POINTS)
+        unknown = set(names) - set(ENTRY_POINTS)
+        if unknown:
+            raise CommandError(
+                f"Unknown entry points: {', '.join(sorted(unknown))}"
+            )
+
+        for name in names:
+            rows = self._profile(ENTRY_POINTS[name])
+            total = sum(self_us for _, self_us, _ in rows)
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{name}: {len(rows)} modules in {total / 1000:.0f} ms'
+            ))
+
+            self.stdout.write(f"{'package':<40}{'self ms':>10}")
+            for package, self_us in package_totals(rows).most_common(top):
+                self.stdout.write(f'{package:<40}{self_us / 1000:>10.1f}')
+
+            self.stdout.write(f"\n{'module':<40}{'cumulative ms':>15}")
+            heaviest = sorted(rows, key=lambda row: row[2], reverse=True)
+            for module, _, cumulative_us in heaviest[:top]:
+                self.stdout.write(
+                    f'{module:<40}{cumulative_us / 1000:>15.1f}'
+                )
+            self.stdout.write('')
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.deletion import prune_tombstones
+
+
+class Command(BaseCommand):
+    """Django command to delete tombstones past their retention window"""
+
+    def handle(self, *args, **options):
+        pruned = sum(
+            prune_tombstones(alias) for alias in settings.DATABASE_SHARDS
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Pruned {pruned} tombstones older than '
+            f'{settings.TOMBSTONE_RETENTION_DAYS} days'
+        ))
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from core import sharding
+from core.models import Recipe, ShardAssignment
+
+
+class Command(BaseCommand):
+    """Django command to even out the number of users per shard"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--max-moves', type=int, default=10)
+        parser.add_argument('--drain-seconds', type=float, default=None)
+
+    def _report(self):
+        """Print users and recipes per shard and return user counts"""
+        users = dict.fromkeys(settings.DATABASE_SHARDS, 0)
+        users.update(
+            ShardAssignment.objects.values_list('shard').annotate(
+                count=Count('pk')
+            ).values_list('shard', 'count')
+        )
+        for shard in settings.DATABASE_SHARDS:
+            recipes = Recipe.objects.using(shard).count()
+            self.stdout.write(
+                f'{shard}: {users[shard]} users, {recipes} recipes'
+            )
+        self.stdout.write(
+            f'total recipes: {sharding.cross_shard_count(Recipe.objects)}'
+        )
+        return users
+
+    def _plan(self, users, max_moves):
+        """Return (user_id, source, target) moves towards an even spread"""
+        target_size = -(-sum(users.values()) // len(users))
+        moves = []
+        for source, count in sorted(users.items(), key=lambda i: -i[1]):
+            surplus = count - target_size
+            if surplus <= 0:
+                continue
+            user_ids = ShardAssignment.objects.filter(
+                shard=source, moving=False
+            ).values_list('user_id', flat=True)[:surplus]
+            for user_id in user_ids:
+                target = min(users, key=users.get)
+                if users[target] >= target_size or len(moves) >= max_moves:
+                    return moves
+                moves.append((user_id, source, target))
+                users[source] -= 1
+                users[target] += 1
+        return moves
+
+    def handle(self, *args, **options):
+        users = self._report()
+        moves = self._plan(users, options['max_moves'])
+        for user_id, source, target in moves:
+            self.stdout.write(f'Move user {user_id}: {source} -> {target}')
+            if not options['dry_run']:
+                sharding.move_user(
+                    user_id, target,
+                    drain_seconds=options['drain_seconds'],
+                    log=self.stdout.write
+                )
+        self.stdout.write(self.style.SUCCESS(f"Planned {len(moves)} moves"))
@@ -0,0 +1,70 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import similarity
+from core.models import Recipe
+
+
+class Command(BaseCommand):
+    """Django command to recompute every recipe similarity signature"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def _batches(self, using, batch_size):
+        """Yield the tokens of all recipes on a database in pk batches"""
+        recipes = Recipe.objects.using(using).order_by('pk').values_list(
+            'pk', flat=True
+        )
+        last_pk = 0
+        while True:
+            recipe_ids = list(recipes.filter(pk__gt=last_pk)[:batch_size])
+            if not recipe_ids:
+                return
+            last_pk = recipe_ids[-1]
+            tokens = similarity.recipe_token_sets(recipe_ids, using)
+            yield list(tokens.items())
+
+    def _rebuild(self, executor, using, batch_size, in_flight):
+        """Sign the recipes of one database, saving batches in order"""
+        pending = deque()
+        signed = 0
+
+        def save_oldest():
+            rows = [
+                similarity.signature_rows(*item)
+                for item in pending.popleft().result()
+            ]
+            similarity.save_signatures(rows, using)
+            return len(rows)
+
+        for batch in self._batches(using, batch_size):
+            pending.append(executor.submit(
+                similarity.sign_batch,
+                batch,
+                settings.RECIPE_MINHASH_PERMUTATIONS,
+                settings.RECIPE_LSH_BANDS
+            ))
+            if len(pending) >= in_flight:
+                signed += save_oldest()
+        while pending:
+            signed += save_oldest()
+        return signed
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'] or 1, 1)
+        # A single worker signs in this process, which also works where
+        # child processes cannot be started, e.g. in parallel test runs.
+        pool = ProcessPoolExecutor if workers > 1 else ThreadPoolExecutor
+        with pool(max_workers=workers) as executor:
+            for using in settings.DATABASE_SHARDS:
+                signed = self._rebuild(
+                    executor, using, options['batch_size'], workers * 2
+                )
+                self.stdout.write(f'{using}: signed {signed} recipes')
+        self.stdout.write(self.style.SUCCESS('Rebuilt recipe signatures'))
@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from core.models import RecipeStats
+
+
+class Command(BaseCommand):
+    """Django command to recompute per-user recipe stats rollups"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids'] or get_user_model().objects.values_list(
+            'id', flat=True
+        ).iterator()
+        rebuilt = 0
+        for user_id in user_ids:
+            RecipeStats.objects.rebuild(user_id)
+            rebuilt += 1
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt stats for {rebuilt} users")
+        )
@@ -0,0 +1,157 @@
+import mimetypes
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse
+)
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_safe
+
+from core.storage import CHUNK_SIZE
+
+# Names made by content_addressed_name end in the digest of their content
+CONTENT_ADDRESSED_NAME = re.compile(r'(?:^|/)([0-9a-f]{64})\.\w+$')
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+IMMUTABLE_SECONDS = 365 * 24 * 60 * 60
+
+
+class RangeNotSatisfiable(ValueError):
+    """Raised for a byte range lying outside the file"""
+
+
+def parse_range(header, size):
+    """Return the (first, last) byte of a Range header, None for all bytes
+
+    Only a single range is honoured; a list of ranges or a header that
+    does not parse is answered with the whole file, as RFC 7233 allows.
+    """
+    match = BYTE_RANGE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        suffix = int(last)
+        if not suffix or not size:
+            raise RangeNotSatisfiable(header)
+        return max(size - suffix, 0), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable(header)
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+def file_etag(name, size):
+    """Return the strong ETag of a stored file and whether it is immutable
+
+    A content-addressed name already holds the digest of the file, so
+    neither the file nor its metadata has to be read for it.
+    """
+    match = CONTENT_ADDRESSED_NAME.search(name)
+    if match:
+        return f'"{match.group(1)}"', True
+    try:
+        modified = int(default_storage.get_modified_time(name).timestamp())
+    except (NotImplementedError, OSError):
+        modified = 0
+    return f'"{size:x}-{modified:x}"', False
+
+
+def _read_range(file, first, length):
+    """Yield `length` bytes of a file starting at `first`, then close it"""
+    try:
+        file.seek(first)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def _offload(response, name):
+    """Let the front proxy send the file body instead of this worker"""
+    if settings.MEDIA_OFFLOAD == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = (
+            settings.MEDIA_OFFLOAD_PREFIX + quote(name)
+        )
+    elif settings.MEDIA_OFFLOAD == 'x-sendfile':
+        response['X-Sendfile'] = default_storage.path(name)
+    return response
+
+
+@require_safe
+def serve(request, name):
+    """Serve a stored media file with cache validators and byte ranges
+
+    Content-addressed recipe images never change under their name, so
+    they are cached for a year without revalidation. With MEDIA_OFFLOAD
+    set the response carries only headers and the front proxy sends the
+    bytes, ranges included.
+    """
+    name = posixpath.normpath(name).lstrip('/')
+    if name.startswith('..') or not default_storage.exists(name):
+        raise Http404
+    size = default_storage.size(name)
+    etag, immutable = file_etag(name, size)
+
+    def with_headers(response):
+        response['ETag'] = etag
+        response['Accept-Ranges'] = 'bytes'
+        if immutable:
+            patch_cache_control(response, public=True, immutable=True,
+                                max_age=IMMUTABLE_SECONDS)
+        else:
+            patch_cache_control(response, public=True,
+                                max_age=settings.MEDIA_CACHE_SECONDS)
+        return response
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    if if_none_match.strip() == '*' or etag in (
+        tag.strip() for tag in if_none_match.split(',')
+    ):
+        return with_headers(HttpResponseNotModified())
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if settings.MEDIA_OFFLOAD:
+        return with_headers(_offload(
+            HttpResponse(content_type=content_type), name
+        ))
+
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if 'HTTP_RANGE' in request.META and if_range in (None, etag):
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return with_headers(response)
+
+    file = default_storage.open(name, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+        response['Content-Length'] = size
+        return with_headers(response)
+
+    first, last = byte_range
+    response = StreamingHttpResponse(
+        _read_range(file, first, last - first + 1),
+        status=206, content_type=content_type
+    )
+    response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    response['Content-Length'] = last - first + 1
+    return with_headers(response)
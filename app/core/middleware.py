@@ -0,0 +1,159 @@
+from django.conf import settings
+from django.core.handlers.exception import convert_exception_to_response
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.module_loading import import_string
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+
+def _compress_brotli(content):
+    """Compress content with brotli tuned for dynamic responses"""
+    return brotli.compress(content, quality=5)
+
+
+COMPRESSORS = {'gzip': compress_string}
+if brotli is not None:
+    COMPRESSORS['br'] = _compress_brotli
+
+
+def parse_accept_encoding(header):
+    """Return the accepted codings mapped to their quality values"""
+    codings = {}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        codings[coding.strip().lower()] = quality
+    return codings
+
+
+def choose_encoding(header):
+    """Return the best supported coding for an Accept-Encoding header"""
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get('*', 0.0)
+    best, best_quality = None, 0.0
+    # Preference order breaks ties: brotli compresses JSON better than gzip.
+    for coding in ('br', 'gzip'):
+        if coding not in COMPRESSORS:
+            continue
+        quality = codings.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Compress responses with brotli or gzip based on Accept-Encoding
+
+    Responses below ``RESPONSE_COMPRESSION_MIN_SIZE`` bytes, streaming
+    responses and already encoded or incompressible content are left alone.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+
+        content_type = response.get('Content-Type', '')
+        if content_type.startswith(('image/', 'video/', 'audio/')):
+            return response
+
+        if len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        coding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        compressed_content = COMPRESSORS[coding](response.content)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response['Content-Length'] = str(len(response.content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = coding
+
+        return response
+
+
+class WebOnlyMiddleware:
+    """Run the ``WEB_ONLY_MIDDLEWARE`` stack for non-API requests only
+
+    Requests under ``API_PATH_PREFIXES`` skip the nested middleware and go
+    straight to the view. Others pass through it as if it were listed in
+    ``MIDDLEWARE`` at this position, view and exception hooks included.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+
+        handler = get_response
+        for middleware_path in reversed(settings.WEB_ONLY_MIDDLEWARE):
+            middleware = import_string(middleware_path)(handler)
+            if hasattr(middleware, 'process_view'):
+                self._view_middleware.insert(0, middleware.process_view)
+            if hasattr(middleware, 'process_template_response'):
+                self._template_response_middleware.append(
+                    middleware.process_template_response
+                )
+            if hasattr(middleware, 'process_exception'):
+                self._exception_middleware.append(
+                    middleware.process_exception
+                )
+            handler = convert_exception_to_response(middleware)
+        self._web_handler = handler
+
+    def _is_api(self, request):
+        return request.path_info.startswith(
+            tuple(settings.API_PATH_PREFIXES)
+        )
+
+    def __call__(self, request):
+        if self._is_api(request):
+            return self.get_response(request)
+        return self._web_handler(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if self._is_api(request):
+            return None
+        for process_view in self._view_middleware:
+            response = process_view(request, view_func, view_args,
+                                    view_kwargs)
+            if response is not None:
+                return response
+        return None
+
+    def process_template_response(self, request, response):
+        if self._is_api(request):
+            return response
+        for process_template_response in self._template_response_middleware:
+            response = process_template_response(request, response)
+        return response
+
+    def process_exception(self, request, exception):
+        if self._is_api(request):
+            return None
+        for process_exception in self._exception_middleware:
+            response = process_exception(request, exception)
+            if response is not None:
+                return response
+        return None
@@ -0,0 +1,23 @@
+# Generated by Django 2.1.15 on 2026-10-19 09:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_image_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardAssignment',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('shard', models.CharField(db_index=True, max_length=64)),
+                ('moving', models.BooleanField(default=False)),
+            ],
+        ),
+    ]
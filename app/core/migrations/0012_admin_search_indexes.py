@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# Admin prefix searches compile to UPPER(column::text) LIKE 'FOO%', which
+# only a matching expression index with pattern operators can serve.
+SEARCH_INDEXES = (
+    ('core_recipe_title_upper_like', 'core_recipe', 'title'),
+    ('core_tag_name_upper_like', 'core_tag', 'name'),
+    ('core_ingredient_name_upper_like', 'core_ingredient', 'name'),
+    ('core_user_email_upper_like', 'core_user', 'email'),
+    ('core_user_name_upper_like', 'core_user', 'name'),
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in SEARCH_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+            f'(UPPER({column}::text) text_pattern_ops)'
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_shard_assignment'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
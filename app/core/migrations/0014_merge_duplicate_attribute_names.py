@@ -0,0 +1,66 @@
+# Generated by Django 2.1.15 on 2026-10-19 10:04
+
+from django.db import migrations
+from django.db.models import Count, F, Min
+
+
+def merge_duplicate_names(apps, schema_editor):
+    """Merge tags and ingredients a user gave the same name
+
+    Recipe links move to the oldest object of each name and the others
+    are deleted, with tombstones so sync clients drop them too.
+    """
+    using = schema_editor.connection.alias
+    User = apps.get_model('core', 'User')
+    Recipe = apps.get_model('core', 'Recipe')
+    Tombstone = apps.get_model('core', 'Tombstone')
+
+    for kind, field in (('tag', 'tags'), ('ingredient', 'ingredients')):
+        model = apps.get_model('core', kind)
+        links = getattr(Recipe, field).through.objects.using(using)
+        column = f'{kind}_id'
+        duplicates = model.objects.using(using).values(
+            'user_id', 'name'
+        ).annotate(count=Count('id'), keep=Min('id')).filter(count__gt=1)
+
+        for row in duplicates:
+            extra = list(model.objects.using(using).filter(
+                user_id=row['user_id'], name=row['name']
+            ).exclude(pk=row['keep']).values_list('pk', flat=True))
+
+            linked = set(links.filter(
+                **{column: row['keep']}
+            ).values_list('recipe_id', flat=True))
+            touched = set()
+            for link in links.filter(**{f'{column}__in': extra}):
+                touched.add(link.recipe_id)
+                if link.recipe_id in linked:
+                    link.delete()
+                else:
+                    setattr(link, column, row['keep'])
+                    link.save()
+                    linked.add(link.recipe_id)
+
+            users = User.objects.using(using).filter(pk=row['user_id'])
+            users.update(change_seq=F('change_seq') + len(extra) + 1)
+            last = users.values_list('change_seq', flat=True).get()
+            Tombstone.objects.using(using).bulk_create(
+                Tombstone(user_id=row['user_id'], kind=kind, object_id=pk,
+                          change_seq=seq)
+                for seq, pk in enumerate(extra, start=last - len(extra))
+            )
+            Recipe.objects.using(using).filter(pk__in=touched).update(
+                change_seq=last
+            )
+            model.objects.using(using).filter(pk__in=extra).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_recipe_signature'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.1.15 on 2026-10-19 10:04
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    # Kept apart from the data migration before it, since Postgres cannot
+    # alter a table with deferred constraint checks pending from deletes.
+    dependencies = [
+        ('core', '0014_merge_duplicate_attribute_names'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='ingredient',
+            unique_together={('user', 'name')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='tag',
+            unique_together={('user', 'name')},
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.1.15 on 2026-10-19 11:04
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_image_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tombstone',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='pruned_seq',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
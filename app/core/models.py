@@ -1,6 +1,16 @@
-import uuid
 import os
-from django.db import models
+import uuid
+from decimal import Decimal
+from django.core.files.storage import default_storage
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    IntegrityError,
+    models,
+    router,
+    transaction
+)
+from django.db.models import F
+from django.utils import timezone
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
@@ -8,13 +18,13 @@ from django.contrib.auth.models import (
 )
 from django.conf import settings
 
+from core.rows import RowQuerySet
+from core.storage import content_addressed_name
 
-def recipe_image_file_path(instance, filename):
-    """Generate file path for new recipe image"""
-    ext = filename.split(".")[-1]
-    filename = f'{uuid.uuid4()}.{ext}'
 
-    return os.path.join("uploads/recipe/", filename)
+def recipe_image_file_path(instance, filename):
+    """Generate content-addressed file path for new recipe image"""
+    return content_addressed_name("uploads/recipe/", instance.image)
 
 
 class UserManager(BaseUserManager):
@@ -29,6 +39,17 @@ class UserManager(BaseUserManager):
 
         return user
 
+    def next_change_seq(self, user_id, count=1):
+        """Reserve change sequence numbers for a user and return the last one
+
+        The user row stays locked until the surrounding transaction ends, so
+        sequence numbers become visible in the order they were handed out.
+        """
+        queryset = self.filter(pk=user_id)
+        queryset.update(change_seq=F('change_seq') + count)
+
+        return queryset.values_list('change_seq', flat=True).get()
+
     def create_superuser(self, email, password):
         """Creates and saves a new super user"""
         user = self.create_user(email, password)
@@ -45,13 +66,61 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    change_seq = models.BigIntegerField(default=0, editable=False)
+    # Newest change sequence whose tombstones were pruned
+    pruned_seq = models.BigIntegerField(default=0, editable=False)
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
 
 
-class Tag(models.Model):
+class ChangeTrackedModel(models.Model):
+    """Model stamped with its owner's change sequence on every save"""
+    change_seq = models.BigIntegerField(default=0, editable=False)
+
+    # Fields whose stored values save receivers compare the new ones with
+    delta_fields = ()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember loaded values so writes can compute what changed"""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Stamp the next change sequence and save in one transaction"""
+        using = kwargs.get('using') or router.db_for_write(
+            type(self), instance=self
+        )
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'change_seq'}
+
+        with transaction.atomic(using=using):
+            self.change_seq = User.objects.db_manager(using).next_change_seq(
+                self.user_id
+            )
+            if self.delta_fields and not self._state.adding:
+                # Read under the owner's lock: the values this instance was
+                # loaded with may predate a concurrent save
+                self._loaded_values = type(self)._base_manager.using(
+                    using
+                ).filter(pk=self.pk).values(*self.delta_fields).first()
+            super().save(*args, **kwargs)
+
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+        }
+
+
+class Tag(ChangeTrackedModel):
     """Tag to be used for a recipe"""
     name = models.CharField(max_length=255)
     user = models.ForeignKey(
@@ -59,11 +128,17 @@ class Tag(models.Model):
         on_delete=models.CASCADE
     )
 
+    objects = RowQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'change_seq'])]
+        unique_together = (('user', 'name'),)
+
     def __str__(self):
         return self.name
 
 
-class Ingredient(models.Model):
+class Ingredient(ChangeTrackedModel):
     """Ingredients to be used in a recipe"""
     name = models.CharField(max_length=255)
     user = models.ForeignKey(
@@ -71,11 +146,17 @@ class Ingredient(models.Model):
         on_delete=models.CASCADE
     )
 
+    objects = RowQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'change_seq'])]
+        unique_together = (('user', 'name'),)
+
     def __str__(self):
         return self.name
 
 
-class Recipe(models.Model):
+class Recipe(ChangeTrackedModel):
     """Recipe objects"""
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -89,5 +170,205 @@ class Recipe(models.Model):
     tags = models.ManyToManyField("Tag")
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
 
+    objects = RowQuerySet.as_manager()
+
+    # Stats rollups and image reference counts move by the change
+    delta_fields = ('price', 'time_minutes', 'image')
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'change_seq'])]
+
     def __str__(self):
         return self.title
+
+
+class RecipeSignature(models.Model):
+    """MinHash signature of the tags and ingredients of a recipe"""
+    recipe = models.OneToOneField(
+        'Recipe',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='signature'
+    )
+    signature = models.BinaryField()
+
+    def __str__(self):
+        return f'Signature of recipe {self.recipe_id}'
+
+
+class LshBucket(models.Model):
+    """Bucket one band of a recipe signature hashes to"""
+    recipe = models.ForeignKey(
+        'Recipe',
+        on_delete=models.CASCADE,
+        related_name='lsh_buckets'
+    )
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=['band', 'bucket'])]
+
+    def __str__(self):
+        return f'Band {self.band} bucket {self.bucket}'
+
+
+class RecipeStatsManager(models.Manager):
+
+    def rebuild(self, user_id):
+        """Recompute and store the rollup for a user from their recipes"""
+        totals = Recipe.objects.filter(user_id=user_id).aggregate(
+            recipe_count=models.Count('id'),
+            price_total=models.Sum('price'),
+            time_minutes_total=models.Sum('time_minutes')
+        )
+        stats, _ = self.update_or_create(
+            user_id=user_id,
+            defaults={
+                'recipe_count': totals['recipe_count'],
+                'price_total': Decimal(str(totals['price_total'] or 0)),
+                'time_minutes_total': totals['time_minutes_total'] or 0,
+            }
+        )
+
+        return stats
+
+    def apply_delta(self, user_id, count, price, time_minutes):
+        """Add a change to the user's rollup, rebuilding it when missing"""
+        updated = self.filter(user_id=user_id).update(
+            recipe_count=F('recipe_count') + count,
+            price_total=F('price_total') + Decimal(str(price)),
+            time_minutes_total=F('time_minutes_total') + time_minutes
+        )
+        if not updated:
+            self.rebuild(user_id)
+
+
+class RecipeStats(models.Model):
+    """Per-user running totals of recipe metrics"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    recipe_count = models.PositiveIntegerField(default=0)
+    price_total = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0
+    )
+    time_minutes_total = models.BigIntegerField(default=0)
+
+    objects = RecipeStatsManager()
+
+    def __str__(self):
+        return f'Stats for user {self.user_id}'
+
+
+class ImageBlobManager(models.Manager):
+
+    def acquire(self, name):
+        """Count a new reference to a stored image
+
+        Call it before storing the file, so `collect` either sees the
+        reference and keeps the file or has removed it already and the
+        file is written again.
+        """
+        if self.filter(name=name).update(ref_count=F('ref_count') + 1):
+            return
+        try:
+            with transaction.atomic():
+                self.create(name=name, ref_count=1)
+        except IntegrityError:
+            self.filter(name=name).update(ref_count=F('ref_count') + 1)
+
+    def release(self, name, count=1, using=None):
+        """Drop references and delete the file once nothing uses it
+
+        `using` is the database of the recipes letting go of the image;
+        the file is only collected once its transaction commits.
+        """
+        self.filter(name=name).update(ref_count=F('ref_count') - count)
+        transaction.on_commit(lambda: self.collect(name, using), using=using)
+
+    def collect(self, name, using=None):
+        """Delete an image file and its blob row when nothing uses them
+
+        The blob row stays locked while the file goes, so a concurrent
+        `acquire` waits for it and then writes the file again.
+        """
+        with transaction.atomic(using=self.db):
+            blob = self.select_for_update().filter(name=name).first()
+            if blob is not None and blob.ref_count > 0:
+                return
+            # Images stored before reference counting have no blob row.
+            aliases = {using or DEFAULT_DB_ALIAS, *settings.DATABASE_SHARDS}
+            if any(Recipe._base_manager.using(alias).filter(
+                    image=name).exists() for alias in aliases):
+                return
+            default_storage.delete(name)
+            if blob is not None:
+                blob.delete()
+
+
+class ImageBlob(models.Model):
+    """Stored image file shared by every recipe with identical content"""
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+
+    objects = ImageBlobManager()
+
+    def __str__(self):
+        return self.name
+
+
+class ImageUpload(models.Model):
+    """Recipe image arriving in chunks over several requests"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+                          editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    size = models.PositiveIntegerField()
+    offset = models.PositiveIntegerField(default=0)
+    expires_at = models.DateTimeField(db_index=True)
+
+    @property
+    def path(self):
+        """Return the path of the file holding the bytes received so far"""
+        return os.path.join(settings.UPLOAD_SESSION_DIR, f'{self.pk}.part')
+
+    def __str__(self):
+        return f'{self.offset}/{self.size} bytes of recipe {self.recipe_id}'
+
+
+class ShardAssignment(models.Model):
+    """Database shard holding the data of one user"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    shard = models.CharField(max_length=64, db_index=True)
+    moving = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'User {self.user_id} on {self.shard}'
+
+
+class Tombstone(models.Model):
+    """Record of a deleted object kept for delta sync clients"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    kind = models.CharField(max_length=32)
+    object_id = models.IntegerField()
+    change_seq = models.BigIntegerField()
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'change_seq'])]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}'
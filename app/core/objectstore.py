@@ -0,0 +1,411 @@
+import hashlib
+import hmac
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from io import BytesIO
+from types import SimpleNamespace
+from urllib.parse import parse_qs, quote, unquote, urlencode, urlsplit
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.utils._os import safe_join
+from django.utils.deconstruct import deconstructible
+
+from core.storage import CHUNK_SIZE, ContentAddressedMixin
+
+try:
+    import boto3
+except ImportError:  # pragma: no cover - boto3 is optional
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+# Error codes S3-compatible stores answer for a missing object
+MISSING_CODES = ('404', 'NoSuchKey', 'NotFound')
+
+
+def s3_client():
+    """Return a boto3 S3 client configured from the settings"""
+    if boto3 is None:
+        raise ImproperlyConfigured(
+            'Install boto3 to keep media files in an object store.'
+        )
+    return boto3.client(
+        's3',
+        endpoint_url=settings.OBJECT_STORAGE_ENDPOINT_URL,
+        region_name=settings.OBJECT_STORAGE_REGION,
+    )
+
+
+@deconstructible
+class ObjectStorage(ContentAddressedMixin, Storage):
+    """Storage keeping files in an S3-compatible object store
+
+    Saving uploads the file to the bucket before returning, so a name is
+    only committed once its object exists. Files larger than
+    OBJECT_STORAGE_PART_SIZE go up as multipart uploads whose parts are
+    sent concurrently from a thread pool. URLs are presigned GETs, so
+    downloads go to the object store directly. Uploaded files stay in a
+    local cache of up to OBJECT_STORAGE_CACHE_BYTES, least recently used
+    ones evicted first, which serves reads without a round trip.
+
+    An existing name is not uploaded again. `client` takes anything with
+    the boto3 S3 client methods used here, such as FakeObjectStore.
+    """
+
+    def __init__(self, bucket=None, client=None, cache_dir=None,
+                 cache_bytes=None, part_size=None, upload_threads=None):
+        self.bucket = bucket or settings.OBJECT_STORAGE_BUCKET
+        self._client = client
+        self.cache_dir = cache_dir or settings.OBJECT_STORAGE_CACHE_DIR
+        self.cache_bytes = (
+            settings.OBJECT_STORAGE_CACHE_BYTES if cache_bytes is None
+            else cache_bytes
+        )
+        self.part_size = part_size or settings.OBJECT_STORAGE_PART_SIZE
+        self._executor = ThreadPoolExecutor(
+            max_workers=(upload_threads or
+                         settings.OBJECT_STORAGE_UPLOAD_THREADS),
+            thread_name_prefix='object-storage'
+        )
+        self._lock = threading.Lock()
+        self._cached = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = s3_client()
+        return self._client
+
+    # Local cache
+
+    def _cache_path(self, name):
+        return safe_join(self.cache_dir, name)
+
+    def _cache_index(self):
+        """Return {name: size} of cached files, least recently used first
+
+        Built from the cache directory on first use, so files cached
+        before a restart are counted and evicted too. Call with the lock
+        held.
+        """
+        if self._cached is None:
+            found = []
+            for directory, _, files in os.walk(self.cache_dir):
+                for file_name in files:
+                    path = os.path.join(directory, file_name)
+                    if file_name.startswith('.upload-'):
+                        continue
+                    stat = os.stat(path)
+                    name = os.path.relpath(path, self.cache_dir)
+                    found.append((stat.st_mtime, name.replace(os.sep, '/'),
+                                  stat.st_size))
+            self._cached = OrderedDict(
+                (name, size) for _, name, size in sorted(found)
+            )
+        return self._cached
+
+    def _write_temp(self, name, content):
+        """Write a file next to its cache path and return the temp path"""
+        directory = os.path.dirname(self._cache_path(name))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks(chunk_size=CHUNK_SIZE):
+                    temp_file.write(chunk)
+        except BaseException:
+            _remove(temp_path)
+            raise
+        return temp_path
+
+    def _evict(self, cached):
+        """Drop least recently used files over the cache budget
+
+        Every cached file is in the bucket too. Call with the lock held.
+        """
+        total = sum(cached.values())
+        for name in list(cached):
+            if total <= self.cache_bytes:
+                break
+            total -= cached.pop(name)
+            _remove(self._cache_path(name))
+
+    def _cached_path(self, name):
+        """Return the cache path of a file and mark it recently used"""
+        with self._lock:
+            cached = self._cache_index()
+            if name not in cached:
+                return None
+            cached.move_to_end(name)
+        return self._cache_path(name)
+
+    # Uploads
+
+    def _upload(self, name, path):
+        """Upload a file to the bucket, retrying failed attempts"""
+        attempts = settings.OBJECT_STORAGE_UPLOAD_ATTEMPTS
+        for attempt in range(1, attempts + 1):
+            try:
+                return self._upload_file(name, path)
+            except Exception:
+                if attempt == attempts:
+                    raise
+                logger.warning('Uploading %s failed, retrying', name,
+                               exc_info=True)
+                time.sleep(2 ** attempt / 10)
+
+    def _upload_part(self, name, path, upload_id, number):
+        """Send one part of a multipart upload, read from its own offset"""
+        with open(path, 'rb') as file:
+            file.seek((number - 1) * self.part_size)
+            data = file.read(self.part_size)
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=name, UploadId=upload_id,
+            PartNumber=number, Body=data
+        )
+        return {'ETag': response['ETag'], 'PartNumber': number}
+
+    def _upload_file(self, name, path):
+        """Send a file to the bucket, in concurrent parts when larger"""
+        content_type = (
+            mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        )
+        size = os.path.getsize(path)
+        if size <= self.part_size:
+            with open(path, 'rb') as file:
+                self.client.put_object(
+                    Bucket=self.bucket, Key=name, Body=file.read(),
+                    ContentType=content_type
+                )
+            return
+
+        upload_id = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=name, ContentType=content_type
+        )['UploadId']
+        futures = []
+        try:
+            # Each part is read by the thread sending it, so at most one
+            # part per upload thread is held in memory.
+            for number in range(1, -(-size // self.part_size) + 1):
+                futures.append(self._executor.submit(
+                    self._upload_part, name, path, upload_id, number
+                ))
+            parts = [future.result() for future in futures]
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=name, UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=name, UploadId=upload_id
+            )
+            raise
+
+    # Storage API
+
+    def _open(self, name, mode='rb'):
+        path = self._cached_path(name)
+        if path is not None:
+            try:
+                return File(open(path, mode), name=name)
+            except FileNotFoundError:
+                pass
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=name)
+        except self.client.exceptions.ClientError as exc:
+            if _is_missing(exc):
+                raise FileNotFoundError(name)
+            raise
+        return File(response['Body'], name=name)
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        temp_path = self._write_temp(name, content)
+        try:
+            self._upload(name, temp_path)
+            os.replace(temp_path, self._cache_path(name))
+        except BaseException:
+            _remove(temp_path)
+            raise
+        with self._lock:
+            cached = self._cache_index()
+            cached[name] = os.path.getsize(self._cache_path(name))
+            cached.move_to_end(name)
+            self._evict(cached)
+        return name
+
+    def delete(self, name):
+        with self._lock:
+            if self._cache_index().pop(name, None) is not None:
+                _remove(self._cache_path(name))
+        self.client.delete_object(Bucket=self.bucket, Key=name)
+
+    def _head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=name)
+        except self.client.exceptions.ClientError as exc:
+            if _is_missing(exc):
+                return None
+            raise
+
+    def exists(self, name):
+        if self._cached_path(name) is not None:
+            return True
+        return self._head(name) is not None
+
+    def size(self, name):
+        path = self._cached_path(name)
+        if path is not None:
+            return os.path.getsize(path)
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['ContentLength']
+
+    def url(self, name):
+        """Return a presigned GET URL of a file"""
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': name},
+            ExpiresIn=settings.OBJECT_STORAGE_URL_SECONDS
+        )
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _is_missing(exc):
+    """Return True when a client error means the object does not exist"""
+    return exc.response.get('Error', {}).get('Code') in MISSING_CODES
+
+
+class FakeClientError(Exception):
+    """Error shaped like botocore's ClientError"""
+
+    def __init__(self, code, operation):
+        super().__init__(f'{code} on {operation}')
+        self.response = {'Error': {'Code': code}}
+
+
+class FakeObjectStore:
+    """In-process stand-in for the boto3 S3 client methods ObjectStorage uses
+
+    Meant for tests: objects live in a dict, multipart uploads are
+    assembled from their parts, and presigned URLs carry an HMAC that
+    `verify_url` checks. `requests` records each call made.
+    """
+    exceptions = SimpleNamespace(ClientError=FakeClientError)
+
+    def __init__(self, endpoint='https://objects.example.com', secret=None):
+        self.endpoint = endpoint
+        self.secret = secret or uuid.uuid4().bytes
+        self.objects = {}
+        self.requests = []
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def _record(self, operation, **params):
+        with self._lock:
+            self.requests.append((operation, params.get('Key')))
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._record('put_object', Key=Key)
+        with self._lock:
+            self.objects[(Bucket, Key)] = bytes(Body)
+        return {'ETag': f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._record('create_multipart_upload', Key=Key)
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._record('upload_part', Key=Key)
+        with self._lock:
+            self._uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId,
+                                  MultipartUpload):
+        self._record('complete_multipart_upload', Key=Key)
+        with self._lock:
+            parts = self._uploads.pop(UploadId)
+            self.objects[(Bucket, Key)] = b''.join(
+                parts[part['PartNumber']]
+                for part in MultipartUpload['Parts']
+            )
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._record('abort_multipart_upload', Key=Key)
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+        return {}
+
+    def _object(self, operation, Bucket, Key):
+        self._record(operation, Key=Key)
+        try:
+            return self.objects[(Bucket, Key)]
+        except KeyError:
+            raise FakeClientError('404', operation)
+
+    def head_object(self, Bucket, Key):
+        data = self._object('head_object', Bucket, Key)
+        return {'ContentLength': len(data)}
+
+    def get_object(self, Bucket, Key):
+        data = self._object('get_object', Bucket, Key)
+        return {'Body': BytesIO(data), 'ContentLength': len(data)}
+
+    def delete_object(self, Bucket, Key):
+        self._record('delete_object', Key=Key)
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def _signature(self, path, expires):
+        return hmac.new(
+            self.secret, f'{path}:{expires}'.encode(), hashlib.sha256
+        ).hexdigest()
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        path = f"/{Params['Bucket']}/{quote(Params['Key'])}"
+        expires = int(time.time()) + ExpiresIn
+        query = urlencode({
+            'Expires': expires,
+            'Signature': self._signature(path, expires),
+        })
+        return f'{self.endpoint}{path}?{query}'
+
+    def verify_url(self, url):
+        """Return the object a presigned URL grants, None if it does not"""
+        parts = urlsplit(url)
+        query = parse_qs(parts.query)
+        expires = int(query['Expires'][0])
+        signature = self._signature(parts.path, expires)
+        if expires < time.time() or not hmac.compare_digest(
+            signature, query['Signature'][0]
+        ):
+            return None
+        bucket, _, key = parts.path[1:].partition('/')
+        return self.objects.get((bucket, unquote(key)))
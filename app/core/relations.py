@@ -0,0 +1,76 @@
+from django.contrib.auth import get_user_model
+
+from core import events, signals
+from core.models import Recipe
+
+
+def _link_column(field):
+    """Return the through table column naming the linked object"""
+    return f'{getattr(Recipe, field).field.m2m_reverse_field_name()}_id'
+
+
+def _diff(recipe, relations, using):
+    """Return {field: (added, removed)} of the links that need writing"""
+    diffs = {}
+    for field, ids in relations.items():
+        through = getattr(Recipe, field).through
+        current = set(through.objects.using(using).filter(
+            recipe_id=recipe.pk
+        ).values_list(_link_column(field), flat=True))
+        wanted = {getattr(item, 'pk', item) for item in ids}
+        if wanted != current:
+            diffs[field] = (wanted - current, current - wanted)
+    return diffs
+
+
+def _write(recipe, field, added, removed, using):
+    """Apply one relation's diff with at most one delete and one insert"""
+    through = getattr(Recipe, field).through
+    column = _link_column(field)
+    if removed:
+        through.objects.using(using).filter(
+            recipe_id=recipe.pk, **{f'{column}__in': removed}
+        )._raw_delete(using)
+    if added:
+        through.objects.using(using).bulk_create(
+            through(recipe_id=recipe.pk, **{column: pk}) for pk in added
+        )
+
+
+def write_relations(recipe, relations, using, seq=None):
+    """Set a recipe's tags or ingredients, writing only what differs
+
+    `relations` maps 'tags' and 'ingredients' to the wanted objects or
+    ids. Links that stay are left alone and nothing is written when no
+    link changes. Pass `seq` when the recipe row was already saved with a
+    new change sequence in this transaction.
+
+    Otherwise the recipe row is still written when its links change: a
+    single UPDATE of change_seq, and no other column, because delta sync
+    clients find changed links only through the recipe's change_seq.
+    Returns the names of the fields whose links changed.
+    """
+    diffs = _diff(recipe, relations, using)
+    if not diffs:
+        return []
+
+    if seq is None:
+        # Taking the sequence locks the owner's row, so the diff is
+        # re-read below in case a concurrent edit got in first.
+        seq = get_user_model().objects.db_manager(using).next_change_seq(
+            recipe.user_id
+        )
+        Recipe.objects.using(using).filter(pk=recipe.pk).update(
+            change_seq=seq
+        )
+        recipe.change_seq = seq
+        events.publish_on_commit(
+            using, recipe.user_id, seq, 'recipe', 'updated', [recipe.pk]
+        )
+        diffs = _diff(recipe, relations, using)
+
+    for field, (added, removed) in diffs.items():
+        _write(recipe, field, added, removed, using)
+    if diffs:
+        signals.refresh_signatures([recipe.pk], using)
+    return list(diffs)
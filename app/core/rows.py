@@ -0,0 +1,66 @@
+from collections import namedtuple
+from functools import lru_cache
+
+from django.db import models
+
+
+class RelatedPk(int):
+    """Primary key of a related object that serializers can read as `.pk`"""
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return int(self)
+
+
+@lru_cache(maxsize=None)
+def row_class(model, fields):
+    """Return a named tuple type for rows of `model` with `fields`"""
+    base = namedtuple(f'{model.__name__}Row', fields)
+
+    return type(base.__name__, (base,), {
+        '__slots__': (),
+        'pk': property(lambda self: self.id),
+    })
+
+
+class RowQuerySet(models.QuerySet):
+    """QuerySet able to return lightweight rows instead of model instances"""
+
+    def rows(self, *fields):
+        """Return named tuple rows holding only the requested fields
+
+        Many-to-many fields become lists of related primary keys, loaded
+        with a single query over the through table.
+        """
+        opts = self.model._meta
+        many = [f for f in fields if opts.get_field(f).many_to_many]
+        local = [f for f in fields if f not in many]
+        if 'id' not in local:
+            local.insert(0, 'id')
+        cls = row_class(self.model, tuple(local) + tuple(many))
+
+        rows = [
+            cls._make(values + tuple([] for _ in many))
+            for values in self.values_list(*local)
+        ]
+        if not many or not rows:
+            return rows
+
+        by_id = {}
+        for row in rows:
+            by_id.setdefault(row.id, []).append(row)
+        ids = self.order_by().values('pk')
+        for index, name in enumerate(many, start=len(local)):
+            field = opts.get_field(name)
+            through = field.remote_field.through
+            source = field.m2m_field_name() + '_id'
+            target = field.m2m_reverse_field_name() + '_id'
+            links = through.objects.using(self.db).filter(
+                **{f'{source}__in': ids}
+            ).order_by('pk').values_list(source, target)
+            for owner_id, related_id in links.iterator():
+                related_pk = RelatedPk(related_id)
+                for row in by_id.get(owner_id, ()):
+                    row[index].append(related_pk)
+        return rows
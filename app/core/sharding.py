@@ -0,0 +1,536 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+from itertools import chain
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    IntegrityError,
+    connections,
+    transaction
+)
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core.db_router import primary_of, read_alias
+from core.models import (
+    Tag,
+    Ingredient,
+    Recipe,
+    ImageUpload,
+    RecipeStats,
+    RecipeSignature,
+    LshBucket,
+    ShardAssignment,
+    Tombstone
+)
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Models whose rows live on the shard of the user owning them
+SHARDED_MODELS = {
+    'core.tag',
+    'core.ingredient',
+    'core.recipe',
+    'core.recipe_tags',
+    'core.recipe_ingredients',
+    'core.recipestats',
+    'core.recipesignature',
+    'core.lshbucket',
+    'core.tombstone',
+    'core.imageupload',
+}
+
+Placement = namedtuple('Placement', ('shard', 'moving'))
+
+_state = threading.local()
+
+
+def is_sharded():
+    """Return True when user data is spread over several databases"""
+    return len(settings.DATABASE_SHARDS) > 1
+
+
+def current_shard():
+    """Return the shard activated for the running code, if any"""
+    stack = getattr(_state, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def activate(alias):
+    """Route sharded queries to `alias` until `deactivate` is called"""
+    if not hasattr(_state, 'stack'):
+        _state.stack = []
+    _state.stack.append(alias)
+
+
+def deactivate():
+    """Undo the most recent `activate`"""
+    _state.stack.pop()
+
+
+class use_shard:
+    """Context manager routing sharded queries inside it to one shard"""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __enter__(self):
+        activate(self.alias)
+        return self.alias
+
+    def __exit__(self, *exc_info):
+        deactivate()
+
+
+def _cache_key(user_id):
+    return f'shard:{user_id}'
+
+
+def forget_placement(user_id):
+    """Drop the cached shard of a user after it changed"""
+    cache.delete(_cache_key(user_id))
+
+
+def ensure_shadow_user(user_id, alias):
+    """Create the stub user row a shard needs for its foreign keys
+
+    Users live on the primary database. Each shard keeps a stub row per
+    resident user so foreign keys hold and the change sequence counter is
+    locked in the same transaction as the data it numbers.
+    """
+    if alias == DEFAULT_DB_ALIAS:
+        return
+    User = get_user_model()
+    if User.objects.using(alias).filter(pk=user_id).exists():
+        return
+    email = User.objects.using(DEFAULT_DB_ALIAS).values_list(
+        'email', flat=True
+    ).get(pk=user_id)
+    shadow = User(pk=user_id, email=email, is_active=False)
+    shadow.set_unusable_password()
+    try:
+        with transaction.atomic(using=alias):
+            shadow.save(using=alias, force_insert=True)
+    except IntegrityError:
+        pass
+
+
+def placement_for_user(user_id):
+    """Return the shard holding a user's data, assigning one if needed"""
+    if not is_sharded():
+        return Placement(DEFAULT_DB_ALIAS, False)
+
+    placement = cache.get(_cache_key(user_id))
+    if placement is not None:
+        return Placement(*placement)
+
+    shards = settings.DATABASE_SHARDS
+    assignment, created = ShardAssignment.objects.using(
+        DEFAULT_DB_ALIAS
+    ).get_or_create(
+        user_id=user_id,
+        defaults={'shard': shards[user_id % len(shards)]}
+    )
+    if created:
+        ensure_shadow_user(user_id, assignment.shard)
+
+    placement = Placement(assignment.shard, assignment.moving)
+    cache.set(
+        _cache_key(user_id), tuple(placement), settings.SHARD_MAP_CACHE_SECONDS
+    )
+    return placement
+
+
+def shard_for_user(user_id):
+    """Return the database alias holding a user's data"""
+    return placement_for_user(user_id).shard
+
+
+def change_seq_for_user(user_id):
+    """Return a user's committed change sequence, read from their shard"""
+    return _user_seq(user_id, shard_for_user(user_id))
+
+
+def cross_shard(queryset):
+    """Iterate over the results of a queryset on every shard"""
+    return chain.from_iterable(
+        queryset.using(alias) for alias in settings.DATABASE_SHARDS
+    )
+
+
+def cross_shard_count(queryset):
+    """Return the number of matching rows summed over every shard"""
+    return sum(
+        queryset.using(alias).count() for alias in settings.DATABASE_SHARDS
+    )
+
+
+class ShardRouter:
+    """Send queries on user-owned models to the active user's shard"""
+
+    def _shard(self, model, hints):
+        if model._meta.label_lower not in SHARDED_MODELS:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return current_shard()
+
+    def db_for_read(self, model, **hints):
+        shard = self._shard(model, hints)
+        if shard is None or shard != primary_of(shard):
+            return shard
+        # The primary's reads are spread by ReplicaRouter
+        if shard == DEFAULT_DB_ALIAS:
+            return None
+        return read_alias(shard)
+
+    def db_for_write(self, model, **hints):
+        shard = self._shard(model, hints)
+        return shard if shard is None else primary_of(shard)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        dbs = {primary_of(obj1._state.db), primary_of(obj2._state.db)}
+        if not dbs <= set(settings.DATABASE_SHARDS):
+            return None
+        if len(dbs) == 1:
+            return True
+        # Users live on the primary and have a stub row on every shard.
+        return any(
+            primary_of(obj._state.db) == DEFAULT_DB_ALIAS
+            and obj._meta.label_lower not in SHARDED_MODELS
+            for obj in (obj1, obj2)
+        )
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+class ShardMoving(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Your data is being moved, please retry shortly.'
+    default_code = 'shard_moving'
+
+
+class UserShardMixin:
+    """Route the ORM queries of an API view to the user's shard"""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not request.user.is_authenticated:
+            return
+
+        placement = placement_for_user(request.user.pk)
+        if placement.moving and request.method not in SAFE_METHODS:
+            raise ShardMoving()
+        activate(placement.shard)
+        self._shard_activated = True
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if getattr(self, '_shard_activated', False):
+            deactivate()
+            self._shard_activated = False
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+def interleave_sequences(alias):
+    """Make id sequences of a Postgres shard hand out ids no other uses
+
+    Shard number k of n issues ids congruent to k modulo n, so tags,
+    ingredients and recipes keep their ids when a user changes shard.
+    Run migrate on every shard again after adding one.
+    """
+    shards = settings.DATABASE_SHARDS
+    connection = connections[alias]
+    if alias not in shards or len(shards) < 2:
+        return
+    if connection.vendor != 'postgresql':
+        return
+
+    count, offset = len(shards), shards.index(alias) + 1
+    with connection.cursor() as cursor:
+        for model in (Tag, Ingredient, Recipe):
+            table = model._meta.db_table
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+            sequence = cursor.fetchone()[0]
+            cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}')
+            next_id = cursor.fetchone()[0] + 1
+            next_id += (offset - next_id) % count
+            cursor.execute(f'ALTER SEQUENCE {sequence} INCREMENT BY {count}')
+            cursor.execute('SELECT setval(%s, %s, false)', [sequence, next_id])
+
+
+# Rows hanging off a recipe, and whether they keep their primary key
+RECIPE_ROWS = (
+    (Recipe.tags.through, False),
+    (Recipe.ingredients.through, False),
+    (RecipeSignature, True),
+    (LshBucket, False),
+)
+
+KINDS = {'tag': Tag, 'ingredient': Ingredient, 'recipe': Recipe}
+
+# Order in which a user's rows are copied so foreign keys always resolve
+COPY_ORDER = (
+    (Tag, True),
+    (Ingredient, True),
+    (Recipe, True),
+    *RECIPE_ROWS,
+    (Tombstone, False),
+    (RecipeStats, True),
+    (ImageUpload, True),
+)
+
+
+def _owned(model, user_id, alias):
+    """Return the rows of `model` belonging to a user on one database"""
+    manager = model._base_manager.using(alias)
+    if model in dict(RECIPE_ROWS):
+        return manager.filter(recipe__user_id=user_id)
+    return manager.filter(user_id=user_id)
+
+
+def _user_seq(user_id, alias):
+    """Return the change sequence counter of a user on one database"""
+    return get_user_model()._base_manager.using(alias).values_list(
+        'change_seq', flat=True
+    ).get(pk=user_id)
+
+
+def _remap_row(row, remap):
+    """Point a row's foreign keys at the target ids of rows given new ones"""
+    for field in type(row)._meta.concrete_fields:
+        ids = remap.get(field.related_model) if field.is_relation else None
+        if ids:
+            value = getattr(row, field.attname)
+            setattr(row, field.attname, ids.get(value, value))
+
+
+def _insert(rows, target, remap):
+    """Insert copied rows, giving new ids to those whose id is taken
+
+    Interleaved Postgres sequences keep ids unique across shards. Other
+    databases may already use the id for another user's row; the copy then
+    gets a fresh id and `remap` records it for the rows referring to it.
+    """
+    model = type(rows[0])
+    for row in rows:
+        _remap_row(row, remap)
+    ids = remap.get(model)
+    if ids is not None:
+        taken = set(model._base_manager.using(target).filter(
+            pk__in=[row.pk for row in rows]
+        ).values_list('pk', flat=True))
+        fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+        for row in [row for row in rows if row.pk in taken]:
+            ids[row.pk] = model._base_manager._insert(
+                [row], fields=fields, return_id=True, using=target
+            )
+        rows = [row for row in rows if row.pk not in taken]
+    model._base_manager.using(target).bulk_create(rows)
+
+
+def _copy_rows(queryset, target, keep_pk, batch_size, remap):
+    """Insert rows of a source queryset into the target in pk batches"""
+    copied, last_pk = 0, None
+    while True:
+        page = queryset.order_by('pk')
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        rows = list(page[:batch_size])
+        if not rows:
+            return copied
+        last_pk = rows[-1].pk
+        if not keep_pk:
+            for row in rows:
+                row.pk = None
+        _insert(rows, target, remap)
+        copied += len(rows)
+
+
+def _upsert(obj, user_id, target, remap):
+    """Write a source row over its copy on the target, without signals"""
+    model = type(obj)
+    _remap_row(obj, remap)
+    values = {
+        field.attname: getattr(obj, field.attname)
+        for field in model._meta.concrete_fields if not field.primary_key
+    }
+    pk = remap.get(model, {}).get(obj.pk, obj.pk)
+    if not _owned(model, user_id, target).filter(pk=pk).update(**values):
+        _insert([obj], target, remap)
+
+
+def _delete_copy(model, pk, user_id, target, remap):
+    """Delete a copied row and its relation rows on the target"""
+    pk = remap[model].get(pk, pk)
+    if not _owned(model, user_id, target).filter(pk=pk).exists():
+        return
+    links = {
+        Tag: [(Recipe.tags.through, 'tag_id')],
+        Ingredient: [(Recipe.ingredients.through, 'ingredient_id')],
+        Recipe: [(rows, 'recipe_id') for rows, _ in RECIPE_ROWS],
+    }[model]
+    for through, column in links:
+        through._base_manager.using(target).filter(**{column: pk}).delete()
+    # Raw deletes keep the target from recording tombstones of its own.
+    model._base_manager.using(target).filter(pk=pk)._raw_delete(target)
+
+
+def _sync_changes(user_id, source, target, since, remap):
+    """Apply changes made on the source after `since` to the target"""
+    changed = 0
+    for model in (Tag, Ingredient, Recipe):
+        for obj in _owned(model, user_id, source).filter(
+                change_seq__gt=since):
+            _upsert(obj, user_id, target, remap)
+            changed += 1
+
+    recipe_ids = list(_owned(Recipe, user_id, source).filter(
+        change_seq__gt=since
+    ).values_list('pk', flat=True))
+    for model, keep_pk in RECIPE_ROWS:
+        model._base_manager.using(target).filter(
+            recipe_id__in=[remap[Recipe].get(pk, pk) for pk in recipe_ids]
+        ).delete()
+        _copy_rows(
+            model._base_manager.using(source).filter(
+                recipe_id__in=recipe_ids
+            ),
+            target, keep_pk, 1000, remap
+        )
+
+    tombstones = _owned(Tombstone, user_id, source).filter(
+        change_seq__gt=since
+    )
+    for tombstone in tombstones:
+        _delete_copy(
+            KINDS[tombstone.kind], tombstone.object_id, user_id, target, remap
+        )
+        changed += 1
+    _copy_rows(tombstones, target, False, 1000, remap)
+
+    for stats in _owned(RecipeStats, user_id, source):
+        _upsert(stats, user_id, target, remap)
+    return changed
+
+
+def _retire_old_ids(user_id, target, remap, seq):
+    """Tell sync clients about rows that got new ids on the target
+
+    Each old id gets a tombstone and its row a new change sequence, so
+    clients drop the old id and fetch the row under its new one.
+    """
+    kinds = {model: kind for kind, model in KINDS.items()}
+    tombstones = []
+    for model, ids in remap.items():
+        model._base_manager.using(target).filter(
+            pk__in=ids.values()
+        ).update(change_seq=seq)
+        tombstones += [
+            Tombstone(user_id=user_id, kind=kinds[model], object_id=old,
+                      change_seq=seq)
+            for old in ids
+        ]
+    Tombstone.objects.using(target).bulk_create(tombstones)
+
+
+def _delete_user_rows(user_id, alias, batch_size):
+    """Remove every row of a user from a database without signals"""
+    for model, _ in reversed(COPY_ORDER):
+        queryset = _owned(model, user_id, alias)
+        while True:
+            pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            model._base_manager.using(alias).filter(pk__in=pks)._raw_delete(
+                alias
+            )
+
+
+def _set_placement(user_id, **fields):
+    """Update a user's shard assignment and drop cached copies of it"""
+    ShardAssignment.objects.using(DEFAULT_DB_ALIAS).filter(
+        user_id=user_id
+    ).update(**fields)
+    forget_placement(user_id)
+
+
+def move_user(user_id, target, drain_seconds=None, batch_size=1000,
+              log=logger.info):
+    """Move a user's data to another shard while the user stays online
+
+    Rows are bulk copied and then caught up from the change sequence while
+    reads and writes continue. Writes are refused only for the short
+    cutover, which waits for cached shard mappings to expire first. The
+    source rows are removed only after cached mappings from before the
+    switch have expired too, so no process still reading them finds an
+    empty account.
+    """
+    if target not in settings.DATABASE_SHARDS:
+        raise ValueError(f'{target} is not a configured shard')
+    source = shard_for_user(user_id)
+    if source == target:
+        log(f'User {user_id} already lives on {target}')
+        return
+    if drain_seconds is None:
+        drain_seconds = settings.SHARD_MAP_CACHE_SECONDS + 2
+
+    ensure_shadow_user(user_id, target)
+    _delete_user_rows(user_id, target, batch_size)
+    remap = {model: {} for model in KINDS.values()}
+    mark = _user_seq(user_id, source)
+    for model, keep_pk in COPY_ORDER:
+        copied = _copy_rows(
+            _owned(model, user_id, source), target, keep_pk, batch_size,
+            remap
+        )
+        log(f'Copied {copied} {model._meta.verbose_name_plural}')
+
+    for _ in range(5):
+        seq = _user_seq(user_id, source)
+        if seq == mark:
+            break
+        changed = _sync_changes(user_id, source, target, mark, remap)
+        log(f'Caught up {changed} changes')
+        mark = seq
+
+    log(f'Pausing writes for {drain_seconds}s to cut over')
+    _set_placement(user_id, moving=True)
+    try:
+        time.sleep(drain_seconds)
+        _sync_changes(user_id, source, target, mark, remap)
+        seq = _user_seq(user_id, source)
+        if any(remap.values()):
+            seq += 1
+            _retire_old_ids(user_id, target, remap, seq)
+            log(f'Gave {sum(map(len, remap.values()))} rows new ids')
+        users = get_user_model()._base_manager
+        pruned = users.using(source).values_list(
+            'pruned_seq', flat=True
+        ).get(pk=user_id)
+        users.using(target).filter(pk=user_id).update(
+            change_seq=seq, pruned_seq=pruned
+        )
+        _set_placement(user_id, shard=target, moving=False)
+    except BaseException:
+        _set_placement(user_id, moving=False)
+        raise
+
+    # Processes still holding the old placement read from the source and
+    # refuse writes, as it says the user is moving, until it expires.
+    log(f'Waiting {drain_seconds}s before removing rows from {source}')
+    time.sleep(drain_seconds)
+    _delete_user_rows(user_id, source, batch_size)
+    if source != DEFAULT_DB_ALIAS:
+        get_user_model()._base_manager.using(source).filter(
+            pk=user_id
+        )._raw_delete(source)
+    log(f'Moved user {user_id} from {source} to {target}')
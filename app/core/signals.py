@@ -0,0 +1,270 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_migrate,
+    post_save,
+    pre_delete,
+    pre_save
+)
+from django.db import transaction
+from django.dispatch import receiver
+
+from core import events, sharding
+from core.models import (
+    Tag,
+    Ingredient,
+    Recipe,
+    RecipeStats,
+    ImageBlob,
+    ShardAssignment,
+    Tombstone
+)
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+def record_tombstone(sender, instance, using, **kwargs):
+    """Leave a tombstone so sync clients learn about the deletion"""
+    seq = get_user_model().objects.db_manager(using).next_change_seq(
+        instance.user_id
+    )
+    Tombstone.objects.using(using).create(
+        user_id=instance.user_id,
+        kind=sender._meta.model_name,
+        object_id=instance.pk,
+        change_seq=seq
+    )
+    events.publish_on_commit(
+        using, instance.user_id, seq, sender._meta.model_name, 'deleted',
+        [instance.pk]
+    )
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=Recipe)
+def publish_saved_object(sender, instance, created, using, **kwargs):
+    """Tell change stream subscribers about a created or updated object"""
+    events.publish_on_commit(
+        using, instance.user_id, instance.change_seq,
+        sender._meta.model_name, 'created' if created else 'updated',
+        [instance.pk]
+    )
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def touch_recipes_of_deleted_attribute(sender, instance, using, **kwargs):
+    """Mark recipes losing a tag or ingredient as changed"""
+    relation = 'tags' if sender is Tag else 'ingredients'
+    recipe_ids = list(Recipe.objects.using(using).filter(
+        **{relation: instance}
+    ).values_list('pk', flat=True))
+    if recipe_ids:
+        seq = get_user_model().objects.db_manager(using).next_change_seq(
+            instance.user_id
+        )
+        Recipe.objects.using(using).filter(pk__in=recipe_ids).update(
+            change_seq=seq
+        )
+        events.publish_on_commit(
+            using, instance.user_id, seq, 'recipe', 'updated', recipe_ids
+        )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def touch_recipe_on_relation_change(sender, instance, action, reverse,
+                                    pk_set, using, **kwargs):
+    """Mark recipes as changed when their tags or ingredients change"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif pk_set:
+        recipe_ids = list(pk_set)
+    else:
+        return
+
+    seq = get_user_model().objects.db_manager(using).next_change_seq(
+        instance.user_id
+    )
+    Recipe.objects.using(using).filter(pk__in=recipe_ids).update(
+        change_seq=seq
+    )
+    events.publish_on_commit(
+        using, instance.user_id, seq, 'recipe', 'updated', recipe_ids
+    )
+    if not reverse:
+        instance.change_seq = seq
+
+
+def refresh_signatures(recipe_ids, using):
+    """Recompute recipe signatures once the current transaction commits"""
+    def update():
+        # Imported on first use so process startup does not load numpy
+        from core import similarity
+        similarity.update_signatures(recipe_ids, using)
+
+    transaction.on_commit(update, using=using)
+
+
+@receiver(post_save, sender=Recipe)
+def sign_created_recipe(sender, instance, created, using, **kwargs):
+    """Give a new recipe its similarity signature"""
+    if created:
+        refresh_signatures([instance.pk], using)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def resign_recipe_on_relation_change(sender, instance, action, reverse,
+                                     pk_set, using, **kwargs):
+    """Recompute signatures of recipes whose tags or ingredients changed"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        refresh_signatures([instance.pk], using)
+    elif pk_set:
+        refresh_signatures(list(pk_set), using)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_stats_on_save(sender, instance, created, **kwargs):
+    """Fold a created or edited recipe into the owner's stats rollup"""
+    if not settings.RECIPE_STATS_ROLLUP:
+        return
+
+    if created:
+        RecipeStats.objects.apply_delta(
+            instance.user_id, 1, instance.price, instance.time_minutes
+        )
+        return
+
+    old = getattr(instance, '_loaded_values', None)
+    if old is None or 'price' not in old or 'time_minutes' not in old:
+        RecipeStats.objects.rebuild(instance.user_id)
+        return
+
+    RecipeStats.objects.apply_delta(
+        instance.user_id,
+        0,
+        Decimal(str(instance.price)) - Decimal(str(old['price'])),
+        instance.time_minutes - old['time_minutes']
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def update_recipe_stats_on_delete(sender, instance, **kwargs):
+    """Remove a deleted recipe from the owner's stats rollup"""
+    if not settings.RECIPE_STATS_ROLLUP:
+        return
+
+    RecipeStats.objects.apply_delta(
+        instance.user_id, -1, -Decimal(str(instance.price)),
+        -instance.time_minutes
+    )
+
+
+def _file_name(value):
+    """Return the storage name of a file field value"""
+    return getattr(value, 'name', value) or ''
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_previous_image(sender, instance, raw, using, **kwargs):
+    """Note which image the recipe pointed to before this save"""
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is not None and 'image' in loaded:
+        instance._previous_image = _file_name(loaded['image'])
+    elif instance.pk is None:
+        instance._previous_image = ''
+    else:
+        instance._previous_image = _file_name(
+            Recipe.objects.using(using).filter(pk=instance.pk).values_list(
+                'image', flat=True
+            ).first()
+        )
+
+
+@receiver(pre_save, sender=Recipe)
+def store_new_image(sender, instance, raw, using, **kwargs):
+    """Count the reference to a new image, then store its file
+
+    Storing skips content that is already there, so the reference has to
+    be counted first or the file could be collected meanwhile.
+    """
+    image = instance.image
+    if raw or not image or image._committed:
+        return
+
+    field = sender._meta.get_field('image')
+    name = field.generate_filename(instance, image.name)
+    ImageBlob.objects.acquire(name)
+    try:
+        image.name = image.storage.save(
+            name, image.file, max_length=field.max_length
+        )
+    except BaseException:
+        ImageBlob.objects.release(name, using=using)
+        raise
+    # Keeps FileField.pre_save from storing the file again
+    image._committed = True
+    instance._acquired_image = image.name
+
+
+@receiver(post_save, sender=Recipe)
+def count_image_references(sender, instance, using, **kwargs):
+    """Move the image reference when a recipe gets a new image"""
+    previous = getattr(instance, '_previous_image', '')
+    current = _file_name(instance.image)
+    acquired = instance.__dict__.pop('_acquired_image', '')
+    if previous == current:
+        if acquired:
+            # The recipe already held a reference to the same image
+            ImageBlob.objects.release(acquired, using=using)
+        return
+
+    if current and current != acquired:
+        ImageBlob.objects.acquire(current)
+    if previous:
+        ImageBlob.objects.release(previous, using=using)
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_recipe_image(sender, instance, using, **kwargs):
+    """Drop the image reference held by a deleted recipe"""
+    name = _file_name(instance.image)
+    if name:
+        ImageBlob.objects.release(name, using=using)
+
+
+@receiver(pre_delete, sender=get_user_model())
+def delete_sharded_user_data(sender, instance, using, **kwargs):
+    """Cascade a user delete to the shard holding the user's data"""
+    shard = ShardAssignment.objects.using(using).filter(
+        user_id=instance.pk
+    ).values_list('shard', flat=True).first()
+    if shard and shard != using:
+        sender._base_manager.using(shard).filter(pk=instance.pk).delete()
+
+
+@receiver(post_migrate)
+def interleave_shard_sequences(sender, using, **kwargs):
+    """Keep object ids unique across shards after migrating one"""
+    if sender.name == 'core':
+        sharding.interleave_sequences(using)
+
+
+@receiver(post_delete, sender=get_user_model())
+def purge_user_leftovers(sender, instance, using, **kwargs):
+    """Drop rows recorded while the user's data was cascading away"""
+    Tombstone.objects.using(using).filter(user_id=instance.pk).delete()
+    RecipeStats.objects.using(using).filter(user_id=instance.pk).delete()
@@ -0,0 +1,161 @@
+import hashlib
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from core.models import Recipe, RecipeSignature, LshBucket
+
+# Universal hashing modulo a Mersenne prime, h(x) = (a * x + b) mod p
+PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint32(0xffffffff)
+
+
+def permutations(count):
+    """Return the fixed hash coefficients every signature is built with"""
+    rng = np.random.RandomState(0x5eed)
+    a = rng.randint(1, 1 << 32, size=count, dtype=np.uint64)
+    b = rng.randint(0, 1 << 32, size=count, dtype=np.uint64)
+    return a, b
+
+
+def minhash(tokens, count=None):
+    """Return the MinHash signature of a set of integer tokens
+
+    Two signatures agree at a position with probability equal to the
+    Jaccard similarity of the sets they were built from.
+    """
+    count = count or settings.RECIPE_MINHASH_PERMUTATIONS
+    if not tokens:
+        return np.full(count, MAX_HASH, dtype=np.uint32)
+    a, b = permutations(count)
+    x = np.asarray(tokens, dtype=np.uint64)[:, np.newaxis]
+    hashes = (x * a + b) % PRIME
+    return (hashes & np.uint64(MAX_HASH)).astype(np.uint32).min(axis=0)
+
+
+def band_buckets(signature, bands=None):
+    """Return the LSH bucket of every band of a signature
+
+    Recipes sharing a bucket in any band become candidates, so pairs with
+    high similarity are found without comparing every pair.
+    """
+    bands = bands or settings.RECIPE_LSH_BANDS
+    return [
+        int.from_bytes(
+            hashlib.blake2b(rows.tobytes(), digest_size=8).digest(),
+            'little',
+            signed=True
+        )
+        for rows in np.array_split(signature, bands)
+    ]
+
+
+def sign_batch(items, count=None, bands=None):
+    """Return signatures and buckets of (recipe id, tokens) pairs
+
+    Only computes, without touching the database, so batches can be
+    spread over worker processes.
+    """
+    signed = []
+    for recipe_id, tokens in items:
+        signature = minhash(tokens, count)
+        buckets = band_buckets(signature, bands) if tokens else []
+        signed.append((recipe_id, signature.tobytes(), buckets))
+    return signed
+
+
+def signature_rows(recipe_id, signature, buckets):
+    """Return the unsaved signature and bucket rows of one recipe"""
+    return RecipeSignature(recipe_id=recipe_id, signature=signature), [
+        LshBucket(recipe_id=recipe_id, band=band, bucket=bucket)
+        for band, bucket in enumerate(buckets)
+    ]
+
+
+def recipe_token_sets(recipe_ids, using=None):
+    """Return the tokens of each recipe, loaded with two queries
+
+    Tag ids become even and ingredient ids odd tokens, so a tag and an
+    ingredient sharing an id stay distinct members of the set.
+    """
+    tokens = {recipe_id: [] for recipe_id in recipe_ids}
+    for field, offset in (('tags', 0), ('ingredients', 1)):
+        through = getattr(Recipe, field).through
+        column = getattr(Recipe, field).field.m2m_reverse_field_name()
+        links = through.objects.db_manager(using).filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', f'{column}_id')
+        for recipe_id, related_id in links:
+            tokens[recipe_id].append(related_id * 2 + offset)
+    return tokens
+
+
+def save_signatures(rows, using=None):
+    """Replace the stored signatures and buckets of some recipes"""
+    recipe_ids = [signature.recipe_id for signature, _ in rows]
+    with transaction.atomic(using=using):
+        # Recipes deleted since their tokens were read must not come back.
+        existing = set(Recipe.objects.db_manager(using).filter(
+            pk__in=recipe_ids
+        ).values_list('pk', flat=True))
+        rows = [row for row in rows if row[0].recipe_id in existing]
+        LshBucket.objects.db_manager(using).filter(
+            recipe_id__in=recipe_ids
+        ).delete()
+        RecipeSignature.objects.db_manager(using).filter(
+            recipe_id__in=recipe_ids
+        ).delete()
+        RecipeSignature.objects.db_manager(using).bulk_create(
+            signature for signature, _ in rows
+        )
+        LshBucket.objects.db_manager(using).bulk_create(
+            bucket for _, buckets in rows for bucket in buckets
+        )
+
+
+def update_signatures(recipe_ids, using=None):
+    """Recompute the signatures of some recipes from their relations"""
+    tokens = recipe_token_sets(recipe_ids, using)
+    save_signatures([
+        signature_rows(*signed) for signed in sign_batch(tokens.items())
+    ], using)
+
+
+def similar_recipes(recipe, limit=10):
+    """Return (recipe id, estimated similarity) pairs most like a recipe
+
+    Candidates come from the LSH buckets the recipe falls into and are
+    ranked by the share of signature positions they agree on.
+    """
+    using = recipe._state.db
+    stored = RecipeSignature.objects.db_manager(using).filter(
+        recipe=recipe
+    ).values_list('signature', flat=True).first()
+    if stored is None:
+        update_signatures([recipe.pk], using)
+        stored = RecipeSignature.objects.db_manager(using).filter(
+            recipe=recipe
+        ).values_list('signature', flat=True).first()
+    signature = np.frombuffer(bytes(stored), dtype=np.uint32)
+
+    shared = Q(pk__in=[])
+    for band, bucket in LshBucket.objects.db_manager(using).filter(
+            recipe=recipe).values_list('band', 'bucket'):
+        shared |= Q(band=band, bucket=bucket)
+    candidates = LshBucket.objects.db_manager(using).filter(
+        shared, recipe__user_id=recipe.user_id
+    ).exclude(recipe=recipe).values('recipe_id')
+    rows = RecipeSignature.objects.db_manager(using).filter(
+        recipe_id__in=candidates
+    ).values_list('recipe_id', 'signature')
+
+    results = []
+    for recipe_id, other in rows:
+        other = np.frombuffer(bytes(other), dtype=np.uint32)
+        if other.shape != signature.shape:
+            continue
+        results.append((recipe_id, float((other == signature).mean())))
+    results.sort(key=lambda item: (-item[1], item[0]))
+    return results[:limit]
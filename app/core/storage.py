@@ -0,0 +1,156 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+import threading
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage
+from django.utils.deconstruct import deconstructible
+from django.utils.encoding import filepath_to_uri
+
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes identifying the image formats we store, mapped to extensions
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+)
+
+
+def sniff_extension(head):
+    """Return the file extension matching the leading bytes of an image"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    return 'img'
+
+
+def fingerprint(content):
+    """Return the sha256 digest and sniffed extension of a file
+
+    The file is hashed chunk by chunk so it is never held in memory whole,
+    and is rewound afterwards for the storage backend to read.
+    """
+    if not hasattr(content, 'chunks'):
+        content = File(content)
+
+    digest = hashlib.sha256()
+    head = b''
+    for chunk in content.chunks(chunk_size=CHUNK_SIZE):
+        if len(head) < 16:
+            head += chunk[:16 - len(head)]
+        digest.update(chunk)
+    content.seek(0)
+
+    return digest.hexdigest(), sniff_extension(head)
+
+
+def content_addressed_name(directory, content):
+    """Return the storage name derived from the content of a file"""
+    digest, ext = fingerprint(content)
+
+    return posixpath.join(directory, digest[:2], f'{digest}.{ext}')
+
+
+class ContentAddressedMixin:
+    """Storage mixin keeping names as given, for content-addressed names
+
+    Names are derived from the file content, so a file already stored
+    under a name holds the same bytes and is reused instead of renamed.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+
+class ContentAddressedStorage(ContentAddressedMixin, FileSystemStorage):
+    """File system storage writing each content-addressed name only once"""
+
+    def _save(self, name, content):
+        """Write the file unless identical content is already stored"""
+        if self.exists(name):
+            return name
+
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+
+        # Write next to the target and rename into place, so concurrent
+        # uploads of the same image never expose a partially written file.
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks(chunk_size=CHUNK_SIZE):
+                    temp_file.write(chunk)
+            mode = self.file_permissions_mode
+            os.chmod(temp_path, 0o644 if mode is None else mode)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return name.replace('\\', '/')
+
+
+@deconstructible
+class InMemoryStorage(ContentAddressedMixin, Storage):
+    """Storage keeping files in a dict of the current process
+
+    Meant for tests: nothing touches the disk, so parallel test processes
+    cannot collide on file names. An existing name is not written again.
+    """
+
+    def __init__(self, base_url=None):
+        self.base_url = settings.MEDIA_URL if base_url is None else base_url
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def _open(self, name, mode='rb'):
+        try:
+            return ContentFile(self._files[name], name=name)
+        except KeyError:
+            raise FileNotFoundError(name)
+
+    def _save(self, name, content):
+        data = b''.join(content.chunks(chunk_size=CHUNK_SIZE))
+        with self._lock:
+            self._files.setdefault(name, data)
+        return name
+
+    def delete(self, name):
+        with self._lock:
+            self._files.pop(name, None)
+
+    def exists(self, name):
+        return name in self._files
+
+    def size(self, name):
+        return len(self._files[name])
+
+    def url(self, name):
+        return urljoin(self.base_url, filepath_to_uri(name))
+
+    def listdir(self, path):
+        prefix = path.rstrip('/') + '/' if path else ''
+        directories, files = set(), []
+        for name in list(self._files):
+            if not name.startswith(prefix):
+                continue
+            head, _, tail = name[len(prefix):].partition('/')
+            if tail:
+                directories.add(head)
+            else:
+                files.append(head)
+        return sorted(directories), sorted(files)
@@ -0,0 +1,88 @@
+import sys
+import time
+import unittest
+
+from django.test.runner import (
+    DiscoverRunner,
+    ParallelTestSuite,
+    RemoteTestResult,
+    RemoteTestRunner,
+)
+
+
+class TimedRemoteTestResult(RemoteTestResult):
+    """Record how long each test took in a parallel worker process"""
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._started = time.perf_counter()
+
+    def stopTest(self, test):
+        # Replayed as result.addDuration(test, seconds) in the main process
+        self.events.append(
+            ('addDuration', self.test_index,
+             time.perf_counter() - self._started)
+        )
+        super().stopTest(test)
+
+
+class TimedRemoteTestRunner(RemoteTestRunner):
+    resultclass = TimedRemoteTestResult
+
+
+class TimedParallelTestSuite(ParallelTestSuite):
+    runner_class = TimedRemoteTestRunner
+
+
+class TimedTextTestResult(unittest.TextTestResult):
+    """Text result remembering the duration of every test"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.durations = {}
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._started = time.perf_counter()
+
+    def addDuration(self, test, seconds):
+        """Take the duration measured by a parallel worker"""
+        self.durations[test.id()] = seconds
+
+    def stopTest(self, test):
+        self.durations.setdefault(
+            test.id(), time.perf_counter() - self._started
+        )
+        super().stopTest(test)
+
+
+class TimedTestRunner(DiscoverRunner):
+    """Test runner listing the slowest tests after the run"""
+    parallel_test_suite = TimedParallelTestSuite
+
+    def __init__(self, slowest=10, **kwargs):
+        super().__init__(**kwargs)
+        self.slowest = slowest
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--slowest', type=int, default=10, metavar='N',
+            help='Report the N slowest tests, 0 to disable. Defaults to 10.'
+        )
+
+    def get_resultclass(self):
+        return super().get_resultclass() or TimedTextTestResult
+
+    def run_suite(self, suite, **kwargs):
+        result = super().run_suite(suite, **kwargs)
+        durations = getattr(result, 'durations', None)
+        if self.slowest and durations:
+            slowest = sorted(
+                durations.items(), key=lambda item: item[1], reverse=True
+            )[:self.slowest]
+            sys.stderr.write(f'\nSlowest {len(slowest)} tests:\n')
+            for test_id, seconds in slowest:
+                sys.stderr.write(f'{seconds:8.3f}s  {test_id}\n')
+        return result
@@ -1,6 +1,12 @@
-from django.test import TestCase, Client
+from unittest import skipUnless
+from unittest.mock import patch
+from django.conf import settings
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from core import sharding
+from core.admin import EstimatedCountPaginator
+from core.models import Tag, Recipe
 
 
 class AdminSiteTests(TestCase):
@@ -42,3 +48,100 @@ class AdminSiteTests(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
+
+    def test_delete_user_page_counts_data(self):
+        """Test that the delete page summarizes the user's data"""
+        Tag.objects.create(user=self.user, name="Vegan")
+        url = reverse("admin:core_user_delete", args=[self.user.id, ])
+        res = self.client.get(url)
+
+        self.assertContains(res, "Tags: 1")
+
+    def test_delete_user(self):
+        """Test that deleting a user from the admin removes their data"""
+        Tag.objects.create(user=self.user, name="Vegan")
+        url = reverse("admin:core_user_delete", args=[self.user.id, ])
+        self.client.post(url, {"post": "yes"})
+
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+        self.assertFalse(Tag.objects.exists())
+
+    def test_recipes_searched_and_filtered(self):
+        """Test that recipes can be searched and filtered by owner"""
+        Recipe.objects.create(
+            user=self.user, title="Soup", time_minutes=5, price=5
+        )
+        Recipe.objects.create(
+            user=self.admin_user, title="Salad", time_minutes=5, price=5
+        )
+        url = reverse("admin:core_recipe_changelist")
+
+        res = self.client.get(url, {"q": "so", "user": self.user.email})
+
+        self.assertContains(res, "Soup")
+        self.assertNotContains(res, "Salad")
+        self.assertContains(res, 'name="user"')
+
+    def test_recipe_change_page(self):
+        """Test that the recipe edit page uses autocomplete widgets"""
+        recipe = Recipe.objects.create(
+            user=self.user, title="Soup", time_minutes=5, price=5
+        )
+        url = reverse("admin:core_recipe_change", args=[recipe.id, ])
+        res = self.client.get(url)
+
+        self.assertContains(res, "admin-autocomplete")
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=100)
+    def test_large_counts_estimated(self):
+        """Test that the paginator trusts the estimate for large results"""
+        queryset = Recipe.objects.order_by("id")
+        with patch.object(EstimatedCountPaginator, "estimate") as estimate:
+            estimate.return_value = 5000
+            self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 5000)
+            estimate.return_value = 50
+            self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 0)
+
+
+@skipUnless('shard_2' in settings.DATABASES, 'needs a shard_2 database')
+@override_settings(DATABASE_SHARDS=['default', 'shard_2'])
+class ShardedAdminTests(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.client = Client()
+        self.admin_user = get_user_model().objects.create_superuser(
+            email="some@o2.pl",
+            password="test123"
+        )
+        self.client.force_login(self.admin_user)
+        user = get_user_model().objects.create_user(
+            email="test@o2.pl",
+            password="test123"
+        )
+        sharding.ensure_shadow_user(user.pk, 'shard_2')
+        self.tag = Tag.objects.using('shard_2').create(user=user, name="Vegan")
+
+    def test_change_page_on_other_shard(self):
+        """Test that the change form opens objects linked from a shard"""
+        url = reverse("admin:core_tag_changelist")
+        res = self.client.get(url, {"shard": "shard_2"})
+        change_url = reverse("admin:core_tag_change", args=[self.tag.pk])
+        self.assertContains(res, "_changelist_filters=shard%3Dshard_2")
+
+        res = self.client.get(
+            change_url, {"_changelist_filters": "shard=shard_2"}
+        )
+
+        self.assertContains(res, "Vegan")
+
+        res = self.client.post(
+            change_url + "?_changelist_filters=shard%3Dshard_2",
+            {"user": self.tag.user_id, "name": "Vegetarian"}
+        )
+
+        self.assertEqual(res.status_code, 302)
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.name, "Vegetarian")
@@ -0,0 +1,53 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError
+from django.test import TestCase
+
+from core import attributes
+from core.models import Tag
+
+
+class ResolveNamesTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+
+    def test_existing_and_missing_names(self):
+        """Test that existing names are reused and missing ones created"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+
+        with self.assertNumQueries(7):
+            found = attributes.resolve_names(
+                Tag, self.user.pk, ['Vegan', 'Quick', 'Cheap', 'Quick']
+            )
+
+        self.assertEqual(found['Vegan'], vegan.pk)
+        self.assertEqual(
+            set(Tag.objects.values_list('name', flat=True)),
+            {'Vegan', 'Quick', 'Cheap'}
+        )
+        self.assertEqual(found, dict(
+            Tag.objects.values_list('name', 'pk')
+        ))
+
+    def test_conflicting_batch_retried_by_name(self):
+        """Test that a batch losing a race is created name by name"""
+        create = attributes._create_named
+        calls = []
+
+        def racing(model, user_id, names, using):
+            calls.append(names)
+            if len(calls) == 1:
+                raise IntegrityError('duplicate key')
+            return create(model, user_id, names, using)
+
+        with patch('core.attributes._create_named', side_effect=racing):
+            found = attributes.resolve_names(Tag, self.user.pk, ['A', 'B'])
+
+        self.assertEqual(calls, [['A', 'B'], ['A'], ['B']])
+        self.assertEqual(set(found), {'A', 'B'})
+        self.assertEqual(Tag.objects.count(), 2)
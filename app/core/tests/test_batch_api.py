@@ -0,0 +1,154 @@
+import threading
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import events, views
+from core.db_router import PIN_COOKIE
+from core.models import Tag
+
+
+BATCH_URL = reverse('batch')
+
+
+class PublicBatchApiTests(TestCase):
+
+    def test_login_required(self):
+        """Test that batches need an authenticated user"""
+        res = APIClient().post(
+            BATCH_URL, {'requests': [{'path': '/api/user/me/'}]},
+            format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(BATCH_DB_CONNECTIONS=1)
+class PrivateBatchApiTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123',
+            name='Mike'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, *items):
+        return self.client.post(
+            BATCH_URL, {'requests': list(items)}, format='json'
+        )
+
+    def test_batch_of_reads(self):
+        """Test running several reads in one request"""
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        res = self.batch(
+            {'path': '/api/user/me/'},
+            {'path': '/api/recipe/tags/'},
+            {'path': '/api/recipe/missing/'},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['status'] for item in res.data], [200, 200, 404]
+        )
+        self.assertEqual(res.data[0]['body']['name'], 'Mike')
+        self.assertEqual(res.data[1]['body'][0]['name'], 'Vegan')
+
+    def test_writes_apply_in_order(self):
+        """Test that reads after a write see the write"""
+        res = self.batch(
+            {'path': '/api/recipe/tags/'},
+            {'method': 'POST', 'path': '/api/recipe/tags/',
+             'body': {'name': 'Vegan'}},
+            {'path': '/api/recipe/tags/'},
+        )
+
+        self.assertEqual(
+            [item['status'] for item in res.data], [200, 201, 200]
+        )
+        self.assertEqual(res.data[0]['body'], [])
+        self.assertEqual(len(res.data[2]['body']), 1)
+        self.assertIn(PIN_COOKIE, res.cookies)
+
+    def test_reads_do_not_pin(self):
+        """Test that a batch of reads leaves the client's reads unpinned"""
+        res = self.batch({'path': '/api/recipe/tags/'})
+
+        self.assertEqual(res.data[0]['status'], 200)
+        self.assertNotIn(PIN_COOKIE, res.cookies)
+
+    def test_other_paths_rejected(self):
+        """Test that only API paths can be batched"""
+        res = self.batch({'path': '/admin/'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_streams_rejected(self):
+        """Test that a streamed item fails alone and releases its stream"""
+        with mock.patch.object(events.Subscription, 'close') as close:
+            res = self.batch(
+                {'path': '/api/recipe/events/'},
+                {'path': '/api/user/me/'},
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['status'] for item in res.data], [400, 200]
+        )
+        close.assert_called_once_with()
+
+    @override_settings(BATCH_MAX_REQUESTS=2)
+    def test_batch_size_limited(self):
+        """Test that batches are capped"""
+        res = self.batch(*[{'path': '/api/user/me/'}] * 3)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(BATCH_DB_CONNECTIONS=3)
+class ConcurrentBatchApiTests(TransactionTestCase):
+
+    def test_reads_in_threads(self):
+        """Test that reads run on the thread pool"""
+        user = get_user_model().objects.create_user('test@o2.pl', 'pass123')
+        Tag.objects.create(user=user, name='Vegan')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        res = client.post(
+            BATCH_URL,
+            {'requests': [{'path': '/api/recipe/tags/'}] * 5},
+            format='json'
+        )
+
+        self.assertEqual(
+            [len(item['body']) for item in res.data], [1] * 5
+        )
+
+    def test_threads_shared_between_batches(self):
+        """Test that batches share one pool of database threads"""
+        user = get_user_model().objects.create_user('test@o2.pl', 'pass123')
+        client = APIClient()
+        client.force_authenticate(user)
+        threads = set()
+        run = views.run_sub_request
+
+        def record(*args):
+            threads.add(threading.current_thread().name)
+            return run(*args)
+
+        with mock.patch.object(views, 'run_sub_request', record):
+            for _ in range(3):
+                client.post(
+                    BATCH_URL,
+                    {'requests': [{'path': '/api/recipe/tags/'}] * 5},
+                    format='json'
+                )
+
+        self.assertLessEqual(len(threads), 3)
@@ -0,0 +1,200 @@
+import threading
+import time
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import coalescing
+from core.models import Recipe
+
+
+class SingleFlightTests(TestCase):
+
+    def _run_concurrently(self, flight, compute, count):
+        """Call flight.do from several threads while the first computes"""
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(flight.do('key', compute))
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    def _wait_for_waiters(self, flight, count):
+        """Block until `count` calls wait on the running computation"""
+        for _ in range(500):
+            if flight._flights['key'].waiters == count:
+                return
+            time.sleep(0.01)
+        self.fail('Calls did not start waiting')
+
+    def test_concurrent_calls_share_one_computation(self):
+        """Test that waiters get the result computed by the first call"""
+        flight = coalescing.SingleFlight('test')
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return ['recipe']
+
+        leader, results, _ = self._run_concurrently(flight, compute, 1)
+        started.wait(5)
+        followers, shared, _ = self._run_concurrently(flight, compute, 4)
+        self._wait_for_waiters(flight, 4)
+        release.set()
+        for thread in leader + followers:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results + shared, [['recipe']] * 5)
+        self.assertEqual(flight.stats(), {
+            'calls': 5, 'leaders': 1, 'followers': 4, 'shared': 0,
+            'timeouts': 0, 'errors': 0, 'ratio': 0.8,
+        })
+
+    def test_error_reaches_waiters(self):
+        """Test that waiters re-raise the error of the computation"""
+        flight = coalescing.SingleFlight('test')
+        started, release = threading.Event(), threading.Event()
+
+        def compute():
+            started.set()
+            release.wait(5)
+            raise ValueError('database went away')
+
+        leader, _, leader_errors = self._run_concurrently(flight, compute, 1)
+        started.wait(5)
+        followers, _, errors = self._run_concurrently(flight, compute, 2)
+        self._wait_for_waiters(flight, 2)
+        release.set()
+        for thread in leader + followers:
+            thread.join(5)
+
+        self.assertEqual(len(leader_errors + errors), 3)
+        self.assertEqual(flight.stats()['errors'], 1)
+        self.assertEqual(flight.stats()['followers'], 2)
+
+    def test_waiter_times_out_and_computes(self):
+        """Test that a waiter computes on its own after the timeout"""
+        flight = coalescing.SingleFlight('test', timeout=0.01)
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return 'slow'
+
+        leader, results, _ = self._run_concurrently(flight, slow, 1)
+        started.wait(5)
+        self.assertEqual(flight.do('key', lambda: 'own'), 'own')
+        release.set()
+        leader[0].join(5)
+
+        self.assertEqual(results, ['slow'])
+        self.assertEqual(flight.stats()['timeouts'], 1)
+
+    def test_shared_result_from_another_process(self):
+        """Test that a result stored through the cache is reused"""
+        flight = coalescing.SingleFlight('test', shared=True)
+        cache.set('coalesce:test:result:key', ['cached'])
+        self.addCleanup(cache.clear)
+
+        self.assertEqual(flight.do('key', lambda: ['computed']), ['cached'])
+        self.assertEqual(flight.stats()['shared'], 1)
+
+    def test_shared_lock_held_elsewhere_times_out(self):
+        """Test that a lock held by another process is waited on"""
+        flight = coalescing.SingleFlight('test', timeout=0.05, shared=True,
+                                         poll=0.01)
+        cache.set('coalesce:test:lock:key', 1)
+        self.addCleanup(cache.clear)
+
+        self.assertEqual(flight.do('key', lambda: 'own'), 'own')
+        self.assertEqual(flight.stats()['timeouts'], 1)
+
+    def test_request_key_normalizes_params(self):
+        """Test that parameter order does not change the key"""
+        factory = RequestFactory()
+        first = factory.get('/api/recipe/recipes/?tags=1&ingredients=2')
+        second = factory.get('/api/recipe/recipes/?ingredients=2&tags=1')
+        other = factory.get('/api/recipe/recipes/?tags=2&ingredients=2')
+
+        self.assertEqual(
+            coalescing.request_key(1, 5, first),
+            coalescing.request_key(1, 5, second)
+        )
+        self.assertNotEqual(
+            coalescing.request_key(1, 5, first),
+            coalescing.request_key(1, 6, first)
+        )
+        self.assertNotEqual(
+            coalescing.request_key(1, 5, first),
+            coalescing.request_key(1, 5, other)
+        )
+
+
+class CoalescedRecipeListTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl', 'haslo123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.addCleanup(cache.clear)
+
+    def test_formats_not_shared(self):
+        """Test that a read in one format never gets another's data"""
+        Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price='10.50'
+        )
+        url = reverse('recipe:recipe-list')
+
+        with patch.object(coalescing.recipe_lists, 'shared', True):
+            self.client.get(url, HTTP_ACCEPT='application/msgpack')
+            res = self.client.get(url)
+
+        self.assertEqual(res.json()[0]['price'], '10.50')
+
+
+class CoalescingStatsApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_stats_require_staff(self):
+        """Test that only staff users see coalescing stats"""
+        user = get_user_model().objects.create_user('test@o2.pl', 'haslo123')
+        self.client.force_authenticate(user)
+
+        res = self.client.get(reverse('coalescing-stats'))
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_stats(self):
+        """Test that staff users see the recipe list counters"""
+        admin = get_user_model().objects.create_superuser(
+            'admin@o2.pl', 'haslo123'
+        )
+        self.client.force_authenticate(admin)
+        flight = coalescing.SingleFlight('test')
+        flight.do('key', lambda: [])
+
+        with patch('core.coalescing.recipe_lists', flight):
+            res = self.client.get(reverse('coalescing-stats'))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['recipe_list']['leaders'], 1)
@@ -1,8 +1,18 @@
+import os
+import subprocess
+import sys
+from io import StringIO
 from unittest.mock import patch
+from django.conf import settings
 from django.core.management import call_command
 from django.db.utils import OperationalError
 from django.test import TestCase
 
+from core.management.commands.profile_imports import (
+    package_totals,
+    parse_importtime,
+)
+
 
 class CommandTests(TestCase):
 
@@ -21,3 +31,82 @@ class CommandTests(TestCase):
             gi.side_effect = [OperationalError] * 5 + [True]
             call_command("wait_for_db")
             self.assertEqual(gi.call_count, 6)
+
+
+IMPORTTIME_OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   numpy.core
+import time:        30 |        150 | numpy
+import time:        50 |         50 | django
+"""
+
+
+class ProfileImportsTests(TestCase):
+
+    def test_parse_importtime(self):
+        """Test that -X importtime output is parsed and grouped"""
+        rows = parse_importtime(IMPORTTIME_OUTPUT)
+
+        self.assertEqual(rows, [
+            ('numpy.core', 120, 120),
+            ('numpy', 30, 150),
+            ('django', 50, 50),
+        ])
+        self.assertEqual(package_totals(rows), {'numpy': 150, 'django': 50})
+
+    @patch('core.management.commands.profile_imports.Command._profile')
+    def test_report(self, profile):
+        """Test that the heaviest packages are reported per entry point"""
+        profile.return_value = parse_importtime(IMPORTTIME_OUTPUT)
+        out = StringIO()
+
+        call_command('profile_imports', 'manage.py', '--top', '1',
+                     stdout=out)
+
+        self.assertIn('manage.py: 3 modules in 0 ms', out.getvalue())
+        self.assertIn('numpy', out.getvalue())
+        self.assertNotIn('django', out.getvalue())
+
+    def test_setup_does_not_import_numpy(self):
+        """Test that numpy is left out of process startup"""
+        result = subprocess.run(
+            [sys.executable, '-c',
+             'import sys, django; django.setup(); '
+             'print("numpy" in sys.modules)'],
+            cwd=settings.BASE_DIR,
+            env=dict(os.environ,
+                     DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE),
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        )
+
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_urlconf_does_not_import_pillow(self):
+        """Test that Pillow is left out of loading the URLconf"""
+        result = subprocess.run(
+            [sys.executable, '-c',
+             'import sys, django; django.setup(); '
+             'from django.urls import get_resolver; '
+             'get_resolver().url_patterns; '
+             'print("PIL" in sys.modules)'],
+            cwd=settings.BASE_DIR,
+            env=dict(os.environ,
+                     DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE),
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        )
+
+        self.assertEqual(result.stdout.strip(), 'False')
+
+
+class WarmupTests(TestCase):
+
+    def test_warmup(self):
+        """Test that warming up imports deferred modules"""
+        from core.warmup import DEFERRED_IMPORTS, warmup
+
+        warmup()
+
+        for module in DEFERRED_IMPORTS:
+            self.assertIn(module, sys.modules)
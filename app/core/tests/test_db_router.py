@@ -0,0 +1,182 @@
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TransactionTestCase,
+    override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from core import db_router
+from core.models import Recipe
+
+
+REPLICAS = ['replica_1', 'replica_2']
+
+
+@override_settings(
+    DATABASE_REPLICAS=REPLICAS,
+    REPLICA_HEALTH_CHECK_INTERVAL=0,
+    REPLICA_MAX_LAG_SECONDS=10,
+    REPLICA_EJECT_SECONDS=30
+)
+class ReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = db_router.ReplicaRouter()
+        db_router.health.reset()
+        lag = patch.object(db_router.health, 'replication_lag')
+        self.lag = lag.start()
+        self.lag.return_value = 0.0
+        self.addCleanup(lag.stop)
+
+    def test_reads_spread_over_replicas(self):
+        """Test that reads are served by the replicas"""
+        used = {self.router.db_for_read(Recipe) for _ in range(50)}
+
+        self.assertEqual(used, set(REPLICAS))
+
+    def test_writes_go_to_primary(self):
+        """Test that writes always use the primary"""
+        self.assertEqual(self.router.db_for_write(Recipe), 'default')
+
+    def test_pinned_reads_go_to_primary(self):
+        """Test that pinned blocks read from the primary"""
+        with db_router.pinned_to_primary():
+            self.assertEqual(self.router.db_for_read(Recipe), 'default')
+
+        self.assertIn(self.router.db_for_read(Recipe), REPLICAS)
+
+    def test_failing_replica_ejected(self):
+        """Test that a replica raising errors leaves the rotation"""
+        def lag(alias):
+            if alias == 'replica_1':
+                raise ConnectionError('down')
+            return 0.0
+        self.lag.side_effect = lag
+
+        used = {self.router.db_for_read(Recipe) for _ in range(20)}
+
+        self.assertEqual(used, {'replica_2'})
+        self.assertFalse(db_router.health.is_healthy('replica_1'))
+
+    def test_lagging_replicas_fall_back_to_primary(self):
+        """Test that reads use the primary when every replica lags"""
+        self.lag.return_value = 60.0
+
+        self.assertEqual(self.router.db_for_read(Recipe), 'default')
+
+    def test_no_migrations_on_replicas(self):
+        """Test that replicas are never migrated"""
+        self.assertFalse(self.router.allow_migrate('replica_1', 'core'))
+        self.assertIsNone(self.router.allow_migrate('default', 'core'))
+
+
+# The second test database stands in for a replica of the primary
+@override_settings(DATABASE_REPLICAS=['shard_2'],
+                   REPLICA_HEALTH_CHECK_INTERVAL=0)
+class ApiReplicaReadTests(TransactionTestCase):
+    multi_db = True
+
+    def setUp(self):
+        db_router.health.reset()
+        self.addCleanup(db_router.health.reset)
+
+    def test_api_reads_use_replicas(self):
+        """Test that API views read user data through the replicas"""
+        user = get_user_model().objects.create_user('test@o2.pl', 'haslo123')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        with CaptureQueriesContext(connections['shard_2']) as replica, \
+                CaptureQueriesContext(connections['default']) as primary:
+            client.get(reverse('recipe:recipe-list'))
+
+        def recipe_queries(queries):
+            return [q for q in queries if 'FROM "core_recipe"' in q['sql']]
+
+        self.assertTrue(recipe_queries(replica.captured_queries))
+        self.assertFalse(recipe_queries(primary.captured_queries))
+
+
+@override_settings(READ_YOUR_WRITES_SECONDS=5)
+class ReadYourWritesMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def run_request(self, request):
+        """Run a request through the middleware and report pinning"""
+        seen = {}
+
+        def view(request):
+            seen['pinned'] = db_router.is_pinned()
+            return HttpResponse()
+
+        middleware = db_router.ReadYourWritesMiddleware()
+        middleware.process_request(request)
+        middleware.process_view(request, view, (), {})
+        response = middleware.process_response(request, view(request))
+        return seen['pinned'], response
+
+    def test_reads_after_write_pinned(self):
+        """Test that a client's reads stick to the primary after a write"""
+        pinned, _ = self.run_request(self.factory.get('/'))
+        self.assertFalse(pinned)
+
+        pinned, response = self.run_request(self.factory.post('/'))
+        self.assertTrue(pinned)
+
+        # Any worker process sees the pin the client sends back
+        self.factory.cookies = response.cookies
+        pinned, _ = self.run_request(self.factory.get('/'))
+        self.assertTrue(pinned)
+        self.assertFalse(db_router.is_pinned())
+
+    def test_other_clients_not_pinned(self):
+        """Test that one client's write does not pin other clients"""
+        self.run_request(self.factory.post('/'))
+
+        pinned, _ = self.run_request(RequestFactory().get('/'))
+        self.assertFalse(pinned)
+
+    def test_exempt_view_not_pinned(self):
+        """Test that exempt views pin only once they report a write"""
+        def view(request):
+            return HttpResponse()
+
+        middleware = db_router.ReadYourWritesMiddleware()
+        request = self.factory.post('/')
+        middleware.process_request(request)
+        middleware.process_view(request, db_router.pin_exempt(view), (), {})
+        self.assertFalse(db_router.is_pinned())
+        response = middleware.process_response(request, view(request))
+        self.assertNotIn(db_router.PIN_COOKIE, response.cookies)
+
+        request = self.factory.post('/')
+        middleware.process_request(request)
+        middleware.process_view(request, db_router.pin_exempt(view), (), {})
+        db_router.mark_written(request)
+        response = middleware.process_response(request, view(request))
+        self.assertIn(db_router.PIN_COOKIE, response.cookies)
+
+    def test_forged_pin_ignored(self):
+        """Test that a pin cookie without a valid signature is ignored"""
+        self.factory.cookies[db_router.PIN_COOKIE] = '1'
+
+        pinned, _ = self.run_request(self.factory.get('/'))
+        self.assertFalse(pinned)
+
+    def test_pin_expires(self):
+        """Test that the pin lasts for the configured window"""
+        _, response = self.run_request(self.factory.post('/'))
+        self.factory.cookies = response.cookies
+
+        self.assertEqual(response.cookies[db_router.PIN_COOKIE]['max-age'], 5)
+        with patch('django.core.signing.time.time', return_value=2e9):
+            pinned, _ = self.run_request(self.factory.get('/'))
+        self.assertFalse(pinned)
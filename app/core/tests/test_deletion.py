@@ -0,0 +1,136 @@
+import os
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from core import deletion, uploads
+from core.models import (
+    Tag,
+    Ingredient,
+    Recipe,
+    RecipeStats,
+    ImageUpload,
+    Tombstone
+)
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': 5.00
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+def fill(user, count):
+    """Give a user recipes sharing a tag and an ingredient"""
+    tag, _ = Tag.objects.get_or_create(user=user, name='Vegan')
+    ingredient, _ = Ingredient.objects.get_or_create(user=user, name='Salt')
+    for _ in range(count):
+        recipe = sample_recipe(user)
+        recipe.tags.add(tag)
+        recipe.ingredients.add(ingredient)
+
+
+@override_settings(RECIPE_STATS_ROLLUP=True)
+class DeletionTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+
+    def test_delete_recipes_keeps_bookkeeping(self):
+        """Test that bulk deleted recipes leave tombstones and update stats"""
+        fill(self.user, 3)
+        kept = sample_recipe(self.user, price=2, time_minutes=7)
+
+        deleted = deletion.delete_objects(
+            Recipe.objects.exclude(pk=kept.pk), batch_size=2
+        )
+
+        self.assertEqual(deleted, 3)
+        self.assertEqual(list(Recipe.objects.all()), [kept])
+        self.assertFalse(Recipe.tags.through.objects.exists())
+        seqs = Tombstone.objects.values_list('change_seq', flat=True)
+        self.assertEqual(len(set(seqs)), 3)
+        stats = RecipeStats.objects.get(user=self.user)
+        self.assertEqual(stats.recipe_count, 1)
+        self.assertEqual(stats.price_total, 2)
+        self.assertEqual(stats.time_minutes_total, 7)
+
+    def test_queries_do_not_grow_with_rows(self):
+        """Test that a batch costs the same number of queries at any size"""
+        fill(self.user, 2)
+        with CaptureQueriesContext(connection) as small:
+            deletion.delete_objects(Recipe.objects.all())
+        fill(self.user, 20)
+        with CaptureQueriesContext(connection) as large:
+            deletion.delete_objects(Recipe.objects.all())
+
+        self.assertEqual(len(small), len(large))
+
+    def test_foreign_receivers_get_instances(self):
+        """Test that objects are loaded when another receiver needs them"""
+        seen = []
+
+        def receiver(sender, instance, **kwargs):
+            seen.append(instance.pk)
+        post_delete.connect(receiver, sender=Tag)
+        self.addCleanup(post_delete.disconnect, receiver, sender=Tag)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+
+        deletion.delete_objects(Tag.objects.all())
+
+        self.assertEqual(seen, [tag.pk])
+        self.assertEqual(Tombstone.objects.get().object_id, tag.pk)
+
+    def test_delete_user_with_data(self):
+        """Test that deleting a user removes all of their data"""
+        fill(self.user, 5)
+        other = get_user_model().objects.create_user('x@o2.pl', 'pass123')
+        fill(other, 1)
+        progress = []
+
+        deletion.delete_user(
+            self.user, batch_size=2,
+            progress=lambda model, count: progress.append(model)
+        )
+
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+        self.assertEqual(
+            set(Recipe.objects.values_list('user_id', flat=True)), {other.pk}
+        )
+        self.assertFalse(Tombstone.objects.filter(user_id=self.user.pk))
+        self.assertEqual(Recipe.tags.through.objects.count(), 1)
+        self.assertIn(Recipe, progress)
+
+    def test_delete_user_in_background(self):
+        """Test that background deletion deactivates the user at once"""
+        deletion.delete_user(self.user, background=True)
+
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+
+
+class UserDeletionTests(TransactionTestCase):
+
+    def test_delete_user_with_open_upload(self):
+        """Test that a user with an unfinished upload can be deleted"""
+        user = get_user_model().objects.create_user('test@o2.pl', 'haslo123')
+        upload = uploads.start_upload(sample_recipe(user), 10)
+
+        deletion.delete_user(user)
+
+        self.assertFalse(ImageUpload.objects.exists())
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(os.path.exists(upload.path))
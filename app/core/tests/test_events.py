@@ -0,0 +1,133 @@
+import json
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from core import events
+from core.models import Tag
+
+
+@override_settings(EVENT_QUEUE_SIZE=2)
+class BrokerTests(TestCase):
+
+    def test_deliver_to_user_subscriptions(self):
+        """Test that events only reach subscriptions of their user"""
+        broker = events.LocalBroker()
+        mine = broker.subscribe(1)
+        theirs = broker.subscribe(2)
+
+        broker.publish(events.Event(1, 5, 'tag', 'created', 3))
+
+        self.assertEqual(mine.get(0).seq, 5)
+        self.assertIsNone(theirs.get(0))
+
+    def test_overflow_drops_events(self):
+        """Test that a full subscription drops events and is flagged"""
+        broker = events.LocalBroker()
+        subscription = broker.subscribe(1)
+        for seq in range(3):
+            broker.publish(events.Event(1, seq, 'tag', 'created', seq))
+
+        self.assertTrue(subscription.overflowed)
+        subscription.reset()
+        self.assertFalse(subscription.overflowed)
+        self.assertIsNone(subscription.get(0))
+
+    def test_closed_subscription_not_delivered(self):
+        """Test that closing a subscription stops its deliveries"""
+        broker = events.LocalBroker()
+        subscription = broker.subscribe(1)
+        subscription.close()
+
+        broker.publish(events.Event(1, 1, 'tag', 'created', 1))
+
+        self.assertIsNone(subscription.get(0))
+
+
+class EventStreamTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+        self.broker = events.LocalBroker()
+
+    def test_format_event(self):
+        """Test the Server-Sent Events wire format of an event"""
+        text = events.format_event(events.Event(1, 7, 'tag', 'deleted', 3))
+
+        lines = text.split('\n')
+        self.assertEqual(lines[:2], ['id: 7', 'event: change'])
+        self.assertEqual(json.loads(lines[2][len('data: '):]), {
+            'kind': 'tag', 'action': 'deleted', 'id': 3, 'seq': 7
+        })
+        self.assertTrue(text.endswith('\n\n'))
+
+    @override_settings(EVENT_STREAM_MAX_SECONDS=60,
+                       EVENT_HEARTBEAT_SECONDS=0)
+    def test_live_events_deduplicated(self):
+        """Test that events already replayed are not sent again"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        subscription = self.broker.subscribe(self.user.pk)
+        self.broker.publish(
+            events.Event(self.user.pk, tag.change_seq, 'tag', 'created',
+                         tag.pk)
+        )
+        self.broker.publish(
+            events.Event(self.user.pk, tag.change_seq + 1, 'tag', 'deleted',
+                         tag.pk)
+        )
+        stream = events.event_stream(self.user.pk, 0, subscription)
+
+        self.assertTrue(next(stream).startswith('retry: '))
+        self.assertTrue(next(stream).startswith(f'id: {tag.change_seq}\n'))
+        self.assertIn('"deleted"', next(stream))
+        self.assertEqual(next(stream), ': heartbeat\n\n')
+        stream.close()
+
+        self.broker.publish(events.Event(self.user.pk, 99, 'tag', 'x', 1))
+        self.assertIsNone(subscription.get(0))
+
+    @override_settings(EVENT_STREAM_MAX_SECONDS=60, EVENT_QUEUE_SIZE=1)
+    def test_overflow_replays_from_database(self):
+        """Test that a stream that fell behind catches up from the DB"""
+        subscription = self.broker.subscribe(self.user.pk)
+        stream = events.event_stream(self.user.pk, 0, subscription)
+        next(stream)
+
+        tags = [
+            Tag.objects.create(user=self.user, name=name)
+            for name in ('Vegan', 'Desert')
+        ]
+        for tag in tags:
+            self.broker.publish(
+                events.Event(self.user.pk, tag.change_seq, 'tag', 'created',
+                             tag.pk)
+            )
+
+        self.assertTrue(subscription.overflowed)
+        self.assertIn(f'"id": {tags[0].pk}', next(stream))
+        self.assertIn(f'"id": {tags[1].pk}', next(stream))
+        stream.close()
+
+
+class StreamConnectionTests(TransactionTestCase):
+
+    @override_settings(EVENT_STREAM_MAX_SECONDS=60)
+    def test_connection_closed_while_waiting(self):
+        """Test that a stream waiting for events holds no connection"""
+        user = get_user_model().objects.create_user('test@o2.pl', 'haslo123')
+        Tag.objects.create(user=user, name='Vegan')
+        subscription = events.LocalBroker().subscribe(user.pk)
+        subscription.get = lambda timeout: self.assertTrue(close.called)
+        stream = events.event_stream(user.pk, 0, subscription)
+
+        with mock.patch.object(connection, 'close') as close:
+            self.assertTrue(next(stream).startswith('retry: '))
+            self.assertIn('"tag"', next(stream))
+            self.assertFalse(close.called)
+            self.assertEqual(next(stream), ': heartbeat\n\n')
+        stream.close()
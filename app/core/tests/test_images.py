@@ -0,0 +1,118 @@
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import zlib
+from io import BytesIO
+
+from PIL import Image
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.test import TestCase
+
+from core import images
+
+# Peak memory the subprocess below may add while sanitizing
+MEMORY_BUDGET_KB = 40 * 1024
+
+MEASURE_PEAK = '''
+import resource, sys
+import django
+django.setup()
+from django.core.files import File
+from core import images
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+with open(sys.argv[1], 'rb') as image:
+    result = images.sanitize(File(image), max_side=1024)
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(after - before)
+'''
+
+
+def encode(image, format, **params):
+    """Return an image file holding `image` saved in a format"""
+    data = BytesIO()
+    image.save(data, format, **params)
+    return ContentFile(data.getvalue(), name=f'upload.{format.lower()}')
+
+
+def png_chunk(kind, data):
+    """Return a PNG chunk with its length and checksum"""
+    return (struct.pack('>I', len(data)) + kind + data +
+            struct.pack('>I', zlib.crc32(kind + data)))
+
+
+class SanitizeTests(TestCase):
+
+    def test_reencodes_without_exif(self):
+        """Test that metadata is dropped and the orientation applied"""
+        # APP1 payload: a little-endian TIFF header and one IFD entry
+        exif = (b'Exif\x00\x00II*\x00' + struct.pack('<IH', 8, 1) +
+                struct.pack('<HHIHH', images.EXIF_ORIENTATION, 3, 1, 6, 0) +
+                struct.pack('<I', 0))
+        upload = encode(Image.new('RGB', (40, 20)), 'JPEG', exif=exif)
+
+        result = Image.open(images.sanitize(upload))
+
+        self.assertEqual(result.format, 'JPEG')
+        self.assertEqual(result.size, (20, 40))
+        self.assertNotIn('exif', result.info)
+
+    def test_scales_down_large_images(self):
+        """Test that images are fit into the largest allowed side"""
+        for format in ('JPEG', 'PNG'):
+            upload = encode(Image.new('RGB', (1000, 500)), format)
+
+            result = Image.open(images.sanitize(upload, max_side=100))
+
+            self.assertEqual(result.size, (100, 50))
+
+    def test_keeps_transparency(self):
+        """Test that images with alpha are stored as PNG with alpha"""
+        upload = encode(Image.new('RGBA', (10, 10)), 'WEBP')
+
+        result = images.sanitize(upload)
+
+        self.assertEqual(result.name, 'image.png')
+        self.assertEqual(Image.open(result).mode, 'RGBA')
+
+    def test_rejects_unknown_formats(self):
+        """Test that files without image magic bytes are refused"""
+        with self.assertRaises(images.InvalidImage):
+            images.sanitize(ContentFile(b'%PDF-1.4 not an image'))
+
+    def test_rejects_large_files(self):
+        """Test that files over the byte limit are refused"""
+        upload = encode(Image.new('RGB', (10, 10)), 'PNG')
+
+        with self.assertRaises(images.InvalidImage):
+            images.sanitize(upload, max_bytes=upload.size - 1)
+
+    def test_rejects_decompression_bomb_undecoded(self):
+        """Test that a header declaring too many pixels is refused"""
+        header = struct.pack('>IIBBBBB', 100000, 100000, 8, 2, 0, 0, 0)
+        bomb = (b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', header) +
+                png_chunk(b'IDAT', zlib.compress(b'\x00' * 1024)) +
+                png_chunk(b'IEND', b''))
+
+        with self.assertRaises(images.InvalidImage):
+            images.sanitize(ContentFile(bomb))
+
+    def test_peak_memory_capped(self):
+        """Test that a large JPEG is decoded at a reduced scale"""
+        # Decoding this image whole takes 108 MB
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image:
+            Image.new('RGB', (6000, 6000), 'white').save(image, 'JPEG')
+            image.flush()
+            result = subprocess.run(
+                [sys.executable, '-c', MEASURE_PEAK, image.name],
+                cwd=settings.BASE_DIR,
+                env=dict(os.environ,
+                         DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE),
+                stdout=subprocess.PIPE,
+                universal_newlines=True,
+            )
+
+        self.assertEqual(result.returncode, 0)
+        self.assertLess(int(result.stdout), MEMORY_BUDGET_KB)
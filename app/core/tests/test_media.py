@@ -0,0 +1,127 @@
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core import media
+
+DIGEST = 'ab' * 32
+IMAGE_NAME = f'uploads/recipe/ab/{DIGEST}.jpg'
+
+
+def stored_bytes(response):
+    """Return the body of a plain or streaming response"""
+    if response.streaming:
+        return b''.join(response.streaming_content)
+    return response.content
+
+
+class ParseRangeTests(TestCase):
+
+    def test_parse_range(self):
+        """Test that single ranges are parsed and clamped to the file"""
+        self.assertEqual(media.parse_range('bytes=2-5', 10), (2, 5))
+        self.assertEqual(media.parse_range('bytes=2-', 10), (2, 9))
+        self.assertEqual(media.parse_range('bytes=5-50', 10), (5, 9))
+        self.assertEqual(media.parse_range('bytes=-3', 10), (7, 9))
+        self.assertEqual(media.parse_range('bytes=-30', 10), (0, 9))
+
+    def test_ranges_served_whole(self):
+        """Test that unparsed and multiple ranges mean the whole file"""
+        for header in ('bytes=0-1,4-5', 'items=0-1', 'bytes=5-2', 'bytes=-'):
+            self.assertIsNone(media.parse_range(header, 10))
+
+    def test_unsatisfiable_ranges(self):
+        """Test that ranges outside the file are refused"""
+        for header in ('bytes=10-', 'bytes=-0'):
+            with self.assertRaises(media.RangeNotSatisfiable):
+                media.parse_range(header, 10)
+
+
+class ServeMediaTests(TestCase):
+
+    def setUp(self):
+        default_storage.save(IMAGE_NAME, ContentFile(b'0123456789'))
+        self.addCleanup(default_storage.delete, IMAGE_NAME)
+        self.url = reverse('media', args=[IMAGE_NAME])
+
+    def test_serve_image(self):
+        """Test that images are served with far-future cache headers"""
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(stored_bytes(res), b'0123456789')
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res['Content-Length'], '10')
+        self.assertEqual(res['ETag'], f'"{DIGEST}"')
+        self.assertEqual(res['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', res['Cache-Control'])
+        self.assertIn('max-age=31536000', res['Cache-Control'])
+
+    def test_not_modified(self):
+        """Test that a matching If-None-Match gets an empty 304"""
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"{DIGEST}"')
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.content, b'')
+        self.assertEqual(res['ETag'], f'"{DIGEST}"')
+
+    def test_byte_range(self):
+        """Test that a single byte range gets a partial response"""
+        res = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(stored_bytes(res), b'2345')
+        self.assertEqual(res['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(res['Content-Length'], '4')
+
+    def test_unsatisfiable_range(self):
+        """Test that a range past the end gets a 416"""
+        res = self.client.get(self.url, HTTP_RANGE='bytes=10-')
+
+        self.assertEqual(res.status_code, 416)
+        self.assertEqual(res['Content-Range'], 'bytes */10')
+
+    def test_stale_if_range(self):
+        """Test that a range for another version gets the whole file"""
+        res = self.client.get(self.url, HTTP_RANGE='bytes=2-5',
+                              HTTP_IF_RANGE='"other"')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(stored_bytes(res), b'0123456789')
+
+    def test_other_names_revalidated(self):
+        """Test that names without a digest are cached briefly"""
+        default_storage.save('notes.txt', ContentFile(b'notes'))
+        self.addCleanup(default_storage.delete, 'notes.txt')
+
+        res = self.client.get(reverse('media', args=['notes.txt']))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('immutable', res['Cache-Control'])
+        self.assertIn('max-age=3600', res['Cache-Control'])
+
+    @override_settings(MEDIA_OFFLOAD='x-accel-redirect')
+    def test_offload_to_proxy(self):
+        """Test that offloading leaves the body to the front proxy"""
+        res = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.content, b'')
+        self.assertEqual(res['X-Accel-Redirect'],
+                         f'/protected-media/{IMAGE_NAME}')
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', res['Cache-Control'])
+
+    def test_missing_files(self):
+        """Test that missing files and paths leaving media are not found"""
+        for name in ('uploads/missing.jpg', '../settings.py'):
+            res = self.client.get(reverse('media', args=[name]))
+
+            self.assertEqual(res.status_code, 404)
+
+    def test_only_safe_methods(self):
+        """Test that media cannot be written through the view"""
+        res = self.client.post(self.url)
+
+        self.assertEqual(res.status_code, 405)
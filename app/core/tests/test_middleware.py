@@ -0,0 +1,100 @@
+import gzip
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from core import middleware
+
+
+def make_response(content=b'x' * 2048, content_type='application/json'):
+    """Return a view stub producing the given response"""
+    return lambda request: HttpResponse(content, content_type=content_type)
+
+
+@override_settings(RESPONSE_COMPRESSION_MIN_SIZE=512)
+class CompressionMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_gzip_selected(self):
+        """Test that gzip is used when it is the only accepted coding"""
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        res = middleware.CompressionMiddleware(make_response())(request)
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(res.content), b'x' * 2048)
+        self.assertIn('Accept-Encoding', res['Vary'])
+
+    def test_brotli_preferred(self):
+        """Test that brotli wins when the client accepts both"""
+        if 'br' not in middleware.COMPRESSORS:
+            self.skipTest('brotli is not installed')
+        request = self.factory.get(
+            '/', HTTP_ACCEPT_ENCODING='gzip, deflate, br'
+        )
+        res = middleware.CompressionMiddleware(make_response())(request)
+
+        self.assertEqual(res['Content-Encoding'], 'br')
+
+    def test_small_response_not_compressed(self):
+        """Test that responses below the threshold are sent as is"""
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        res = middleware.CompressionMiddleware(
+            make_response(b'x' * 100)
+        )(request)
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+
+    def test_images_not_compressed(self):
+        """Test that already compressed media types are skipped"""
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        res = middleware.CompressionMiddleware(
+            make_response(content_type='image/jpeg')
+        )(request)
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+
+    def test_choose_encoding_respects_quality(self):
+        """Test that q=0 codings are never chosen"""
+        self.assertEqual(
+            middleware.choose_encoding('br;q=0, gzip;q=0.5'), 'gzip'
+        )
+        self.assertIsNone(middleware.choose_encoding('identity'))
+        self.assertIsNone(middleware.choose_encoding('gzip;q=0'))
+
+
+@override_settings(
+    API_PATH_PREFIXES=('/api/',),
+    WEB_ONLY_MIDDLEWARE=[
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+    ]
+)
+class WebOnlyMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = middleware.WebOnlyMiddleware(make_response())
+
+    def view(self, request):
+        """Run the middleware view hook, then the view itself"""
+        response = self.middleware.process_view(request, make_response(),
+                                                (), {})
+        return response or make_response()(request)
+
+    def test_api_requests_skip_nested_middleware(self):
+        """Test that API paths bypass sessions and CSRF checks"""
+        request = self.factory.post('/api/recipe/tags/')
+
+        self.middleware(request)
+
+        self.assertFalse(hasattr(request, 'session'))
+        self.assertEqual(self.view(request).status_code, 200)
+
+    def test_web_requests_run_nested_middleware(self):
+        """Test that other paths get sessions and CSRF checks"""
+        request = self.factory.post('/admin/login/')
+
+        self.middleware(request)
+
+        self.assertTrue(hasattr(request, 'session'))
+        self.assertEqual(self.view(request).status_code, 403)
@@ -1,7 +1,13 @@
-from unittest.mock import patch
-from django.test import TestCase
+import hashlib
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth import get_user_model
-from core import models
+from core import models, sharding
 
 
 def sample_user(email='test@gmail.com', password="testpass"):
@@ -74,13 +80,75 @@ class ModelTests(TestCase):
 
         self.assertEqual(str(recipe), recipe.title)
 
-    @patch('uuid.uuid4')
-    def test_recipe_filename_uuid(self, mock_uuid):
-        """Test that image is saved in correct location"""
-        uuid = 'test-uuid'
-        mock_uuid.return_value = uuid
-        file_path = models.recipe_image_file_path(None, 'myimage.jpg')
+    def test_recipe_filename_content_addressed(self):
+        """Test that image path comes from the content, not the client"""
+        content = b'\xff\xd8\xff\xe0' + b'jpeg data'
+        recipe = models.Recipe(
+            image=SimpleUploadedFile('myimage.png', content)
+        )
+        digest = hashlib.sha256(content).hexdigest()
 
-        exp_path = f'uploads/recipe/{uuid}.jpg'
+        file_path = models.recipe_image_file_path(recipe, 'myimage.png')
 
+        exp_path = f'uploads/recipe/{digest[:2]}/{digest}.jpg'
         self.assertEqual(file_path, exp_path)
+
+    def test_image_reference_counted_before_file_stored(self):
+        """Test that a new image is referenced before its file is stored"""
+        content = b'\xff\xd8\xff\xe0' + b'jpeg data'
+        recipe = models.Recipe(
+            user=sample_user(), title='Soup', time_minutes=5, price=5,
+            image=SimpleUploadedFile('soup.jpg', content)
+        )
+        save = default_storage.save
+
+        def stored(name, *args, **kwargs):
+            self.assertEqual(
+                models.ImageBlob.objects.get(name=name).ref_count, 1
+            )
+            return save(name, *args, **kwargs)
+
+        with mock.patch.object(default_storage, 'save', stored):
+            recipe.save()
+
+        self.assertTrue(default_storage.exists(recipe.image.name))
+        self.assertEqual(
+            models.ImageBlob.objects.get(name=recipe.image.name).ref_count, 1
+        )
+
+    def test_collect_keeps_image_referenced_again(self):
+        """Test that collecting spares an image acquired after its release"""
+        name = default_storage.save('uploads/recipe/a.jpg', ContentFile(b'a'))
+        models.ImageBlob.objects.create(name=name, ref_count=1)
+
+        models.ImageBlob.objects.release(name)
+        models.ImageBlob.objects.acquire(name)
+        models.ImageBlob.objects.collect(name)
+
+        self.assertTrue(default_storage.exists(name))
+
+        models.ImageBlob.objects.release(name)
+        models.ImageBlob.objects.collect(name)
+
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(models.ImageBlob.objects.exists())
+
+
+class ShardImageTests(TransactionTestCase):
+    multi_db = True
+
+    def test_image_collected_after_shard_commit(self):
+        """Test that a shard recipe's image goes when its delete commits"""
+        user = sample_user()
+        sharding.ensure_shadow_user(user.pk, 'shard_2')
+        recipe = models.Recipe.objects.using('shard_2').create(
+            user=user, title='Soup', time_minutes=5, price=5,
+            image=SimpleUploadedFile('soup.jpg', b'\xff\xd8\xff\xe0 soup')
+        )
+        name = recipe.image.name
+
+        with transaction.atomic(using='shard_2'):
+            recipe.delete()
+            self.assertTrue(default_storage.exists(name))
+
+        self.assertFalse(default_storage.exists(name))
@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, override_settings
+
+from core.objectstore import FakeClientError, FakeObjectStore, ObjectStorage
+
+
+class FlakyObjectStore(FakeObjectStore):
+    """Fake store failing the first `failures` upload attempts"""
+
+    def __init__(self, failures=1):
+        super().__init__()
+        self.failures = failures
+
+    def put_object(self, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise FakeClientError('500', 'put_object')
+        return super().put_object(**kwargs)
+
+
+class FlakyParts(FakeObjectStore):
+    """Fake store failing every upload of a second part"""
+
+    def upload_part(self, **kwargs):
+        if kwargs['PartNumber'] == 2:
+            raise FakeClientError('500', 'upload_part')
+        return super().upload_part(**kwargs)
+
+
+@override_settings(OBJECT_STORAGE_UPLOAD_ATTEMPTS=1)
+class ObjectStorageTests(SimpleTestCase):
+
+    def _storage(self, store=None, **kwargs):
+        self.store = store or FakeObjectStore()
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        storage = ObjectStorage(
+            bucket='media', client=self.store, cache_dir=cache_dir, **kwargs
+        )
+        self.addCleanup(storage._executor.shutdown)
+        return storage
+
+    def _operations(self):
+        return [operation for operation, _ in self.store.requests]
+
+    def test_upload_in_parts(self):
+        """Test that files larger than a part go up as a multipart upload"""
+        storage = self._storage(part_size=4)
+
+        name = storage.save('uploads/ab/abc.jpg', ContentFile(b'0123456789'))
+
+        self.assertEqual(name, 'uploads/ab/abc.jpg')
+        self.assertEqual(self.store.objects[('media', name)], b'0123456789')
+        self.assertEqual(self._operations()[1:], [
+            'create_multipart_upload', 'upload_part', 'upload_part',
+            'upload_part', 'complete_multipart_upload',
+        ])
+
+    def test_small_file_uploaded_whole(self):
+        """Test that files fitting one part are put in one request"""
+        storage = self._storage()
+
+        storage.save('a.jpg', ContentFile(b'img'))
+
+        self.assertEqual(self._operations(), ['head_object', 'put_object'])
+
+    def test_uploaded_before_save_returns(self):
+        """Test that a saved file is in the bucket and linked from there"""
+        storage = self._storage()
+
+        storage.save('a.jpg', ContentFile(b'img'))
+
+        self.assertEqual(self.store.objects[('media', 'a.jpg')], b'img')
+        url = storage.url('a.jpg')
+        self.assertTrue(url.startswith('https://objects.example.com/'))
+        self.assertEqual(self.store.verify_url(url), b'img')
+        self.assertIsNone(self.store.verify_url(url + '0'))
+
+    def test_least_recently_used_evicted(self):
+        """Test that the cache drops the file used longest ago"""
+        storage = self._storage(cache_bytes=12)
+        for name in ('a.jpg', 'b.jpg'):
+            storage.save(name, ContentFile(b'x' * 6))
+            storage.open('a.jpg').close()
+
+        storage.save('c.jpg', ContentFile(b'x' * 6))
+
+        self.assertEqual(list(storage._cache_index()), ['a.jpg', 'c.jpg'])
+        del self.store.requests[:]
+        self.assertEqual(storage.open('b.jpg').read(), b'x' * 6)
+        self.assertEqual(self._operations(), ['get_object'])
+
+    def test_cache_rebuilt_from_disk(self):
+        """Test that a new storage counts files cached before it"""
+        storage = self._storage()
+        storage.save('uploads/a.jpg', ContentFile(b'img'))
+
+        restarted = ObjectStorage(
+            bucket='media', client=self.store, cache_dir=storage.cache_dir,
+            cache_bytes=0
+        )
+        self.addCleanup(restarted._executor.shutdown)
+
+        self.assertEqual(restarted._cache_index(), {'uploads/a.jpg': 3})
+
+    @override_settings(OBJECT_STORAGE_UPLOAD_ATTEMPTS=2)
+    def test_failed_upload_retried(self):
+        """Test that a failed upload is attempted again"""
+        storage = self._storage(FlakyObjectStore())
+
+        with self.assertLogs('core.objectstore', 'WARNING'):
+            storage.save('a.jpg', ContentFile(b'img'))
+
+        self.assertEqual(self.store.objects[('media', 'a.jpg')], b'img')
+
+    @override_settings(OBJECT_STORAGE_UPLOAD_ATTEMPTS=2)
+    def test_failed_upload_fails_save(self):
+        """Test that a file the bucket never got is not saved at all"""
+        storage = self._storage(FlakyObjectStore(failures=2))
+
+        with self.assertRaises(FakeClientError), \
+                self.assertLogs('core.objectstore', 'WARNING'):
+            storage.save('a.jpg', ContentFile(b'img'))
+
+        self.assertFalse(self.store.objects)
+        self.assertFalse(storage.exists('a.jpg'))
+        self.assertEqual(os.listdir(storage.cache_dir), [])
+
+    def test_failed_part_aborts_upload(self):
+        """Test that a multipart upload losing a part is aborted"""
+        storage = self._storage(FlakyParts(), part_size=4)
+
+        with self.assertRaises(FakeClientError):
+            storage.save('a.jpg', ContentFile(b'0123456789'))
+
+        self.assertIn('abort_multipart_upload', self._operations())
+        self.assertFalse(self.store.objects)
+
+    def test_existing_name_not_uploaded_again(self):
+        """Test that saving content already stored sends nothing"""
+        storage = self._storage()
+        self.store.objects[('media', 'a.jpg')] = b'img'
+
+        storage.save('a.jpg', ContentFile(b'img'))
+
+        self.assertEqual(self._operations(), ['head_object'])
+        self.assertNotIn('a.jpg', storage._cache_index())
+
+    def test_delete(self):
+        """Test that deleting removes the object and the cached copy"""
+        storage = self._storage()
+        storage.save('a.jpg', ContentFile(b'img'))
+
+        storage.delete('a.jpg')
+
+        self.assertFalse(self.store.objects)
+        self.assertFalse(storage.exists('a.jpg'))
+        with self.assertRaises(FileNotFoundError):
+            storage.open('a.jpg')
@@ -0,0 +1,95 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from core import relations
+from core.models import Tag, Ingredient, Recipe
+
+
+def writes(queries):
+    """Return the statements of captured queries that write rows"""
+    return [
+        query['sql'] for query in queries
+        if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+    ]
+
+
+class WriteRelationsTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+        self.tags = [
+            Tag.objects.create(user=self.user, name=f'Tag {i}')
+            for i in range(4)
+        ]
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=10, price=5
+        )
+        self.recipe.tags.set(self.tags[:3])
+        self.recipe.refresh_from_db()
+
+    def test_writes_only_the_difference(self):
+        """Test that one delete and one insert replace changed links"""
+        seq = self.recipe.change_seq
+        wanted = [self.tags[0].pk, self.tags[2].pk, self.tags[3].pk]
+
+        with patch('core.signals.refresh_signatures') as refresh:
+            with CaptureQueriesContext(connection) as queries:
+                changed = relations.write_relations(
+                    self.recipe, {'tags': wanted}, 'default'
+                )
+
+        self.assertEqual(changed, ['tags'])
+        statements = writes(queries)
+        self.assertEqual(
+            [sql.split()[0] for sql in statements
+             if 'core_recipe_tags' in sql],
+            ['DELETE', 'INSERT']
+        )
+        recipe_updates = [
+            sql for sql in statements if sql.startswith('UPDATE "core_recipe"')
+        ]
+        self.assertEqual(len(recipe_updates), 1)
+        self.assertIn('SET "change_seq"', recipe_updates[0])
+        self.assertNotIn('"title"', recipe_updates[0])
+        self.assertEqual(
+            set(self.recipe.tags.values_list('pk', flat=True)), set(wanted)
+        )
+        self.recipe.refresh_from_db()
+        self.assertGreater(self.recipe.change_seq, seq)
+        refresh.assert_called_once_with([self.recipe.pk], 'default')
+
+    def test_unchanged_links_write_nothing(self):
+        """Test that wanting the current links only reads them"""
+        seq = self.recipe.change_seq
+
+        with self.assertNumQueries(2):
+            changed = relations.write_relations(self.recipe, {
+                'tags': list(reversed(self.tags[:3])),
+                'ingredients': [],
+            }, 'default')
+
+        self.assertEqual(changed, [])
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.change_seq, seq)
+
+    def test_saved_recipe_row_not_touched_again(self):
+        """Test that a given change sequence skips the recipe update"""
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+
+        with CaptureQueriesContext(connection) as queries:
+            relations.write_relations(
+                self.recipe, {'ingredients': [ingredient]}, 'default',
+                seq=self.recipe.change_seq
+            )
+
+        self.assertEqual(
+            [sql.split()[0] for sql in writes(queries)], ['INSERT']
+        )
+        self.assertEqual(list(self.recipe.ingredients.all()), [ingredient])
@@ -0,0 +1,69 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from core.models import Tag, Ingredient, Recipe
+from recipe.serializers import RecipeSerializer, TagSerializer
+
+
+class RowQuerySetTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@gmail.com',
+            'testpass'
+        )
+
+    def test_rows_hold_requested_fields(self):
+        """Test that rows expose fields and pk without model instances"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+
+        row, = Tag.objects.filter(user=self.user).rows('name')
+
+        self.assertNotIsInstance(row, Tag)
+        self.assertEqual(row.id, tag.id)
+        self.assertEqual(row.pk, tag.id)
+        self.assertEqual(row.name, 'Vegan')
+        self.assertFalse(hasattr(row, '__dict__'))
+
+    def test_rows_collect_many_to_many_ids(self):
+        """Test that m2m fields become lists of related keys"""
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        tag2 = Tag.objects.create(user=self.user, name='Quick')
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=5
+        )
+        recipe.tags.add(tag1, tag2)
+        recipe.ingredients.add(salt)
+        Recipe.objects.create(
+            user=self.user, title='Toast', time_minutes=5, price=5
+        )
+
+        with self.assertNumQueries(3):
+            rows = Recipe.objects.order_by('id').rows(
+                'title', 'tags', 'ingredients'
+            )
+
+        self.assertEqual(rows[0].tags, [tag1.id, tag2.id])
+        self.assertEqual(rows[0].ingredients, [salt.id])
+        self.assertEqual(rows[1].tags, [])
+
+    def test_serializers_consume_rows(self):
+        """Test that rows serialize exactly like model instances"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=5
+        )
+        recipe.tags.add(tag)
+        recipes = Recipe.objects.all()
+        tags = Tag.objects.all()
+
+        self.assertEqual(
+            RecipeSerializer(
+                recipes.rows(*RecipeSerializer.Meta.fields), many=True
+            ).data,
+            RecipeSerializer(recipes, many=True).data
+        )
+        self.assertEqual(
+            TagSerializer(tags.rows('id', 'name'), many=True).data,
+            TagSerializer(tags, many=True).data
+        )
@@ -0,0 +1,201 @@
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import db_router, sharding
+from core.models import Tag, Recipe, ShardAssignment, Tombstone
+
+
+SHARDS = ['default', 'shard_2']
+
+
+@override_settings(DATABASE_SHARDS=SHARDS)
+class ShardRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = sharding.ShardRouter()
+
+    def test_user_data_follows_active_shard(self):
+        """Test that sharded models go to the activated shard"""
+        with sharding.use_shard('shard_2'):
+            self.assertEqual(self.router.db_for_read(Recipe), 'shard_2')
+            self.assertEqual(
+                self.router.db_for_write(Recipe.tags.through), 'shard_2'
+            )
+
+        self.assertIsNone(self.router.db_for_read(Recipe))
+
+    def test_reads_leave_primary_to_replica_router(self):
+        """Test that reads on the default shard are left to ReplicaRouter"""
+        with sharding.use_shard('default'):
+            self.assertIsNone(self.router.db_for_read(Recipe))
+            self.assertEqual(self.router.db_for_write(Recipe), 'default')
+
+    @override_settings(SHARD_REPLICAS={'shard_2': ['shard_2_replica_1']},
+                       REPLICA_HEALTH_CHECK_INTERVAL=60)
+    def test_shard_reads_use_its_replicas(self):
+        """Test that a shard's reads go to its replicas, writes to it"""
+        db_router.health.reset()
+        self.addCleanup(db_router.health.reset)
+        with mock.patch.object(db_router.health, 'replication_lag',
+                               return_value=0.0), \
+                sharding.use_shard('shard_2'):
+            self.assertEqual(
+                self.router.db_for_read(Recipe), 'shard_2_replica_1'
+            )
+            self.assertEqual(self.router.db_for_write(Recipe), 'shard_2')
+
+        recipe = Recipe()
+        recipe._state.db = 'shard_2_replica_1'
+        self.assertEqual(
+            self.router.db_for_write(Recipe, instance=recipe), 'shard_2'
+        )
+
+    def test_users_not_sharded(self):
+        """Test that users stay on the primary database"""
+        with sharding.use_shard('shard_2'):
+            self.assertIsNone(self.router.db_for_read(get_user_model()))
+
+    def test_instances_stay_on_their_shard(self):
+        """Test that saved instances keep using the database they came from"""
+        recipe = Recipe()
+        recipe._state.db = 'shard_2'
+
+        self.assertEqual(
+            self.router.db_for_write(Recipe, instance=recipe), 'shard_2'
+        )
+
+    def test_relations_across_shards_refused(self):
+        """Test that objects on different shards cannot be related"""
+        tag, recipe, user = Tag(), Recipe(), get_user_model()()
+        tag._state.db, recipe._state.db = 'default', 'shard_2'
+        user._state.db = 'default'
+
+        self.assertFalse(self.router.allow_relation(tag, recipe))
+        self.assertTrue(self.router.allow_relation(recipe, user))
+
+
+@skipUnless('shard_2' in settings.DATABASES, 'needs a shard_2 database')
+@override_settings(DATABASE_SHARDS=SHARDS)
+class MoveUserTests(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+        ShardAssignment.objects.create(user=self.user, shard='default')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_move_user_to_other_shard(self):
+        """Test that a user's data is moved and served from the new shard"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=5
+        )
+        recipe.tags.add(tag)
+        Tag.objects.create(user=self.user, name='Gone').delete()
+        seq = get_user_model().objects.get(pk=self.user.pk).change_seq
+
+        sharding.move_user(self.user.pk, 'shard_2', drain_seconds=0,
+                           log=lambda message: None)
+
+        self.assertEqual(sharding.shard_for_user(self.user.pk), 'shard_2')
+        self.assertFalse(Recipe.objects.using('default').exists())
+        moved = Recipe.objects.using('shard_2').get(pk=recipe.pk)
+        self.assertEqual(list(moved.tags.all()), [tag])
+        self.assertEqual(Tombstone.objects.using('shard_2').count(), 1)
+        self.assertEqual(
+            get_user_model().objects.using('shard_2').get(
+                pk=self.user.pk
+            ).change_seq,
+            seq
+        )
+
+        res = self.client.get(reverse('recipe:recipe-list'))
+        self.assertEqual([r['id'] for r in res.data], [recipe.pk])
+
+    def test_move_onto_shard_using_same_ids(self):
+        """Test that rows whose ids are taken on the target get new ones"""
+        other = get_user_model().objects.create_user('x@o2.pl', 'pass123')
+        sharding.ensure_shadow_user(other.pk, 'shard_2')
+        taken_tag = Tag.objects.using('shard_2').create(user=other, name='Own')
+        taken = Recipe.objects.using('shard_2').create(
+            user=other, title='Stew', time_minutes=5, price=5
+        )
+        taken.tags.add(taken_tag)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=5
+        )
+        recipe.tags.add(tag)
+        self.assertEqual((tag.pk, recipe.pk), (taken_tag.pk, taken.pk))
+        seq = get_user_model().objects.get(pk=self.user.pk).change_seq
+
+        sharding.move_user(self.user.pk, 'shard_2', drain_seconds=0,
+                           log=lambda message: None)
+
+        taken.refresh_from_db()
+        self.assertEqual(taken.title, 'Stew')
+        self.assertEqual(list(taken.tags.all()), [taken_tag])
+        moved = Recipe.objects.using('shard_2').get(user=self.user)
+        self.assertNotEqual(moved.pk, recipe.pk)
+        self.assertEqual(
+            list(moved.tags.values_list('name', flat=True)), ['Vegan']
+        )
+        self.assertEqual(
+            set(Tombstone.objects.using('shard_2').filter(
+                user=self.user, change_seq=seq + 1
+            ).values_list('kind', 'object_id')),
+            {('tag', tag.pk), ('recipe', recipe.pk)}
+        )
+
+        res = self.client.get(reverse('recipe:recipe-list'))
+        self.assertEqual([r['id'] for r in res.data], [moved.pk])
+
+    def test_source_kept_until_cached_placements_expire(self):
+        """Test that source rows outlive placements cached before the move"""
+        Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=5
+        )
+        stale = sharding.placement_for_user(self.user.pk)
+        seen = []
+
+        def sleep(seconds):
+            seen.append((
+                sharding.shard_for_user(self.user.pk),
+                Recipe.objects.using('default').exists()
+            ))
+
+        with mock.patch.object(sharding.time, 'sleep', sleep):
+            sharding.move_user(self.user.pk, 'shard_2', drain_seconds=0,
+                               log=lambda message: None)
+
+        self.assertEqual(stale.shard, 'default')
+        self.assertEqual(seen, [('default', True), ('shard_2', True)])
+        self.assertFalse(Recipe.objects.using('default').exists())
+
+    def test_writes_refused_while_moving(self):
+        """Test that writes get a 503 during the cutover"""
+        ShardAssignment.objects.filter(user=self.user).update(moving=True)
+
+        res = self.client.post(reverse('recipe:tag-list'), {'name': 'Vegan'})
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_new_users_spread_over_shards(self):
+        """Test that unassigned users get a shard and a stub row there"""
+        other = get_user_model().objects.create_user('x@o2.pl', 'pass123')
+        shard = sharding.shard_for_user(other.pk)
+
+        self.assertEqual(shard, SHARDS[other.pk % 2])
+        self.assertTrue(
+            get_user_model().objects.using(shard).filter(pk=other.pk).exists()
+        )
@@ -0,0 +1,75 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from core import similarity
+from core.models import Ingredient, Recipe, RecipeSignature, LshBucket
+
+
+class MinHashTests(SimpleTestCase):
+
+    def test_signatures_estimate_jaccard(self):
+        """Test that agreeing positions track the Jaccard similarity"""
+        first = similarity.minhash(list(range(0, 100)), count=512)
+        second = similarity.minhash(list(range(50, 150)), count=512)
+
+        self.assertAlmostEqual((first == second).mean(), 1 / 3, delta=0.06)
+
+    def test_identical_sets_share_buckets(self):
+        """Test that equal token sets land in the same buckets"""
+        batch = similarity.sign_batch([(1, [4, 7, 9]), (2, [9, 7, 4])])
+
+        self.assertEqual(batch[0][1:], batch[1][1:])
+
+    def test_empty_sets_not_bucketed(self):
+        """Test that recipes without tags or ingredients get no buckets"""
+        (_, _, buckets), = similarity.sign_batch([(1, [])])
+
+        self.assertEqual(buckets, [])
+
+
+class SimilarRecipesTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+        self.ingredients = [
+            Ingredient.objects.create(user=self.user, name=str(n))
+            for n in range(6)
+        ]
+
+    def recipe(self, *positions):
+        """Create a recipe using the ingredients at `positions`"""
+        recipe = Recipe.objects.create(
+            user=self.user, title='Recipe', time_minutes=5, price=5
+        )
+        recipe.ingredients.add(*[self.ingredients[n] for n in positions])
+        return recipe
+
+    def test_similar_recipes_found(self):
+        """Test that recipes with the same ingredients are found first"""
+        recipe = self.recipe(0, 1, 2, 3)
+        twin = self.recipe(0, 1, 2, 3)
+        self.recipe(4, 5)
+        similarity.update_signatures(
+            Recipe.objects.values_list('pk', flat=True)
+        )
+
+        found = similarity.similar_recipes(recipe)
+
+        self.assertEqual(found, [(twin.pk, 1.0)])
+
+    def test_rebuild_command(self):
+        """Test that the rebuild command signs every recipe"""
+        self.recipe(0, 1)
+        self.recipe()
+
+        call_command(
+            'rebuild_recipe_signatures', '--workers', '1', stdout=StringIO()
+        )
+
+        self.assertEqual(RecipeSignature.objects.count(), 2)
+        self.assertEqual(LshBucket.objects.count(), 16)
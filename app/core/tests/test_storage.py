@@ -0,0 +1,39 @@
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase
+
+from core.storage import InMemoryStorage
+
+
+class InMemoryStorageTests(SimpleTestCase):
+
+    def setUp(self):
+        self.storage = InMemoryStorage(base_url='/media/')
+
+    def test_save_and_open(self):
+        """Test that saved files can be read back and listed"""
+        name = self.storage.save('uploads/ab/abc.jpg', ContentFile(b'img'))
+
+        self.assertEqual(name, 'uploads/ab/abc.jpg')
+        self.assertEqual(self.storage.open(name).read(), b'img')
+        self.assertEqual(self.storage.size(name), 3)
+        self.assertEqual(self.storage.url(name), '/media/uploads/ab/abc.jpg')
+        self.assertEqual(self.storage.listdir('uploads'), (['ab'], []))
+        self.assertEqual(self.storage.listdir('uploads/ab'), ([], ['abc.jpg']))
+
+    def test_existing_name_kept(self):
+        """Test that saving an existing name neither renames nor rewrites"""
+        self.storage.save('a.jpg', ContentFile(b'first'))
+        name = self.storage.save('a.jpg', ContentFile(b'second'))
+
+        self.assertEqual(name, 'a.jpg')
+        self.assertEqual(self.storage.open(name).read(), b'first')
+
+    def test_delete(self):
+        """Test that deleted files no longer exist"""
+        self.storage.save('a.jpg', ContentFile(b'img'))
+        self.storage.delete('a.jpg')
+        self.storage.delete('a.jpg')
+
+        self.assertFalse(self.storage.exists('a.jpg'))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open('a.jpg')
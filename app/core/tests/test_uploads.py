@@ -0,0 +1,147 @@
+import fcntl
+import os
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from core import uploads
+from core.models import Recipe, ImageUpload
+
+
+class DroppedStream(BytesIO):
+    """Request body whose connection drops after the first read"""
+
+    def read(self, size=-1):
+        if self.tell():
+            raise OSError('connection reset')
+        return super().read(size)
+
+
+class NoTransactionStream(BytesIO):
+    """Request body recording whether a transaction was open on reads"""
+
+    def read(self, size=-1):
+        self.in_transaction = connection.in_atomic_block
+        return super().read(size)
+
+
+class UploadTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user('test@o2.pl', 'haslo123')
+        self.recipe = Recipe.objects.create(
+            user=user, title='Soup', time_minutes=10, price=5
+        )
+
+    def test_dropped_chunk_keeps_received_bytes(self):
+        """Test that the bytes of an interrupted chunk are kept"""
+        upload = uploads.start_upload(self.recipe, 10 * uploads.CHUNK_SIZE)
+
+        upload = uploads.append_chunk(
+            upload, 0, DroppedStream(b'x' * 2 * uploads.CHUNK_SIZE)
+        )
+
+        self.assertEqual(upload.offset, uploads.CHUNK_SIZE)
+        self.assertEqual(os.path.getsize(upload.path), uploads.CHUNK_SIZE)
+
+    def test_resent_chunk_overwrites_leftovers(self):
+        """Test that bytes past the recorded offset are discarded"""
+        upload = uploads.start_upload(self.recipe, 10)
+        with open(upload.path, 'wb') as part:
+            part.write(b'garbage')
+
+        upload = uploads.append_chunk(upload, 0, BytesIO(b'abc'))
+
+        with open(upload.path, 'rb') as part:
+            self.assertEqual(part.read(), b'abc')
+
+    def test_concurrent_chunk_refused(self):
+        """Test that a chunk arriving while another is written conflicts"""
+        upload = uploads.start_upload(self.recipe, 10)
+
+        with open(upload.path, 'r+b') as part:
+            fcntl.flock(part, fcntl.LOCK_EX)
+            with self.assertRaises(uploads.OffsetMismatch):
+                uploads.append_chunk(upload, 0, BytesIO(b'abc'))
+
+        upload.refresh_from_db()
+        self.assertEqual(upload.offset, 0)
+
+    def test_expire_uploads(self):
+        """Test that expired uploads and stale files are removed"""
+        live = uploads.start_upload(self.recipe, 10)
+        expired = uploads.start_upload(self.recipe, 10)
+        ImageUpload.objects.filter(pk=expired.pk).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        stale = os.path.join(os.path.dirname(live.path), 'stale.part')
+        open(stale, 'wb').close()
+        past = time.time() - 2 * 24 * 60 * 60
+        os.utime(stale, (past, past))
+
+        out = StringIO()
+        call_command('expire_uploads', stdout=out)
+
+        self.assertIn('Expired 1 uploads and removed 1 stale files',
+                      out.getvalue())
+
+        self.assertEqual(list(ImageUpload.objects.all()), [live])
+        self.assertTrue(os.path.exists(live.path))
+        self.assertFalse(os.path.exists(expired.path))
+        self.assertFalse(os.path.exists(stale))
+
+
+class ChunkTransactionTests(TransactionTestCase):
+
+    def test_body_read_outside_transaction(self):
+        """Test that no transaction is held while the chunk arrives"""
+        user = get_user_model().objects.create_user('test@o2.pl', 'haslo123')
+        recipe = Recipe.objects.create(
+            user=user, title='Soup', time_minutes=10, price=5
+        )
+        upload = uploads.start_upload(recipe, 10)
+        stream = NoTransactionStream(b'abc')
+
+        upload = uploads.append_chunk(upload, 0, stream)
+
+        self.assertFalse(stream.in_transaction)
+        self.assertEqual(upload.offset, 3)
+        uploads.discard_upload(upload)
+
+    @skipUnless(connection.features.has_select_for_update,
+                'needs row locks')
+    @override_settings(UPLOAD_QUOTA_BYTES=100)
+    def test_overlapping_reservations_share_quota(self):
+        """Test that uploads started together cannot overrun the quota"""
+        user = get_user_model().objects.create_user('test@o2.pl', 'haslo123')
+        recipe = Recipe.objects.create(
+            user=user, title='Soup', time_minutes=10, price=5
+        )
+        outcome = []
+
+        def reserve():
+            try:
+                outcome.append(uploads.start_upload(recipe, 60))
+            except uploads.UploadQuotaExceeded as exc:
+                outcome.append(exc)
+            finally:
+                connections.close_all()
+
+        with transaction.atomic():
+            first = uploads.start_upload(recipe, 60)
+            other = threading.Thread(target=reserve)
+            other.start()
+            other.join(0.5)
+            self.assertTrue(other.is_alive())
+        other.join()
+
+        self.assertIsInstance(outcome[0], uploads.UploadQuotaExceeded)
+        uploads.discard_upload(first)
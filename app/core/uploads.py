@@ -0,0 +1,206 @@
+import fcntl
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import UploadedFile
+from django.db import router, transaction
+from django.db.models import Sum
+from django.http import Http404
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from core.models import ImageUpload
+from core.storage import CHUNK_SIZE, sniff_extension
+
+
+class OffsetMismatch(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The chunk does not start where the upload stopped.'
+    default_code = 'offset_mismatch'
+
+    def __init__(self, offset):
+        super().__init__()
+        self.offset = offset
+
+
+class UploadQuotaExceeded(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Too many bytes are reserved by unfinished uploads.'
+    default_code = 'upload_quota_exceeded'
+
+
+class ReceivedFile(UploadedFile):
+    """Completely received upload, validated and stored from its own file"""
+
+    def temporary_file_path(self):
+        """Let image validation open the file instead of a memory copy"""
+        return self.file.name
+
+
+def _expiry():
+    return timezone.now() + timedelta(seconds=settings.UPLOAD_SESSION_SECONDS)
+
+
+def remove_file(path):
+    """Remove a partial file unless it is already gone"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def start_upload(recipe, size):
+    """Open an upload of `size` bytes for a recipe's image
+
+    Unfinished uploads of the user reserve their full size against the
+    upload quota until they finish or expire. The user row stays locked
+    from the check to the new reservation, so uploads started at the same
+    time cannot both fit into the last of the quota.
+    """
+    using = router.db_for_write(ImageUpload)
+    with transaction.atomic(using=using):
+        get_user_model()._base_manager.using(using).select_for_update(
+        ).filter(pk=recipe.user_id).values_list('pk', flat=True).get()
+        reserved = ImageUpload.objects.using(using).filter(
+            user_id=recipe.user_id, expires_at__gt=timezone.now()
+        ).aggregate(total=Sum('size'))['total'] or 0
+        if reserved + size > settings.UPLOAD_QUOTA_BYTES:
+            raise UploadQuotaExceeded()
+
+        upload = ImageUpload.objects.using(using).create(
+            user_id=recipe.user_id, recipe=recipe, size=size,
+            expires_at=_expiry()
+        )
+    os.makedirs(settings.UPLOAD_SESSION_DIR, exist_ok=True)
+    open(upload.path, 'xb').close()
+    return upload
+
+
+def _locked_upload(pk):
+    """Return an unexpired upload locked until the transaction ends"""
+    try:
+        return ImageUpload.objects.select_for_update().get(
+            pk=pk, expires_at__gt=timezone.now()
+        )
+    except ImageUpload.DoesNotExist:
+        raise Http404
+
+
+def append_chunk(upload, offset, stream):
+    """Append the bytes of `stream` at `offset` and return the upload
+
+    The chunk is copied to the partial file piece by piece, never held in
+    memory whole. A chunk cut short by a dropped connection keeps the
+    bytes that arrived, so the client resumes from the returned offset.
+    The upload row is only locked to check and to advance the offset;
+    while the body arrives a lock on the partial file keeps out other
+    chunks, so no database transaction waits on the client.
+    """
+    using = router.db_for_write(ImageUpload)
+    try:
+        part = open(upload.path, 'r+b')
+    except FileNotFoundError:
+        raise Http404
+    with part:
+        try:
+            fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Another chunk of this upload is being written
+            raise OffsetMismatch(upload.offset)
+
+        with transaction.atomic(using=using):
+            upload = _locked_upload(upload.pk)
+        if offset != upload.offset:
+            raise OffsetMismatch(upload.offset)
+
+        # Drop bytes a write that failed before saving its offset left
+        part.seek(offset)
+        part.truncate()
+        received = 0
+        while True:
+            try:
+                chunk = stream.read(CHUNK_SIZE)
+            except OSError:
+                break
+            if not chunk:
+                break
+            if offset + received + len(chunk) > upload.size:
+                part.truncate(offset)
+                raise ValidationError(
+                    'The chunk goes past the size of the upload.'
+                )
+            part.write(chunk)
+            received += len(chunk)
+        part.flush()
+
+        with transaction.atomic(using=using):
+            upload = _locked_upload(upload.pk)
+            if offset != upload.offset:
+                raise OffsetMismatch(upload.offset)
+            upload.offset += received
+            upload.expires_at = _expiry()
+            upload.save(update_fields=['offset', 'expires_at'])
+    return upload
+
+
+def received_file(upload):
+    """Return the file of a finished upload"""
+    if upload.offset != upload.size:
+        raise ValidationError({'offset': (
+            f'Only {upload.offset} of {upload.size} bytes were uploaded.'
+        )})
+    try:
+        part = open(upload.path, 'rb')
+    except FileNotFoundError:
+        raise Http404
+    # Clients name nothing, so the name gets the extension of the content
+    ext = sniff_extension(part.read(16))
+    part.seek(0)
+    return ReceivedFile(part, name=f'{upload.pk}.{ext}', size=upload.size)
+
+
+def discard_upload(upload):
+    """Delete an upload and, once that commits, its partial file"""
+    path = upload.path
+    using = upload._state.db
+    upload.delete(using=using)
+    transaction.on_commit(lambda: remove_file(path), using=using)
+
+
+def expire_uploads(using):
+    """Delete expired uploads of a database and return how many there were"""
+    with transaction.atomic(using=using):
+        uploads = ImageUpload.objects.using(using)
+        # Locked, so a chunk arriving meanwhile finds its upload gone
+        # instead of writing to a file removed below
+        expired = list(uploads.select_for_update().filter(
+            expires_at__lte=timezone.now()
+        ).only('pk'))
+        uploads.filter(pk__in=[upload.pk for upload in expired])._raw_delete(
+            using
+        )
+    for upload in expired:
+        remove_file(upload.path)
+    return len(expired)
+
+
+def remove_stale_files():
+    """Remove partial files untouched for longer than an upload lives
+
+    Chunks refresh their file's modification time along with the upload's
+    expiry, so such files belong to expired or deleted uploads.
+    """
+    directory = settings.UPLOAD_SESSION_DIR
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = time.time() - settings.UPLOAD_SESSION_SECONDS
+    removed = 0
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            remove_file(entry.path)
+            removed += 1
+    return removed
@@ -0,0 +1,215 @@
+import json
+import logging
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.http import Http404
+from django.urls import resolve
+from rest_framework import serializers, status
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from core import coalescing
+from core.db_router import is_pinned, mark_written, pinned_to_primary
+
+logger = logging.getLogger(__name__)
+
+SUB_REQUEST_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class SubRequestSerializer(serializers.Serializer):
+    """Serializer for one API call inside a batch"""
+    method = serializers.ChoiceField(choices=SUB_REQUEST_METHODS,
+                                     default='GET')
+    path = serializers.CharField(max_length=2048)
+    body = serializers.JSONField(required=False)
+
+    def validate_path(self, value):
+        """Only allow paths under the batchable API prefixes"""
+        if not value.startswith(tuple(settings.BATCH_ALLOWED_PREFIXES)):
+            raise serializers.ValidationError(
+                'Only paths under '
+                f"{', '.join(settings.BATCH_ALLOWED_PREFIXES)} can be batched."
+            )
+        return value
+
+
+class BatchSerializer(serializers.Serializer):
+    """Serializer for a list of API calls made in one request"""
+    requests = serializers.ListField(
+        child=SubRequestSerializer(),
+        min_length=1
+    )
+
+    def validate_requests(self, value):
+        """Cap the number of calls one batch may make"""
+        if len(value) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(
+                f'Ensure this field has no more than '
+                f'{settings.BATCH_MAX_REQUESTS} elements.'
+            )
+        return value
+
+
+def sub_request(request, item):
+    """Build a request for a batch item authenticated like the batch"""
+    url = urlsplit(item['path'])
+    body = b''
+    environ = dict(request._request.META)
+    environ.pop('CONTENT_TYPE', None)
+    if 'body' in item:
+        body = json.dumps(item['body']).encode()
+        environ['CONTENT_TYPE'] = 'application/json'
+    environ.update({
+        'REQUEST_METHOD': item['method'],
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_LENGTH': str(len(body)),
+        'HTTP_ACCEPT': 'application/json',
+        'wsgi.input': BytesIO(body),
+    })
+
+    sub = WSGIRequest(environ)
+    # DRF views use these instead of authenticating the request again.
+    sub._force_auth_user = request.user
+    sub._force_auth_token = request.auth
+    sub._dont_enforce_csrf_checks = True
+    return sub
+
+
+def run_sub_request(request, item, pinned):
+    """Run one batch item through its view and return its result"""
+    try:
+        match = resolve(urlsplit(item['path']).path)
+    except Http404:
+        return {'status': status.HTTP_404_NOT_FOUND,
+                'body': {'detail': 'Not found.'}}
+
+    try:
+        with pinned_to_primary() if pinned else nullcontext():
+            response = match.func(
+                sub_request(request, item), *match.args, **match.kwargs
+            )
+        if response.streaming:
+            # A stream never ends by itself, so it cannot be batched; close
+            # it so what it holds open is released without iterating it.
+            response.close()
+            return {'status': status.HTTP_400_BAD_REQUEST,
+                    'body': {'detail': 'Streaming responses cannot be '
+                                       'batched.'}}
+        if hasattr(response, 'render'):
+            response.render()
+        content = response.content
+    except Exception:
+        logger.exception('Batch item %s %s failed', item['method'],
+                         item['path'])
+        return {'status': status.HTTP_500_INTERNAL_SERVER_ERROR,
+                'body': {'detail': 'Internal server error.'}}
+
+    if not content:
+        body = None
+    elif response.get('Content-Type', '').startswith('application/json'):
+        body = json.loads(content.decode(response.charset))
+    else:
+        body = content.decode(response.charset, errors='replace')
+    return {'status': response.status_code, 'body': body}
+
+
+def batch_executor():
+    """Return the process-wide thread pool running batched reads
+
+    Its BATCH_DB_CONNECTIONS threads bound the database connections every
+    batch in the process uses at once, and keep them open between batches
+    for CONN_MAX_AGE like request threads do.
+    """
+    global _executor
+    size = settings.BATCH_DB_CONNECTIONS
+    with _executor_lock:
+        if _executor is None or _executor._max_workers != size:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(
+                max_workers=size, thread_name_prefix='batch'
+            )
+        return _executor
+
+
+class BatchView(APIView):
+    """Run several API calls in one request and return all their results
+
+    Consecutive GETs run concurrently on the process-wide batch thread
+    pool. Other methods run one at a time, in order, after the calls
+    before them have finished, and pin the reads after them and the
+    client's next requests to the primary.
+    """
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def _run_concurrently(self, executor, request, items, pinned):
+        """Run independent GETs, in threads when the budget allows"""
+        if executor is None:
+            return [run_sub_request(request, item, pinned) for item in items]
+
+        def run(item):
+            close_old_connections()
+            try:
+                return run_sub_request(request, item, pinned)
+            finally:
+                close_old_connections()
+
+        return list(executor.map(run, items))
+
+    def _run(self, executor, request, items):
+        """Run batch items, letting writes act as barriers"""
+        pinned = is_pinned()
+        results, reads = [], []
+        for item in items:
+            if item['method'] == 'GET':
+                reads.append(item)
+                continue
+            results += self._run_concurrently(
+                executor, request, reads, pinned
+            )
+            reads = []
+            pinned = True
+            mark_written(request._request)
+            results.append(run_sub_request(request, item, pinned))
+        results += self._run_concurrently(executor, request, reads, pinned)
+        return results
+
+    def post(self, request):
+        """Run the batched calls and return their statuses and bodies"""
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['requests']
+
+        executor = None
+        if settings.BATCH_DB_CONNECTIONS > 1:
+            executor = batch_executor()
+        results = self._run(executor, request, items)
+
+        return Response([
+            dict(result, path=item['path'], method=item['method'])
+            for item, result in zip(items, results)
+        ])
+
+
+class CoalescingStatsView(APIView):
+    """Report how many reads this process served from shared computations"""
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        """Return the coalescing counters of each coalesced read"""
+        return Response({'recipe_list': coalescing.recipe_lists.stats()})
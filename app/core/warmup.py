@@ -0,0 +1,61 @@
+import logging
+import time
+from importlib import import_module
+
+from django.apps import apps
+from django.urls import URLPattern, get_resolver
+
+logger = logging.getLogger(__name__)
+
+# Modules kept out of startup imports that requests still need
+DEFERRED_IMPORTS = ('core.similarity', 'PIL.Image')
+
+
+def _views(patterns):
+    """Yield the view callbacks of a tree of URL patterns"""
+    for pattern in patterns:
+        if isinstance(pattern, URLPattern):
+            yield pattern.callback
+        else:
+            yield from _views(pattern.url_patterns)
+
+
+def _serializer_classes(callbacks):
+    """Return the serializer classes of DRF views and viewsets"""
+    classes = set()
+    for callback in callbacks:
+        view_class = getattr(callback, 'cls', None)
+        serializer_class = getattr(view_class, 'serializer_class', None)
+        if serializer_class is not None:
+            classes.add(serializer_class)
+    return classes
+
+
+def warmup():
+    """Do the one-off work of a first request before serving any
+
+    Imports the URLconf and every view, fills the resolver caches, builds
+    model metadata and the fields of each view's serializer once, and
+    imports modules deferred at startup.
+    """
+    started = time.perf_counter()
+
+    resolver = get_resolver()
+    # Reading it fills the resolver's lookup caches
+    resolver.reverse_dict
+    callbacks = list(_views(resolver.url_patterns))
+
+    for model in apps.get_models():
+        model._meta.get_fields()
+
+    for serializer_class in _serializer_classes(callbacks):
+        try:
+            serializer_class(context={}).fields
+        except Exception:
+            logger.debug('Could not warm up %s', serializer_class,
+                         exc_info=True)
+
+    for module in DEFERRED_IMPORTS:
+        import_module(module)
+
+    logger.info('Warmed up in %.0f ms', (time.perf_counter() - started) * 1e3)
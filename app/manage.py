@@ -3,7 +3,12 @@ import os
 import sys
 
 if __name__ == '__main__':
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+    profile = os.environ.get('DJANGO_ENV', 'dev')
+    os.environ.setdefault(
+        'DJANGO_SETTINGS_MODULE',
+        'app.settings.test' if sys.argv[1:2] == ['test']
+        else f'app.settings.{profile}'
+    )
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -0,0 +1,243 @@
+import copy
+import threading
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+
+from core.deletion import pruned_seq
+from core.models import Recipe, Tombstone
+from core.sharding import change_seq_for_user, shard_for_user
+
+
+def to_bitset(positions, size):
+    """Return an integer with the bits at `positions` set"""
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def iter_bits(bitset):
+    """Yield the positions of the set bits of an integer"""
+    # Searching the binary digits stays linear in the size of the bitset,
+    # where peeling off the lowest bit would copy it once per set bit.
+    digits = bin(bitset)[:1:-1]
+    position = digits.find('1')
+    while position != -1:
+        yield position
+        position = digits.find('1', position + 1)
+
+
+class CookableIndex:
+    """Inverted index from a user's ingredients to bitsets of recipes
+
+    Bit `n` of every bitset stands for the recipe at position `n` of
+    `recipe_ids`. Recipes are grouped by ingredient count as well, so the
+    recipes missing exactly `m` ingredients are the ones whose matched
+    count equals their size minus `m`. Deleted recipes leave an empty
+    position that is in no group, until the index is built again.
+    """
+
+    def __init__(self, recipe_ids, ingredients):
+        self.recipe_ids = recipe_ids
+        self.ingredients = ingredients
+        self.positions = {
+            recipe_id: n for n, recipe_id in enumerate(recipe_ids)
+        }
+        self.empty = 0
+        self.full = (1 << len(recipe_ids)) - 1
+
+        postings = defaultdict(list)
+        by_size = defaultdict(list)
+        for position, recipe_ingredients in enumerate(ingredients):
+            by_size[len(recipe_ingredients)].append(position)
+            for ingredient_id in recipe_ingredients:
+                postings[ingredient_id].append(position)
+        size = len(recipe_ids)
+        self.postings = {
+            ingredient_id: to_bitset(positions, size)
+            for ingredient_id, positions in postings.items()
+        }
+        self.by_size = {
+            count: to_bitset(positions, size)
+            for count, positions in by_size.items()
+        }
+
+    @classmethod
+    def build(cls, user_id, using=None):
+        """Build the index of a user's recipes with two queries"""
+        recipes = Recipe.objects.db_manager(using).filter(user_id=user_id)
+        recipe_ids = list(
+            recipes.order_by('pk').values_list('pk', flat=True)
+        )
+        position = {recipe_id: n for n, recipe_id in enumerate(recipe_ids)}
+        ingredients = [[] for _ in recipe_ids]
+        links = Recipe.ingredients.through.objects.db_manager(using).filter(
+            recipe__user_id=user_id
+        ).values_list('recipe_id', 'ingredient_id')
+        for recipe_id, ingredient_id in links.iterator():
+            if recipe_id in position:
+                ingredients[position[recipe_id]].append(ingredient_id)
+
+        return cls(recipe_ids, [tuple(items) for items in ingredients])
+
+    def _clear(self, position):
+        """Take the recipe at a position out of every bitset"""
+        mask = ~(1 << position)
+        ingredients = self.ingredients[position]
+        for ingredient_id in ingredients:
+            self.postings[ingredient_id] &= mask
+        self.by_size[len(ingredients)] &= mask
+        self.ingredients[position] = ()
+
+    def apply(self, changed, deleted):
+        """Return a copy of the index with some recipes changed or deleted
+
+        `changed` maps recipe ids to their ingredient ids. Only the bits
+        of those recipes are rewritten; the copy leaves this index intact
+        for the searches still using it.
+        """
+        index = copy.copy(self)
+        index.recipe_ids = list(self.recipe_ids)
+        index.ingredients = list(self.ingredients)
+        index.positions = dict(self.positions)
+        index.postings = dict(self.postings)
+        index.by_size = dict(self.by_size)
+
+        for recipe_id in set(deleted) | set(changed):
+            position = index.positions.get(recipe_id)
+            if position is None:
+                continue
+            index._clear(position)
+            if recipe_id not in changed:
+                del index.positions[recipe_id]
+                index.recipe_ids[position] = None
+                index.empty += 1
+
+        for recipe_id, ingredients in changed.items():
+            position = index.positions.get(recipe_id)
+            if position is None:
+                position = index.positions[recipe_id] = len(index.recipe_ids)
+                index.recipe_ids.append(recipe_id)
+                index.ingredients.append(())
+                index.full |= 1 << position
+            bit = 1 << position
+            index.ingredients[position] = tuple(ingredients)
+            for ingredient_id in ingredients:
+                index.postings[ingredient_id] = (
+                    index.postings.get(ingredient_id, 0) | bit
+                )
+            size = len(ingredients)
+            index.by_size[size] = index.by_size.get(size, 0) | bit
+        return index
+
+    def _matched_counts(self, have):
+        """Return bit planes counting how many `have` items each recipe uses
+
+        The counts are added with a ripple-carry adder over whole bitsets,
+        so every ingredient costs a few big integer operations however many
+        recipes there are.
+        """
+        planes = []
+        for ingredient_id in have:
+            carry = self.postings.get(ingredient_id, 0)
+            for n, plane in enumerate(planes):
+                if not carry:
+                    break
+                planes[n], carry = plane ^ carry, plane & carry
+            if carry:
+                planes.append(carry)
+        return planes
+
+    def _equal_to(self, planes, value):
+        """Return the recipes whose bit-sliced count equals `value`"""
+        if value >> len(planes):
+            return 0
+        result = self.full
+        for n, plane in enumerate(planes):
+            result &= plane if value >> n & 1 else self.full ^ plane
+        return result
+
+    def search(self, have, max_missing=0):
+        """Return recipes missing at most `max_missing` of `have`
+
+        Results are (recipe id, missing ingredient ids, coverage) tuples,
+        best covered first.
+        """
+        have = set(have)
+        planes = self._matched_counts(have)
+        results = []
+        for missing in range(max_missing + 1):
+            for size, recipes in self.by_size.items():
+                if size < missing:
+                    continue
+                found = recipes & self._equal_to(planes, size - missing)
+                for position in iter_bits(found):
+                    ingredients = self.ingredients[position]
+                    results.append((
+                        self.recipe_ids[position],
+                        [i for i in ingredients if i not in have],
+                        (size - missing) / size if size else 1.0,
+                    ))
+        results.sort(key=lambda item: (-item[2], len(item[1]), -item[0]))
+        return results
+
+
+_lock = threading.Lock()
+_indexes = OrderedDict()
+
+
+def _changes_since(user_id, seq, using):
+    """Return the recipes of a user changed and deleted after `seq`
+
+    Edits to a recipe's ingredients, including deleting one of them,
+    move the recipe's change sequence, so its row shows every change.
+    """
+    changed = {
+        recipe_id: [] for recipe_id in Recipe.objects.db_manager(
+            using
+        ).filter(
+            user_id=user_id, change_seq__gt=seq
+        ).values_list('pk', flat=True)
+    }
+    links = Recipe.ingredients.through.objects.db_manager(using).filter(
+        recipe_id__in=list(changed)
+    ).values_list('recipe_id', 'ingredient_id')
+    for recipe_id, ingredient_id in links:
+        changed[recipe_id].append(ingredient_id)
+    deleted = Tombstone.objects.db_manager(using).filter(
+        user_id=user_id, kind='recipe', change_seq__gt=seq
+    ).values_list('object_id', flat=True)
+    return changed, list(deleted)
+
+
+def index_for_user(user_id):
+    """Return the cookable index of a user, updated after changes
+
+    Indexes are kept per process and keyed by the user's change sequence,
+    which moves on every write to their recipes and ingredients. A stale
+    index takes in just the recipes changed since its sequence, and is
+    built again once deleted recipes leave half of it empty or when
+    tombstones it has not seen were pruned.
+    """
+    seq = change_seq_for_user(user_id)
+
+    with _lock:
+        cached = _indexes.get(user_id)
+        if cached is not None and cached[0] == seq:
+            _indexes.move_to_end(user_id)
+            return cached[1]
+
+    using = shard_for_user(user_id)
+    if (cached is None
+            or cached[1].empty * 2 > len(cached[1].recipe_ids)
+            or cached[0] < pruned_seq(user_id, using)):
+        index = CookableIndex.build(user_id, using=using)
+    else:
+        index = cached[1].apply(*_changes_since(user_id, cached[0], using))
+    with _lock:
+        _indexes[user_id] = (seq, index)
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > settings.COOKABLE_INDEX_USERS:
+            _indexes.popitem(last=False)
+    return index
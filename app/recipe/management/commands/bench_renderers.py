@@ -0,0 +1,70 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from core.middleware import COMPRESSORS
+from recipe.renderers import CompactJSONRenderer, MessagePackRenderer
+
+
+def sample_recipes(count):
+    """Return recipe list payloads shaped like RecipeSerializer output"""
+    string_rows, numeric_rows = [], []
+    for i in range(count):
+        row = {
+            'id': i + 1,
+            'title': f'Recipe number {i}',
+            'time_minutes': 5 + i % 120,
+            'price': Decimal(i % 5000) / 100,
+            'link': f'https://example.com/recipes/{i}',
+            'ingredients': [i, i + 1, i + 2, i + 3],
+            'tags': [i % 7, i % 11],
+        }
+        numeric_rows.append(row)
+        string_rows.append(dict(row, price=f"{row['price']:.2f}"))
+    return string_rows, numeric_rows
+
+
+class Command(BaseCommand):
+    """Django command to compare response size and encode time per format"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def _time(self, func, repeat):
+        """Return the result of func and its best run time in milliseconds"""
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best * 1000
+
+    def handle(self, *args, **options):
+        string_rows, numeric_rows = sample_recipes(options['rows'])
+        candidates = [
+            ('json', JSONRenderer(), string_rows),
+            ('compact', CompactJSONRenderer(), numeric_rows),
+            ('msgpack', MessagePackRenderer(), numeric_rows),
+        ]
+
+        self.stdout.write(
+            f"{options['rows']} recipes, best of {options['repeat']} runs"
+        )
+        self.stdout.write(f"{'format':<18}{'bytes':>10}{'encode ms':>12}")
+        for name, renderer, data in candidates:
+            body, elapsed = self._time(
+                lambda: renderer.render(data), options['repeat']
+            )
+            self.stdout.write(f"{name:<18}{len(body):>10}{elapsed:>12.2f}")
+            for coding, compress in sorted(COMPRESSORS.items()):
+                packed, extra = self._time(
+                    lambda: compress(body), options['repeat']
+                )
+                self.stdout.write(
+                    f"{name + '+' + coding:<18}{len(packed):>10}"
+                    f"{elapsed + extra:>12.2f}"
+                )
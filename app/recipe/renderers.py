@@ -0,0 +1,74 @@
+import decimal
+import json
+
+import msgpack
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+def _msgpack_default(obj):
+    """Encode values msgpack does not know natively"""
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    return str(obj)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Renderer which serializes to MessagePack"""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    numeric_decimals = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render `data` into a MessagePack bytestring"""
+        if data is None:
+            return bytes()
+
+        return msgpack.packb(
+            data, default=_msgpack_default, use_bin_type=True
+        )
+
+
+class CompactJSONRenderer(JSONRenderer):
+    """Renderer which lays out lists of objects as columns and rows
+
+    A list of objects is rendered as ``{"fields": [...], "rows": [[...]]}``
+    so each field name is sent once instead of once per object. The
+    columns are the keys of all objects, in order of first appearance,
+    and a key an object lacks is sent as null.
+    """
+    media_type = 'application/vnd.recipe.compact+json'
+    format = 'compact'
+    compact = True
+    numeric_decimals = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render `data` into columnar JSON when it is a list of objects"""
+        if isinstance(data, list) and all(isinstance(i, dict) for i in data):
+            fields = list(dict.fromkeys(
+                field for item in data for field in item
+            ))
+            data = {
+                'fields': fields,
+                'rows': [
+                    [item.get(field) for field in fields] for item in data
+                ],
+            }
+
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Renderer which lets clients negotiate Server-Sent Events
+
+    Streams are written by the view itself; this only renders errors.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render `data` as a single SSE error event"""
+        if data is None:
+            return bytes()
+        return f'event: error\ndata: {json.dumps(data)}\n\n'.encode()
@@ -1,8 +1,56 @@
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
 from rest_framework import serializers
-from core.models import Tag, Ingredient, Recipe
 
+from core import images
+from core.attributes import resolve_names
+from core.models import Tag, Ingredient, Recipe, ImageUpload
+from core.relations import write_relations
 
-class TagSerializer(serializers.ModelSerializer):
+
+class UniqueNameMixin:
+    """Reject names the requesting user already gave another object
+
+    The check in validate_name gives the usual field error; a concurrent
+    request taking the name after the check hits the unique constraint
+    instead, which is reported the same way.
+    """
+
+    def _name_taken(self):
+        return (f'You already have a {self.Meta.model._meta.verbose_name} '
+                f'with this name.')
+
+    def validate_name(self, value):
+        """Check the name is not taken by another of the user's objects"""
+        request = self.context.get('request')
+        if request is None:
+            return value
+        queryset = self.Meta.model.objects.filter(
+            user=request.user, name=value
+        )
+        if self.instance is not None:
+            queryset = queryset.exclude(pk=self.instance.pk)
+        if queryset.exists():
+            raise serializers.ValidationError(self._name_taken())
+        return value
+
+    def _save_unique(self, save, *args):
+        """Run a save in a savepoint, turning name clashes into errors"""
+        try:
+            with transaction.atomic(
+                    using=router.db_for_write(self.Meta.model)):
+                return save(*args)
+        except IntegrityError:
+            raise serializers.ValidationError({'name': [self._name_taken()]})
+
+    def create(self, validated_data):
+        return self._save_unique(super().create, validated_data)
+
+    def update(self, instance, validated_data):
+        return self._save_unique(super().update, instance, validated_data)
+
+
+class TagSerializer(UniqueNameMixin, serializers.ModelSerializer):
     """Serializer for tag objects"""
 
     class Meta:
@@ -11,7 +59,7 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_Fields = ("id",)
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(UniqueNameMixin, serializers.ModelSerializer):
     """Serializer for ingredient objects"""
     class Meta:
         model = Ingredient
@@ -19,15 +67,62 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ("id",)
 
 
-class RecipeSerializer(serializers.ModelSerializer):
-    """Serializer for recipe objects"""
+class NumericDecimalMixin:
+    """Keep decimals numeric for renderers that encode numbers compactly"""
+
+    def get_fields(self):
+        """Turn off string coercion of decimals for numeric renderers"""
+        fields = super().get_fields()
+        request = self.context.get('request')
+        renderer = getattr(request, 'accepted_renderer', None)
+
+        if getattr(renderer, 'numeric_decimals', False):
+            for field in fields.values():
+                if isinstance(field, serializers.DecimalField):
+                    field.coerce_to_string = False
+        return fields
+
+
+class NameOrPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Related field taking an id, or a name to find or create by
+
+    Names are passed through as strings for the serializer to resolve all
+    at once. Strings of digits are read as ids; a name made of digits is
+    given as an object, {"name": "1984"}.
+    """
+    default_error_messages = {
+        'invalid_name': 'Ensure names have 1 to {max_length} characters.',
+    }
+    max_length = 255
 
-    ingredients = serializers.PrimaryKeyRelatedField(
+    def to_internal_value(self, data):
+        if isinstance(data, dict):
+            data = data.get('name')
+            if not isinstance(data, str):
+                self.fail('invalid_name', max_length=self.max_length)
+        elif not isinstance(data, str) or data.strip().isdigit():
+            return super().to_internal_value(data)
+        name = data.strip()
+        if not 0 < len(name) <= self.max_length:
+            self.fail('invalid_name', max_length=self.max_length)
+        return name
+
+
+class RecipeSerializer(NumericDecimalMixin, serializers.ModelSerializer):
+    """Serializer for recipe objects
+
+    Tags and ingredients are given by id or by name; names the user has
+    not used yet are created along with the recipe.
+    """
+
+    ingredients = NameOrPrimaryKeyRelatedField(
         many=True,
+        required=False,
         queryset=Ingredient.objects.all()
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = NameOrPrimaryKeyRelatedField(
         many=True,
+        required=False,
         queryset=Tag.objects.all()
     )
 
@@ -37,6 +132,56 @@ class RecipeSerializer(serializers.ModelSerializer):
                   "price", "link", "ingredients", "tags")
         read_only_fields = ("id",)
 
+    def _resolve_names(self, validated_data, user_id, using):
+        """Replace tag and ingredient names with the ids they stand for"""
+        for field, model in (('tags', Tag), ('ingredients', Ingredient)):
+            items = validated_data.get(field)
+            names = [item for item in items or () if isinstance(item, str)]
+            if not names:
+                continue
+            ids = resolve_names(model, user_id, names, using)
+            validated_data[field] = list(dict.fromkeys(
+                ids[item] if isinstance(item, str) else item.pk
+                for item in items
+            ))
+
+    def create(self, validated_data):
+        """Create a recipe, its new tags and ingredients in one transaction"""
+        using = router.db_for_write(Recipe)
+        with transaction.atomic(using=using):
+            self._resolve_names(
+                validated_data, validated_data['user'].pk, using
+            )
+            return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        """Update a recipe and create its new tags and ingredients
+
+        Only fields whose value changed are saved and only links that
+        changed are written; a recipe whose tags or ingredients alone
+        changed only gets its change_seq bumped.
+        """
+        using = instance._state.db
+        with transaction.atomic(using=using):
+            self._resolve_names(validated_data, instance.user_id, using)
+            relations = {
+                field: validated_data.pop(field)
+                for field in ('tags', 'ingredients') if field in validated_data
+            }
+            changed = [
+                attr for attr, value in validated_data.items()
+                if getattr(instance, attr) != value
+            ]
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+
+            seq = None
+            if changed:
+                instance.save(using=using, update_fields=changed)
+                seq = instance.change_seq
+            write_relations(instance, relations, using, seq=seq)
+        return instance
+
 
 class RecipeDetailSerializer(RecipeSerializer):
     """Serialize a recipe detail"""
@@ -44,10 +189,116 @@ class RecipeDetailSerializer(RecipeSerializer):
     tags = TagSerializer(many=True, read_only=True)
 
 
+class BoundedImageField(serializers.FileField):
+    """Image field decoding uploads in bounded memory and without EXIF"""
+
+    def to_internal_value(self, data):
+        file = super().to_internal_value(data)
+        try:
+            return images.sanitize(file)
+        except images.InvalidImage as exc:
+            raise serializers.ValidationError(str(exc))
+
+
 class RecipeImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading images to recipes"""
+    image = BoundedImageField(allow_null=True)
 
     class Meta:
         model = Recipe
         fields = ("id", "image")
         read_only_fields = ("id",)
+
+
+class ImageUploadSerializer(serializers.ModelSerializer):
+    """Serializer for resumable recipe image uploads"""
+
+    class Meta:
+        model = ImageUpload
+        fields = ("id", "size", "offset", "expires_at")
+        read_only_fields = ("id", "offset", "expires_at")
+        extra_kwargs = {"size": {"min_value": 1}}
+
+    def validate_size(self, value):
+        """Refuse images larger than the upload limit"""
+        if value > settings.UPLOAD_MAX_BYTES:
+            raise serializers.ValidationError(
+                f'Ensure this value is less than or equal to '
+                f'{settings.UPLOAD_MAX_BYTES}.'
+            )
+        return value
+
+
+class AttributeCountSerializer(serializers.Serializer):
+    """Serialize a tag or ingredient with the number of recipes using it"""
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    recipe_count = serializers.IntegerField()
+
+
+class RecipeStatsSerializer(serializers.Serializer):
+    """Serialize aggregated recipe statistics"""
+    recipe_count = serializers.IntegerField()
+    average_price = serializers.DecimalField(
+        max_digits=12, decimal_places=2, allow_null=True
+    )
+    average_time_minutes = serializers.FloatField(allow_null=True)
+    tags = AttributeCountSerializer(many=True)
+    top_ingredients = AttributeCountSerializer(many=True)
+
+
+class BulkDeleteSerializer(serializers.Serializer):
+    """Serializer for the ids of objects deleted at once"""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        min_length=1,
+        max_length=1000
+    )
+
+
+class CookableRecipeSerializer(serializers.Serializer):
+    """Serialize a recipe with the ingredients missing to cook it"""
+    recipe = RecipeSerializer()
+    missing = serializers.IntegerField()
+    missing_ingredients = serializers.ListField(
+        child=serializers.IntegerField()
+    )
+    coverage = serializers.FloatField()
+
+
+class SimilarRecipeSerializer(serializers.Serializer):
+    """Serialize a recipe with its estimated similarity to another"""
+    recipe = RecipeSerializer()
+    similarity = serializers.FloatField()
+
+
+class PlanItemSerializer(serializers.Serializer):
+    """Serializer for one recipe of a meal plan"""
+    recipe = serializers.IntegerField()
+    servings = serializers.IntegerField(min_value=1, max_value=1000, default=1)
+
+
+class ShoppingListRequestSerializer(serializers.Serializer):
+    """Serializer for the recipes a shopping list is made for"""
+    recipes = serializers.ListField(
+        child=PlanItemSerializer(),
+        min_length=1,
+        max_length=200
+    )
+
+
+class ShoppingListIngredientSerializer(serializers.Serializer):
+    """Serialize an ingredient with the recipes of a plan needing it"""
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    recipe_count = serializers.IntegerField()
+    servings = serializers.IntegerField()
+    recipes = serializers.ListField(child=serializers.IntegerField())
+
+
+class ShoppingListSerializer(NumericDecimalMixin, serializers.Serializer):
+    """Serialize the ingredients needed for a meal plan"""
+    recipe_count = serializers.IntegerField()
+    servings = serializers.IntegerField()
+    total_price = serializers.DecimalField(max_digits=14, decimal_places=2)
+    ingredients = ShoppingListIngredientSerializer(many=True)
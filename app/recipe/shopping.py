@@ -0,0 +1,80 @@
+import hashlib
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.models import Recipe
+from core.sharding import change_seq_for_user
+
+
+def normalize_plan(items):
+    """Merge plan items into sorted (recipe id, servings) pairs"""
+    servings = {}
+    for item in items:
+        servings[item['recipe']] = (
+            servings.get(item['recipe'], 0) + item['servings']
+        )
+    return sorted(servings.items())
+
+
+def build_shopping_list(user_id, plan):
+    """Return the ingredients needed for a plan of (recipe, servings)
+
+    Ingredients are collected with one query over the recipe ingredients
+    through table. Recipes carry no quantities, so servings scale how many
+    times each ingredient is needed. Raises KeyError listing recipe ids
+    the user does not own.
+    """
+    servings = dict(plan)
+    prices = dict(Recipe.objects.filter(
+        user_id=user_id, pk__in=servings
+    ).values_list('pk', 'price'))
+    unknown = sorted(set(servings) - set(prices))
+    if unknown:
+        raise KeyError(unknown)
+
+    ingredients = {}
+    links = Recipe.ingredients.through.objects.filter(
+        recipe_id__in=servings
+    ).order_by('ingredient__name', 'ingredient_id', 'recipe_id').values_list(
+        'recipe_id', 'ingredient_id', 'ingredient__name'
+    )
+    for recipe_id, ingredient_id, name in links:
+        entry = ingredients.setdefault(ingredient_id, {
+            'id': ingredient_id,
+            'name': name,
+            'recipe_count': 0,
+            'servings': 0,
+            'recipes': [],
+        })
+        entry['recipe_count'] += 1
+        entry['servings'] += servings[recipe_id]
+        entry['recipes'].append(recipe_id)
+
+    return {
+        'recipe_count': len(servings),
+        'servings': sum(servings.values()),
+        'total_price': sum(
+            (Decimal(str(prices[pk])) * count
+             for pk, count in servings.items()),
+            Decimal('0')
+        ),
+        'ingredients': list(ingredients.values()),
+    }
+
+
+def cached_shopping_list(user_id, plan):
+    """Return the shopping list of a plan, reusing it until the user writes
+
+    The cache key holds the user's change sequence, so any change to their
+    recipes or ingredients makes earlier lists unreachable.
+    """
+    digest = hashlib.sha256(json.dumps(plan).encode()).hexdigest()
+    key = f'shopping:{user_id}:{change_seq_for_user(user_id)}:{digest}'
+    shopping_list = cache.get(key)
+    if shopping_list is None:
+        shopping_list = build_shopping_list(user_id, plan)
+        cache.set(key, shopping_list, settings.SHOPPING_LIST_CACHE_SECONDS)
+    return shopping_list
@@ -0,0 +1,161 @@
+import random
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Ingredient, Recipe
+from recipe import cookable
+
+
+COOKABLE_URL = reverse('recipe:recipe-cookable')
+
+
+class CookableIndexTests(SimpleTestCase):
+
+    def test_search_matches_set_logic(self):
+        """Test that the bitset search agrees with plain set arithmetic"""
+        rng = random.Random(7)
+        recipes = [
+            tuple(rng.sample(range(30), rng.randint(0, 8)))
+            for _ in range(300)
+        ]
+        index = cookable.CookableIndex(list(range(300)), recipes)
+        have = set(rng.sample(range(30), 12))
+
+        for max_missing in (0, 1, 3):
+            found = {
+                recipe_id: missing
+                for recipe_id, missing, _ in index.search(have, max_missing)
+            }
+            expected = {
+                recipe_id: [i for i in items if i not in have]
+                for recipe_id, items in enumerate(recipes)
+                if len(set(items) - have) <= max_missing
+            }
+            self.assertEqual(found, expected)
+
+    def test_applied_changes_match_fresh_index(self):
+        """Test that an updated index searches like one built anew"""
+        rng = random.Random(11)
+        recipes = {
+            n: tuple(rng.sample(range(20), rng.randint(0, 6)))
+            for n in range(100)
+        }
+        index = cookable.CookableIndex(list(recipes), list(recipes.values()))
+        changed = {
+            n: tuple(rng.sample(range(20), rng.randint(0, 6)))
+            for n in rng.sample(range(150), 40)
+        }
+        deleted = [n for n in rng.sample(range(100), 30) if n not in changed]
+
+        updated = index.apply(changed, deleted)
+
+        for n in deleted:
+            del recipes[n]
+        recipes.update(changed)
+        fresh = cookable.CookableIndex(list(recipes), list(recipes.values()))
+        have = set(rng.sample(range(20), 8))
+        for max_missing in (0, 2):
+            self.assertEqual(
+                sorted(updated.search(have, max_missing)),
+                sorted(fresh.search(have, max_missing))
+            )
+        self.assertEqual(len(index.search(set(range(20)))), 100)
+
+    def test_ranked_by_coverage(self):
+        """Test that better covered recipes come first"""
+        index = cookable.CookableIndex([1, 2, 3], [(1, 2), (1, 2, 3), (3,)])
+
+        found = index.search({1, 2}, max_missing=1)
+
+        self.assertEqual([item[0] for item in found], [1, 2, 3])
+        self.assertEqual(found[1][2], 2 / 3)
+
+
+class CookableApiTests(TestCase):
+
+    def setUp(self):
+        cookable._indexes.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def recipe(self, title, *ingredients):
+        """Create a recipe using the given ingredients"""
+        recipe = Recipe.objects.create(
+            user=self.user, title=title, time_minutes=5, price=5
+        )
+        recipe.ingredients.add(*ingredients)
+        return recipe
+
+    def test_cookable_recipes(self):
+        """Test listing recipes covered by the given ingredients"""
+        eggs, salt, flour = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('Eggs', 'Salt', 'Flour')
+        ]
+        omelette = self.recipe('Omelette', eggs, salt)
+        bread = self.recipe('Bread', flour, salt)
+        cake = self.recipe('Cake', flour)
+
+        res = self.client.get(
+            COOKABLE_URL, {'ingredients': f'{eggs.id},{salt.id}'}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['recipe']['id'] for r in res.data], [omelette.id])
+
+        res = self.client.get(
+            COOKABLE_URL,
+            {'ingredients': f'{eggs.id},{salt.id}', 'missing': 1}
+        )
+
+        self.assertEqual(
+            [r['recipe']['id'] for r in res.data],
+            [omelette.id, bread.id, cake.id]
+        )
+        self.assertEqual(res.data[1]['missing_ingredients'], [flour.id])
+        self.assertEqual(res.data[1]['coverage'], 0.5)
+
+    def test_index_follows_changes(self):
+        """Test that new recipes show up without waiting for a rebuild"""
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        self.client.get(COOKABLE_URL, {'ingredients': salt.id})
+        recipe = self.recipe('Salt', salt)
+
+        res = self.client.get(COOKABLE_URL, {'ingredients': salt.id})
+
+        self.assertEqual([r['recipe']['id'] for r in res.data], [recipe.id])
+
+    def test_edit_updates_index_without_rebuild(self):
+        """Test that edits are applied to the cached index"""
+        salt, eggs = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('Salt', 'Eggs')
+        ]
+        soup = self.recipe('Soup', salt)
+        omelette = self.recipe('Omelette', eggs)
+        self.client.get(COOKABLE_URL, {'ingredients': salt.id})
+
+        soup.ingredients.add(eggs)
+        omelette.delete()
+        with mock.patch.object(
+                cookable.CookableIndex, 'build',
+                side_effect=AssertionError('rebuilt')):
+            res = self.client.get(
+                COOKABLE_URL, {'ingredients': f'{salt.id},{eggs.id}'}
+            )
+
+        self.assertEqual([r['recipe']['id'] for r in res.data], [soup.id])
+
+    def test_invalid_ingredients(self):
+        """Test that malformed ingredient ids are rejected"""
+        res = self.client.get(COOKABLE_URL, {'ingredients': '1,x'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
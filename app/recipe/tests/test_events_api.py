@@ -0,0 +1,141 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import events
+from core.models import Tag, Recipe
+
+EVENTS_URL = reverse("recipe:events")
+
+
+def read_events(res):
+    """Return the change events of a finished stream as dicts"""
+    body = b''.join(res.streaming_content).decode()
+    return [
+        json.loads(line[len('data: '):])
+        for line in body.splitlines() if line.startswith('data: ')
+    ]
+
+
+class PublicChangeStreamApiTests(TestCase):
+    """Test the change stream without authentication"""
+
+    def test_login_required(self):
+        """Test that authentication is required to stream changes"""
+        res = APIClient().get(EVENTS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(EVENT_STREAM_MAX_SECONDS=0)
+class PrivateChangeStreamApiTests(TestCase):
+    """Test streaming the user's changes"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_stream_headers(self):
+        """Test that the stream is sent unbuffered as text/event-stream"""
+        res = self.client.get(EVENTS_URL, HTTP_ACCEPT='text/event-stream')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        self.assertEqual(res['Content-Type'], 'text/event-stream')
+        self.assertEqual(res['Cache-Control'], 'no-cache')
+        self.assertEqual(res['X-Accel-Buffering'], 'no')
+        self.assertEqual(read_events(res), [])
+
+    def test_resume_after_last_event_id(self):
+        """Test that changes after Last-Event-ID are replayed in order"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        seen = self.user.__class__.objects.get(pk=self.user.pk).change_seq
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=1.00
+        )
+        tag_id = tag.id
+        tag.delete()
+        other = get_user_model().objects.create_user('o@o2.pl', 'pass')
+        Tag.objects.create(user=other, name='Fruity')
+
+        res = self.client.get(EVENTS_URL, HTTP_LAST_EVENT_ID=str(seen))
+
+        self.assertEqual(
+            [(e['kind'], e['action'], e['id']) for e in read_events(res)],
+            [('recipe', 'updated', recipe.id), ('tag', 'deleted', tag_id)]
+        )
+
+    @override_settings(EVENT_MAX_STREAMS=1, EVENT_RETRY_MILLISECONDS=5000)
+    def test_open_streams_capped(self):
+        """Test that streams past the process limit are told to retry"""
+        first = self.client.get(EVENTS_URL)
+
+        res = self.client.get(EVENTS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res['Retry-After'], '5')
+
+        first.close()
+        res = self.client.get(EVENTS_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res.close()
+
+    def test_invalid_last_event_id(self):
+        """Test that a non-integer Last-Event-ID is rejected"""
+        res = self.client.get(EVENTS_URL, {'last_event_id': 'x'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ChangePublishingTests(TransactionTestCase):
+    """Test that committed writes reach change stream subscribers"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+        self.subscription = events.broker.subscribe(self.user.pk)
+        self.addCleanup(self.subscription.close)
+
+    def drain(self):
+        """Return the events delivered to the subscription so far"""
+        received = []
+        event = self.subscription.get(0)
+        while event is not None:
+            received.append((event.kind, event.action, event.id))
+            event = self.subscription.get(0)
+        return received
+
+    def test_writes_published(self):
+        """Test that creating, relating and deleting objects is published"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=1.00
+        )
+        recipe.tags.add(tag)
+        tag_id = tag.id
+        tag.delete()
+
+        self.assertEqual(self.drain(), [
+            ('tag', 'created', tag_id),
+            ('recipe', 'created', recipe.id),
+            ('recipe', 'updated', recipe.id),
+            ('recipe', 'updated', recipe.id),
+            ('tag', 'deleted', tag_id),
+        ])
+
+    def test_other_users_not_published(self):
+        """Test that subscribers only receive their own user's changes"""
+        other = get_user_model().objects.create_user('o@o2.pl', 'pass')
+        Tag.objects.create(user=other, name='Fruity')
+
+        self.assertEqual(self.drain(), [])
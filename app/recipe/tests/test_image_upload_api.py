@@ -0,0 +1,178 @@
+import os
+from datetime import timedelta
+from io import BytesIO
+
+from PIL import Image
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, ImageUpload
+
+
+def start_url(recipe_id):
+    """Return the url starting a resumable image upload"""
+    return reverse('recipe:recipe-start-image-upload', args=[recipe_id])
+
+
+def upload_url(recipe_id, upload_id):
+    """Return the url of a resumable image upload"""
+    return reverse(
+        'recipe:recipe-image-upload', args=[recipe_id, upload_id]
+    )
+
+
+def finish_url(recipe_id, upload_id):
+    """Return the url finishing a resumable image upload"""
+    return reverse(
+        'recipe:recipe-finish-image-upload', args=[recipe_id, upload_id]
+    )
+
+
+def sample_image():
+    """Return the bytes of a small JPEG image"""
+    data = BytesIO()
+    Image.new('RGB', (10, 10)).save(data, format='JPEG')
+    return data.getvalue()
+
+
+class ImageUploadApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=10, price=5
+        )
+
+    def _start(self, size):
+        return self.client.post(
+            start_url(self.recipe.id), {'size': size}, format='json'
+        )
+
+    def _send(self, upload_id, offset, chunk):
+        return self.client.patch(
+            upload_url(self.recipe.id, upload_id), chunk,
+            content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def test_upload_in_chunks(self):
+        """Test that an image sent in chunks is attached to the recipe"""
+        image = sample_image()
+        res = self._start(len(image))
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        upload_id = res.data['id']
+        self.assertEqual(res.data['offset'], 0)
+
+        half = len(image) // 2
+        res = self._send(upload_id, 0, image[:half])
+        self.assertEqual(res.data['offset'], half)
+        res = self.client.get(upload_url(self.recipe.id, upload_id))
+        self.assertEqual(res.data['offset'], half)
+        self._send(upload_id, half, image[half:])
+
+        res = self.client.post(finish_url(self.recipe.id, upload_id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK, res.data)
+        self.recipe.refresh_from_db()
+        self.assertTrue(self.recipe.image.name.endswith('.jpg'))
+        stored = Image.open(default_storage.open(self.recipe.image.name))
+        self.assertEqual((stored.format, stored.size), ('JPEG', (10, 10)))
+        self.assertFalse(ImageUpload.objects.exists())
+        self.recipe.image.delete()
+
+    def test_chunk_at_wrong_offset(self):
+        """Test that a chunk not starting at the offset is refused"""
+        upload_id = self._start(100).data['id']
+        self._send(upload_id, 0, b'x' * 10)
+
+        res = self._send(upload_id, 5, b'x' * 10)
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data['offset'], 10)
+
+    def test_chunk_past_size(self):
+        """Test that a chunk going past the declared size is refused"""
+        upload_id = self._start(10).data['id']
+        self._send(upload_id, 0, b'x' * 5)
+
+        res = self._send(upload_id, 5, b'x' * 6)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        upload = ImageUpload.objects.get()
+        self.assertEqual(upload.offset, 5)
+        self.assertEqual(os.path.getsize(upload.path), 5)
+
+    def test_finish_incomplete_upload(self):
+        """Test that an upload missing bytes cannot be finished"""
+        upload_id = self._start(10).data['id']
+        self._send(upload_id, 0, b'x' * 5)
+
+        res = self.client.post(finish_url(self.recipe.id, upload_id))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(ImageUpload.objects.exists())
+
+    def test_finish_invalid_image(self):
+        """Test that bytes which are not an image are refused and dropped"""
+        upload_id = self._start(5).data['id']
+        self._send(upload_id, 0, b'x' * 5)
+
+        res = self.client.post(finish_url(self.recipe.id, upload_id))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ImageUpload.objects.exists())
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    @override_settings(UPLOAD_MAX_BYTES=100)
+    def test_upload_too_large(self):
+        """Test that uploads larger than the limit are refused"""
+        res = self._start(101)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(UPLOAD_QUOTA_BYTES=100)
+    def test_upload_quota(self):
+        """Test that unfinished uploads count against the user's quota"""
+        self.assertEqual(self._start(60).status_code,
+                         status.HTTP_201_CREATED)
+
+        res = self._start(60)
+
+        self.assertEqual(res.status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        ImageUpload.objects.update(expires_at=timezone.now())
+        self.assertEqual(self._start(60).status_code,
+                         status.HTTP_201_CREATED)
+
+    def test_expired_upload(self):
+        """Test that an expired upload can no longer take chunks"""
+        upload_id = self._start(10).data['id']
+        ImageUpload.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+        res = self._send(upload_id, 0, b'x')
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_upload_of_other_user(self):
+        """Test that uploads of another user's recipe are not found"""
+        other = get_user_model().objects.create_user('other@o2.pl', 'pass')
+        recipe = Recipe.objects.create(
+            user=other, title='Other', time_minutes=1, price=1
+        )
+
+        res = self.client.post(start_url(recipe.id), {'size': 10})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
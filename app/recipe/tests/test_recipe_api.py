@@ -1,12 +1,17 @@
 import tempfile
-import os
+from unittest.mock import patch
+from io import BytesIO
 from PIL import Image
-from django.test import TestCase
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 from django.contrib.auth import get_user_model
-from core.models import Recipe, Tag, Ingredient
+from core.coalescing import SingleFlight
+from core.models import Recipe, Tag, Ingredient, ImageBlob, Tombstone
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
 
 
@@ -88,6 +93,20 @@ class PrivateRecipeAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)
 
+    def test_retrieve_recipe_list_coalesced(self):
+        """Test that coalesced lists reflect writes made between them"""
+        sample_recipe(user=self.user)
+        flight = SingleFlight('test')
+
+        with patch('core.coalescing.recipe_lists', flight):
+            first = self.client.get(RECIPES_URL, {'tags': '', 'a': '1'})
+            sample_recipe(user=self.user, title='Newer')
+            second = self.client.get(RECIPES_URL, {'a': '1', 'tags': ''})
+
+        self.assertEqual(len(first.data), 1)
+        self.assertEqual(len(second.data), 2)
+        self.assertEqual(flight.stats()['leaders'], 2)
+
     def test_limit_recipes_to_user(self):
         """Test that recipes are only created by those user"""
         user2 = get_user_model().objects.\
@@ -179,6 +198,139 @@ class PrivateRecipeAPITests(TestCase):
         self.assertIn(ig2, ingredients)
         self.assertEqual(ingredients.count(), 2)
 
+    def test_create_recipe_with_names(self):
+        """Test that tags and ingredients are found or created by name"""
+        vegan = sample_tag(self.user, name='Vegan')
+        salt = sample_ingredient(self.user, 'Salt')
+        other = get_user_model().objects.create_user('other@o2.pl', 'pass')
+        sample_tag(other, name='Quick')
+        payload = {
+            'title': 'Soup',
+            'time_minutes': 10,
+            'price': 5,
+            'tags': [vegan.id, 'Vegan', 'Quick', 'Quick'],
+            'ingredients': ['Salt', 'Water', 'Leek'],
+        }
+
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(
+            sorted(recipe.tags.values_list('name', flat=True)),
+            ['Quick', 'Vegan']
+        )
+        self.assertEqual(recipe.tags.get(name='Quick').user, self.user)
+        self.assertEqual(
+            sorted(recipe.ingredients.values_list('name', flat=True)),
+            ['Leek', 'Salt', 'Water']
+        )
+        self.assertIn(salt, recipe.ingredients.all())
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(len(set(
+            Ingredient.objects.values_list('change_seq', flat=True)
+        )), 3)
+
+    def test_create_recipe_names_constant_queries(self):
+        """Test that creating by name costs the same for any name count"""
+        def create(names):
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(RECIPES_URL, {
+                    'title': 'Soup', 'time_minutes': 10, 'price': 5,
+                    'tags': names, 'ingredients': names,
+                }, format='json')
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        self.assertEqual(
+            create(['A']), create(['B', 'C', 'D', 'E', 'F'])
+        )
+
+    def test_update_recipe_with_names(self):
+        """Test that names replace the tags of a recipe on update"""
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(sample_tag(self.user, name='Old'))
+
+        res = self.client.patch(
+            detail_url(recipe.id), {'tags': ['New']}, format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(recipe.tags.values_list('name', flat=True)), ['New']
+        )
+
+    def test_update_recipe_tags_only_skips_recipe_columns(self):
+        """Test that changing only tags leaves the recipe columns alone"""
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(sample_tag(self.user, name='Old'))
+        new = sample_tag(self.user, name='New')
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.patch(detail_url(recipe.id), {
+                'title': recipe.title, 'tags': [new.pk],
+            }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        updates = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('UPDATE "core_recipe"')
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"title"', updates[0])
+        self.assertEqual(list(recipe.tags.all()), [new])
+
+    def test_update_recipe_unchanged_writes_nothing(self):
+        """Test that an update repeating the current values writes no rows"""
+        recipe = sample_recipe(user=self.user)
+        tag = sample_tag(self.user)
+        recipe.tags.add(tag)
+        recipe.refresh_from_db()
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.patch(detail_url(recipe.id), {
+                'title': recipe.title, 'tags': [tag.pk], 'ingredients': [],
+            }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse([
+            query['sql'] for query in queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+        ])
+        self.assertEqual(
+            Recipe.objects.get(pk=recipe.pk).change_seq, recipe.change_seq
+        )
+
+    def test_create_recipe_with_invalid_name(self):
+        """Test that blank or too long names are rejected"""
+        for name in ('  ', 'x' * 256):
+            res = self.client.post(RECIPES_URL, {
+                'title': 'Soup', 'time_minutes': 10, 'price': 5,
+                'tags': [name],
+            }, format='json')
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_create_recipe_with_numeric_name(self):
+        """Test that names made of digits are given as name objects"""
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Soup', 'time_minutes': 10, 'price': 5,
+            'tags': [{'name': '1984'}],
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(
+            list(recipe.tags.values_list('name', flat=True)), ['1984']
+        )
+
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Soup', 'time_minutes': 10, 'price': 5,
+            'tags': [{'id': 1}],
+        }, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_partial_update_with_recipe(self):
         """Test updating a recipe with patch"""
         recipe = sample_recipe(user=self.user)
@@ -220,6 +372,137 @@ class PrivateRecipeAPITests(TestCase):
         tags = recipe.tags.all()
         self.assertEqual(len(tags), 0)
 
+    def test_delete_recipe(self):
+        """Test deleting a recipe with its relations"""
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(sample_tag(self.user))
+
+        res = self.client.delete(detail_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Recipe.objects.filter(pk=recipe.pk).exists())
+        self.assertFalse(Recipe.tags.through.objects.exists())
+        self.assertTrue(
+            Tombstone.objects.filter(kind='recipe', object_id=recipe.pk)
+        )
+
+    def test_delete_missing_recipe(self):
+        """Test deleting an unknown recipe returns 404"""
+        res = self.client.delete(detail_url(999))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_batch_retrieve_recipes(self):
+        """Test retrieving several recipes in request order"""
+        first = sample_recipe(user=self.user, title='First')
+        second = sample_recipe(user=self.user, title='Second')
+        second.tags.add(sample_tag(self.user))
+        other_user = get_user_model().objects.create_user(
+            'other@o2.pl', 'pass123'
+        )
+        foreign = sample_recipe(user=other_user)
+
+        ids = f'{second.id},999,{foreign.id},{first.id}'
+        res = self.client.get(RECIPES_URL, {'ids': ids})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['id'], item['status']) for item in res.data],
+            [(second.id, 200), (999, 404), (foreign.id, 403), (first.id, 200)]
+        )
+        self.assertEqual(
+            res.data[0]['recipe'], RecipeDetailSerializer(second).data
+        )
+
+    def test_batch_retrieve_constant_queries(self):
+        """Test that batch retrieve queries do not grow with the batch"""
+        recipes = [sample_recipe(user=self.user) for _ in range(5)]
+        for i, recipe in enumerate(recipes):
+            recipe.tags.add(sample_tag(self.user, name=f'Tag {i}'))
+        ids = ','.join(str(recipe.id) for recipe in recipes)
+
+        with self.assertNumQueries(4):
+            self.client.get(RECIPES_URL, {'ids': ids})
+
+    def test_batch_retrieve_limited(self):
+        """Test that too many ids are rejected"""
+        ids = ','.join(str(n) for n in range(1, 200))
+
+        res = self.client.get(RECIPES_URL, {'ids': ids})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_id_lists_rejected(self):
+        """Test that malformed id lists are a bad request, not an error"""
+        for params in ({'ids': '1,a'}, {'tags': 'x'}, {'ingredients': '1,'}):
+            res = self.client.get(RECIPES_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+def sample_image(color='red'):
+    """Return an in-memory JPEG image file"""
+    buffer = BytesIO()
+    Image.new("RGB", (10, 10), color).save(buffer, format='JPEG')
+    buffer.seek(0)
+    buffer.name = 'photo.png'
+
+    return buffer
+
+
+class RecipeImageStorageTests(TransactionTestCase):
+    """Test content-addressed storage of recipe images"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@londonappdev.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    def upload(self, recipe, image):
+        """Upload an image to a recipe and return the stored name"""
+        res = self.client.post(
+            image_upload_url(recipe.id), {'image': image}, format='multipart'
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipe.refresh_from_db()
+
+        return recipe.image.name
+
+    def test_identical_images_stored_once(self):
+        """Test that equal uploads share one file with the real extension"""
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+
+        name1 = self.upload(recipe1, sample_image())
+        name2 = self.upload(recipe2, sample_image())
+
+        self.assertEqual(name1, name2)
+        self.assertTrue(name1.endswith('.jpg'))
+        self.assertEqual(ImageBlob.objects.get(name=name1).ref_count, 2)
+        recipe1.delete()
+        recipe2.delete()
+
+    def test_unreferenced_images_removed(self):
+        """Test that replaced and deleted images are garbage collected"""
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        shared = self.upload(recipe1, sample_image())
+        self.upload(recipe2, sample_image())
+
+        replacement = self.upload(recipe1, sample_image('blue'))
+        self.assertTrue(default_storage.exists(shared))
+        self.assertEqual(ImageBlob.objects.get(name=shared).ref_count, 1)
+
+        recipe2.delete()
+        self.assertFalse(default_storage.exists(shared))
+        self.assertFalse(ImageBlob.objects.filter(name=shared).exists())
+
+        recipe1.delete()
+        self.assertFalse(default_storage.exists(replacement))
+
 
 class RecipeImageUploadTests(TestCase):
 
@@ -247,7 +530,7 @@ class RecipeImageUploadTests(TestCase):
         self.recipe.refresh_from_db()
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertIn('image', res.data)
-        self.assertTrue(os.path.exists(self.recipe.image.path))
+        self.assertTrue(default_storage.exists(self.recipe.image.name))
 
     def test_upload_image_bad_request(self):
         """Test uploading an invalid iamge"""
@@ -304,3 +587,33 @@ class RecipeImageUploadTests(TestCase):
         self.assertIn(serializer1.data, res.data)
         self.assertIn(serializer2.data, res.data)
         self.assertNotIn(serializer3.data, res.data)
+
+
+class SimilarRecipeApiTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_similar_recipes(self):
+        """Test listing recipes sharing tags and ingredients"""
+        tag = sample_tag(self.user)
+        salt = sample_ingredient(self.user, 'Salt')
+        recipe = sample_recipe(self.user)
+        twin = sample_recipe(self.user, title='Twin')
+        other = sample_recipe(self.user, title='Other')
+        for item in (recipe, twin):
+            item.tags.add(tag)
+            item.ingredients.add(salt)
+        other.ingredients.add(sample_ingredient(self.user, 'Sugar'))
+
+        url = reverse('recipe:recipe-similar', args=[recipe.id])
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['recipe']['id'] for r in res.data], [twin.id])
+        self.assertEqual(res.data[0]['similarity'], 1.0)
@@ -0,0 +1,157 @@
+from decimal import Decimal
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Tag, Ingredient, Recipe, RecipeStats
+
+
+STATS_URL = reverse("recipe:recipe-stats")
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'Default Title',
+        'time_minutes': 10,
+        'price': Decimal('10.00')
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PrivateRecipeStatsApiTests(TestCase):
+    """Test the recipe statistics API"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_stats_login_required(self):
+        """Test that login is required for stats"""
+        res = APIClient().get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_stats_empty(self):
+        """Test stats for a user without recipes"""
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['recipe_count'], 0)
+        self.assertIsNone(res.data['average_price'])
+        self.assertIsNone(res.data['average_time_minutes'])
+
+    def test_stats_aggregates(self):
+        """Test averages, tag counts and top ingredients"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        Tag.objects.create(user=self.user, name='Unused')
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        Ingredient.objects.create(user=self.user, name='Pepper')
+        r1 = sample_recipe(self.user, price=Decimal('4.00'), time_minutes=10)
+        r2 = sample_recipe(self.user, price=Decimal('8.00'), time_minutes=30)
+        r1.tags.add(vegan)
+        r2.tags.add(vegan)
+        r1.ingredients.add(salt)
+        sample_recipe(
+            get_user_model().objects.create_user('other@o2.pl', 'pass123'),
+            price=Decimal('100.00')
+        )
+
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['recipe_count'], 2)
+        self.assertEqual(res.data['average_price'], '6.00')
+        self.assertEqual(res.data['average_time_minutes'], 20)
+        self.assertEqual(
+            [(t['name'], t['recipe_count']) for t in res.data['tags']],
+            [('Vegan', 2), ('Unused', 0)]
+        )
+        self.assertEqual(
+            [(i['name'], i['recipe_count'])
+             for i in res.data['top_ingredients']],
+            [('Salt', 1)]
+        )
+
+    def test_stats_respects_filters(self):
+        """Test that recipe filters narrow the averages"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = sample_recipe(self.user, price=Decimal('2.00'))
+        recipe.tags.add(vegan)
+        sample_recipe(self.user, price=Decimal('20.00'))
+
+        res = self.client.get(STATS_URL, {'tags': f'{vegan.id}'})
+
+        self.assertEqual(res.data['recipe_count'], 1)
+        self.assertEqual(res.data['average_price'], '2.00')
+
+    def test_stats_invalid_top(self):
+        """Test that a non-integer top param is rejected"""
+        res = self.client.get(STATS_URL, {'top': 'many'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(RECIPE_STATS_ROLLUP=True)
+class RecipeStatsRollupTests(TestCase):
+    """Test the incrementally maintained stats rollup"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+
+    def test_rollup_tracks_writes(self):
+        """Test that creates, updates and deletes adjust the rollup"""
+        recipe = sample_recipe(self.user, price=Decimal('4.00'))
+        sample_recipe(self.user, price=Decimal('6.00'), time_minutes=20)
+
+        recipe = Recipe.objects.get(id=recipe.id)
+        recipe.price = Decimal('5.00')
+        recipe.save()
+
+        stats = RecipeStats.objects.get(user=self.user)
+        self.assertEqual(stats.recipe_count, 2)
+        self.assertEqual(stats.price_total, Decimal('11.00'))
+        self.assertEqual(stats.time_minutes_total, 30)
+
+        recipe.delete()
+        stats.refresh_from_db()
+        self.assertEqual(stats.recipe_count, 1)
+        self.assertEqual(stats.price_total, Decimal('6.00'))
+
+    def test_rollup_survives_stale_instances(self):
+        """Test that edits through copies loaded earlier keep totals right"""
+        recipe = sample_recipe(self.user, price=Decimal('4.00'))
+        first = Recipe.objects.get(id=recipe.id)
+        second = Recipe.objects.get(id=recipe.id)
+
+        first.price, first.time_minutes = Decimal('5.00'), 15
+        first.save()
+        second.price, second.time_minutes = Decimal('7.00'), 20
+        second.save()
+
+        stats = RecipeStats.objects.get(user=self.user)
+        self.assertEqual(stats.price_total, Decimal('7.00'))
+        self.assertEqual(stats.time_minutes_total, 20)
+
+    def test_stats_read_from_rollup(self):
+        """Test that the endpoint serves averages from the rollup"""
+        sample_recipe(self.user, price=Decimal('4.00'))
+        RecipeStats.objects.filter(user=self.user).update(
+            price_total=Decimal('7.00')
+        )
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        res = client.get(STATS_URL)
+
+        self.assertEqual(res.data['recipe_count'], 1)
+        self.assertEqual(res.data['average_price'], '7.00')
@@ -0,0 +1,101 @@
+import msgpack
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Recipe
+from recipe.renderers import CompactJSONRenderer
+
+
+RECIPES_URL = reverse("recipe:recipe-list")
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'Default Title',
+        'time_minutes': 10,
+        'price': 10.50
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeRendererTests(TestCase):
+    """Test alternative response formats for recipe endpoints"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_msgpack_negotiated(self):
+        """Test that recipes can be requested as MessagePack"""
+        recipe = sample_recipe(user=self.user)
+
+        res = self.client.get(RECIPES_URL, HTTP_ACCEPT='application/msgpack')
+        data = msgpack.unpackb(res.content, raw=False)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/msgpack')
+        self.assertEqual(data[0]['id'], recipe.id)
+        self.assertEqual(data[0]['price'], 10.5)
+
+    def test_compact_layout(self):
+        """Test that the compact format sends field names once"""
+        sample_recipe(user=self.user, title='First')
+        sample_recipe(user=self.user, title='Second')
+
+        res = self.client.get(RECIPES_URL, {'format': 'compact'})
+        data = res.json()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            data['fields'],
+            ['id', 'title', 'time_minutes', 'price', 'link',
+             'ingredients', 'tags']
+        )
+        self.assertEqual([row[1] for row in data['rows']],
+                         ['Second', 'First'])
+        self.assertEqual(data['rows'][0][3], 10.5)
+
+    def test_compact_batch_retrieve(self):
+        """Test that found and missing ids share the compact columns"""
+        recipe = sample_recipe(user=self.user)
+
+        res = self.client.get(
+            RECIPES_URL, {'ids': f'{recipe.id},99999', 'format': 'compact'}
+        )
+        data = res.json()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(data['fields'], ['id', 'status', 'recipe', 'detail'])
+        self.assertEqual(data['rows'][0][2]['title'], recipe.title)
+        self.assertEqual(data['rows'][1], [99999, 404, None, 'Not found.'])
+
+    def test_compact_rows_with_different_keys(self):
+        """Test that keys missing from some objects render as null"""
+        body = CompactJSONRenderer().render([{'a': 1}, {'b': 2}])
+
+        self.assertEqual(
+            body, b'{"fields":["a","b"],"rows":[[1,null],[null,2]]}'
+        )
+
+    def test_json_keeps_decimal_strings(self):
+        """Test that the default JSON format is unchanged"""
+        sample_recipe(user=self.user)
+
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.json()[0]['price'], '10.50')
+
+    def test_compact_leaves_objects_alone(self):
+        """Test that non-list payloads render as plain JSON"""
+        body = CompactJSONRenderer().render({'detail': 'Not found.'})
+
+        self.assertEqual(body, b'{"detail":"Not found."}')
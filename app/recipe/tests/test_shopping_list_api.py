@@ -0,0 +1,82 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Ingredient, Recipe
+
+
+SHOPPING_LIST_URL = reverse('recipe:recipe-shopping-list')
+
+
+class ShoppingListApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.salt = Ingredient.objects.create(user=self.user, name='Salt')
+        self.eggs = Ingredient.objects.create(user=self.user, name='Eggs')
+
+    def recipe(self, price, *ingredients):
+        """Create a recipe using the given ingredients"""
+        recipe = Recipe.objects.create(
+            user=self.user, title='Recipe', time_minutes=5, price=price
+        )
+        recipe.ingredients.add(*ingredients)
+        return recipe
+
+    def post(self, items):
+        return self.client.post(
+            SHOPPING_LIST_URL, {'recipes': items}, format='json'
+        )
+
+    def test_shopping_list(self):
+        """Test merging the ingredients of several recipes"""
+        omelette = self.recipe(4, self.eggs, self.salt)
+        soup = self.recipe(6, self.salt)
+
+        with self.assertNumQueries(3):
+            res = self.post([
+                {'recipe': omelette.id, 'servings': 2},
+                {'recipe': soup.id},
+            ])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['recipe_count'], 2)
+        self.assertEqual(res.data['total_price'], '14.00')
+        eggs, salt = res.data['ingredients']
+        self.assertEqual(eggs['recipes'], [omelette.id])
+        self.assertEqual(eggs['servings'], 2)
+        self.assertEqual(salt['recipe_count'], 2)
+        self.assertEqual(salt['recipes'], [omelette.id, soup.id])
+        self.assertEqual(salt['servings'], 3)
+
+    def test_repeated_plan_cached(self):
+        """Test that an unchanged plan is served from the cache"""
+        recipe = self.recipe(4, self.salt)
+        self.post([{'recipe': recipe.id}])
+
+        with self.assertNumQueries(1):
+            self.post([{'recipe': recipe.id}])
+
+        recipe.ingredients.add(self.eggs)
+        res = self.post([{'recipe': recipe.id}])
+
+        self.assertEqual(len(res.data['ingredients']), 2)
+
+    def test_other_users_recipes_rejected(self):
+        """Test that recipes of other users cannot be planned"""
+        other = get_user_model().objects.create_user('x@o2.pl', 'pass123')
+        recipe = Recipe.objects.create(
+            user=other, title='Recipe', time_minutes=5, price=5
+        )
+
+        res = self.post([{'recipe': recipe.id}])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
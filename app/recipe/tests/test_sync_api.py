@@ -0,0 +1,152 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Tag, Ingredient, Recipe, Tombstone
+
+
+SYNC_URL = reverse("recipe:sync")
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'Default Title',
+        'time_minutes': 10,
+        'price': 10.00
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PublicSyncApiTests(TestCase):
+    """Test publicly available sync API"""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_login_required(self):
+        """Test that login is required for syncing"""
+        res = self.client.get(SYNC_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateSyncApiTests(TestCase):
+    """Test the authorized user sync API"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@o2.pl',
+            'haslo123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_full_sync_returns_everything(self):
+        """Test syncing from zero returns all user objects"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        Ingredient.objects.create(user=self.user, name='Salt')
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(tag)
+
+        res = self.client.get(SYNC_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['recipes']), 1)
+        self.assertEqual(res.data['recipes'][0]['tags'], [tag.id])
+        self.assertEqual(len(res.data['tags']), 1)
+        self.assertEqual(len(res.data['ingredients']), 1)
+        self.assertGreater(res.data['cursor'], 0)
+
+    def test_sync_returns_only_changes_since_cursor(self):
+        """Test that only objects changed after the cursor are returned"""
+        Tag.objects.create(user=self.user, name='Old')
+        recipe = sample_recipe(user=self.user)
+        cursor = self.client.get(SYNC_URL).data['cursor']
+
+        new_tag = Tag.objects.create(user=self.user, name='New')
+        recipe.title = 'Changed'
+        recipe.save()
+
+        res = self.client.get(SYNC_URL, {'since': cursor})
+
+        self.assertEqual([t['id'] for t in res.data['tags']], [new_tag.id])
+        self.assertEqual(res.data['recipes'][0]['title'], 'Changed')
+        self.assertEqual(res.data['ingredients'], [])
+        self.assertGreater(res.data['cursor'], cursor)
+
+    def test_sync_reports_deletions(self):
+        """Test that deleted objects are reported as tombstones"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(tag)
+        cursor = self.client.get(SYNC_URL).data['cursor']
+        tag_id = tag.id
+
+        tag.delete()
+        res = self.client.get(SYNC_URL, {'since': cursor})
+
+        self.assertEqual(res.data['deleted']['tags'], [tag_id])
+        self.assertEqual(res.data['recipes'][0]['id'], recipe.id)
+        self.assertEqual(res.data['recipes'][0]['tags'], [])
+
+    def test_sync_limited_to_user(self):
+        """Test that other users changes are not returned"""
+        user2 = get_user_model().objects.create_user(
+            'other@o2.pl',
+            'testpass'
+        )
+        sample_recipe(user=user2)
+        Tag.objects.create(user=user2, name='Fruity').delete()
+
+        res = self.client.get(SYNC_URL)
+
+        self.assertEqual(res.data['recipes'], [])
+        self.assertEqual(res.data['deleted']['tags'], [])
+        self.assertEqual(res.data['cursor'], 0)
+
+    def test_sync_invalid_cursor(self):
+        """Test that a non-integer cursor is rejected"""
+        res = self.client.get(SYNC_URL, {'since': 'abc'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(TOMBSTONE_RETENTION_DAYS=30)
+    def test_cursor_older_than_pruned_tombstones(self):
+        """Test that clients behind pruned deletions must sync again"""
+        old_cursor = self.client.get(SYNC_URL).data['cursor']
+        Tag.objects.create(user=self.user, name='Vegan').delete()
+        Tombstone.objects.update(
+            created_at=timezone.now() - timedelta(days=31)
+        )
+        cursor = self.client.get(SYNC_URL).data['cursor']
+        Tag.objects.create(user=self.user, name='Quick').delete()
+
+        call_command('prune_tombstones', stdout=StringIO())
+
+        self.assertEqual(Tombstone.objects.count(), 1)
+        res = self.client.get(SYNC_URL, {'since': old_cursor + 1})
+        self.assertEqual(res.status_code, status.HTTP_410_GONE)
+        self.assertEqual(res.data['detail'].code, 'resync_required')
+        res = self.client.get(SYNC_URL, {'since': cursor})
+        self.assertEqual(len(res.data['deleted']['tags']), 1)
+        res = self.client.get(SYNC_URL, {'since': 0})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_deleting_user_purges_tombstones(self):
+        """Test that cascading a user delete leaves no tombstones behind"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        sample_recipe(user=self.user)
+
+        self.user.delete()
+
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(Tombstone.objects.exists())
@@ -1,3 +1,5 @@
+from unittest import mock
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
@@ -83,6 +85,31 @@ class PrivateTagsApiTests(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_tag_create_duplicate_name(self):
+        """Test that a user cannot create two tags with one name"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        other = get_user_model().objects.create_user('other@o2.pl', 'pass')
+        Tag.objects.create(user=other, name='Fruity')
+
+        res = self.client.post(TAGS_URL, {'name': 'Vegan'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.post(TAGS_URL, {'name': 'Fruity'})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_tag_name_taken_after_check(self):
+        """Test that a name taken by a concurrent request is a 400"""
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        # The other request creates the tag after this one checked the name
+        with mock.patch.object(TagSerializer, 'validate_name',
+                               lambda self, value: value):
+            res = self.client.post(TAGS_URL, {'name': 'Vegan'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('name', res.data)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
     def test_retrieve_tags_asigned_to_recipes(self):
         """Test filtering tags bt those asigned to recipes"""
         tag1 = Tag.objects.create(user=self.user, name='Breakfast')
@@ -103,3 +130,53 @@ class PrivateTagsApiTests(TestCase):
 
         self.assertIn(serializer1.data, res.data)
         self.assertNotIn(serializer2.data, res.data)
+
+    def test_delete_tag(self):
+        """Test deleting a tag marks its recipes as changed"""
+        tag = Tag.objects.create(user=self.user, name='Breakfast')
+        recipe = Recipe.objects.create(
+            title='Eggs on toast',
+            time_minutes=10,
+            price=5,
+            user=self.user
+        )
+        recipe.tags.add(tag)
+        recipe.refresh_from_db()
+
+        res = self.client.delete(reverse('recipe:tag-detail', args=[tag.id]))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Tag.objects.filter(pk=tag.pk).exists())
+        changed = Recipe.objects.get(pk=recipe.pk)
+        self.assertGreater(changed.change_seq, recipe.change_seq)
+        self.assertEqual(changed.tags.count(), 0)
+
+    def test_delete_other_users_tag(self):
+        """Test that tags of other users cannot be deleted"""
+        user2 = get_user_model().objects.create_user(
+            'other@o2.pl',
+            'testpass'
+        )
+        tag = Tag.objects.create(user=user2, name='Fruity')
+
+        res = self.client.delete(reverse('recipe:tag-detail', args=[tag.id]))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(Tag.objects.filter(pk=tag.pk).exists())
+
+    def test_bulk_delete_tags(self):
+        """Test deleting several tags at once"""
+        tags = [
+            Tag.objects.create(user=self.user, name=name)
+            for name in ('Breakfast', 'Lunch', 'Dinner')
+        ]
+
+        res = self.client.post(
+            reverse('recipe:tag-bulk-delete'),
+            {'ids': [tags[0].id, tags[1].id]},
+            format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'deleted': 2})
+        self.assertEqual(list(Tag.objects.all()), [tags[2]])
@@ -11,4 +11,6 @@ app_name = "recipe"
 
 urlpatterns = [
     path("", include(router.urls)),
+    path("sync/", views.SyncView.as_view(), name="sync"),
+    path("events/", views.ChangeStreamView.as_view(), name="events"),
 ]